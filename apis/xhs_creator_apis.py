@@ -1,12 +1,13 @@
-import requests
 from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.http_util import Session_Pool, default_session_pool
 from xhs_utils.xhs_creator_util import get_common_headers, generate_xs
 from xhs_utils.xhs_util import generate_x_b3_traceid
 
 
 class XHS_Creator_Apis():
-    def __init__(self):
+    def __init__(self, session_pool: Session_Pool = None):
         self.base_url = "https://creator.xiaohongshu.com"
+        self.http = session_pool or default_session_pool
 
 
     # page: 页数
@@ -27,7 +28,7 @@ class XHS_Creator_Apis():
             }
             if page:
                 params["page"] = str(page)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, params=params)
+            response = self.http.get(self.base_url + api, headers=headers, cookies=cookies, params=params)
             res_json = response.json()
             success = res_json["success"]
         except Exception as e:
@@ -1,9 +1,15 @@
 # encoding: utf-8
 import json
 import re
+import time
 import urllib
-import requests
-from xhs_utils.xhs_util import splice_str, generate_request_params, generate_x_b3_traceid, get_common_headers
+from concurrent.futures import ThreadPoolExecutor
+from xhs_utils.xhs_util import splice_str, generate_request_params, generate_request_params_batch, generate_x_b3_traceid, get_common_headers
+from xhs_utils.data_util import get_img_id
+from xhs_utils.http_util import Session_Pool, default_session_pool
+from xhs_utils.cache_util import Response_Cache
+from xhs_utils.rate_limit_util import Rate_Limiter
+from xhs_utils.trace_util import tracer
 from loguru import logger
 
 """
@@ -11,8 +17,54 @@ from loguru import logger
     :param cookies_str: 你的cookies
 """
 class XHS_Apis():
-    def __init__(self):
+    # Data_Spider 通过账号池调用的接口对应的请求路径, 账号池按接口的限速预算选择账号
+    ENDPOINTS = {
+        'get_note_info': '/api/sns/web/v1/feed',
+        'get_some_note_info': '/api/sns/web/v1/feed',
+        'iter_user_notes': '/api/sns/web/v1/user_posted',
+        'iter_search_notes': '/api/sns/web/v1/search/notes',
+        'iter_note_out_comments': '/api/sns/web/v2/comment/page',
+        'iter_note_inner_comments': '/api/sns/web/v2/comment/sub/page',
+        'get_note_all_comment': '/api/sns/web/v2/comment/page',
+    }
+
+    def __init__(self, session_pool: Session_Pool = None, cache: Response_Cache = None, throttle_retries: int = 3, throttle_backoff: float = 5):
+        """
+            :param session_pool: http 会话池, 按账号和代理复用连接, 默认使用全局共享的会话池
+            :param cache: 响应缓存, 传入时笔记详细, 用户信息和无水印视频地址会优先从缓存读取
+            :param throttle_retries: 被限流时重新签名并重试的次数
+            :param throttle_backoff: 会话池没有限速器时, 第一次重试前等待的秒数, 之后每次翻倍
+            所有接口的 proxies 参数可以传入代理 dict, 也可以传入 Proxy_Pool
+        """
         self.base_url = "https://edith.xiaohongshu.com"
+        self.http = session_pool or default_session_pool
+        self.cache = cache
+        self.throttle_retries = throttle_retries
+        self.throttle_backoff = throttle_backoff
+
+    def request(self, api: str, cookies_str: str, data=None, proxies=None, params=None):
+        """
+            签名并发送请求, data 为 None 时为 GET 请求, api 需要包含拼接好的参数
+            被限流时等待暂停结束后重新签名并重试, 最多重试 throttle_retries 次
+            :param params: 已经生成的 (headers, cookies, data), 只用于第一次请求
+            返回 response
+        """
+        for attempt in range(self.throttle_retries + 1):
+            if params is None or attempt > 0:
+                params = generate_request_params(cookies_str, api, data if data is not None else '')
+            headers, cookies, trans_data = params
+            if data is None:
+                response = self.http.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            else:
+                response = self.http.post(self.base_url + api, headers=headers, data=trans_data.encode('utf-8'), cookies=cookies, proxies=proxies)
+            if attempt == self.throttle_retries or not Rate_Limiter.is_throttled(response):
+                return response
+            # 有限速器时下一次请求会等待限速器的暂停结束, 否则按指数退避等待
+            wait = 0 if getattr(self.http, 'rate_limiter', None) is not None else self.throttle_backoff * 2 ** attempt
+            logger.warning(f'请求 {api.split("?")[0]} 被限流, 重新签名后重试 第 {attempt + 1} 次')
+            if wait > 0:
+                time.sleep(wait)
+        return response
 
     def get_homefeed_all_channel(self, cookies_str: str, proxies: dict = None):
         """
@@ -22,8 +74,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = "/api/sns/web/v1/homefeed/category"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -62,8 +113,7 @@ class XHS_Apis():
                 ],
                 "need_filter_image": False
             }
-            headers, cookies, trans_data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=trans_data, cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, data, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -111,15 +161,19 @@ class XHS_Apis():
         """
         res_json = None
         try:
+            res_json = self.cache.get('user_info', user_id) if self.cache is not None else None
+            if res_json is not None:
+                return True, '成功', res_json
             api = f"/api/sns/web/v1/user/otherinfo"
             params = {
                 "target_user_id": user_id
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
+            if success and self.cache is not None:
+                self.cache.set('user_info', user_id, res_json)
         except Exception as e:
             success = False
             msg = str(e)
@@ -134,8 +188,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = f"/api/sns/web/v1/user/selfinfo"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -153,8 +206,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = f"/api/sns/web/v2/user/me"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -182,8 +234,7 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -192,34 +243,53 @@ class XHS_Apis():
         return success, msg, res_json
 
 
-    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None):
+    def iter_user_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None, stop_note_ids: set = None):
+        """
+           逐页获取用户的笔记
+           :param user_url: 用户主页的url
+           :param cookies_str: 你的cookies
+           :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+           :param stop_note_ids: 增量爬取时传入已经爬取过的笔记id, 遇到其中的笔记(置顶笔记除外)时停止翻页
+           每页返回 (笔记列表, cursor), 请求失败时抛出异常
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
+        while True:
+            success, msg, res_json = self.get_user_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+            if not success:
+                raise Exception(msg)
+            notes = res_json["data"]["notes"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            if stop_note_ids:
+                # 笔记按发布时间倒序, 置顶笔记不按时间排列, 不作为停止的依据
+                stop_index = next((i for i, note in enumerate(notes) if note['note_id'] in stop_note_ids and not note.get('interact_info', {}).get('sticky')), None)
+                if stop_index is not None:
+                    yield [note for note in notes[:stop_index] if note['note_id'] not in stop_note_ids], cursor
+                    break
+            yield notes, cursor
+            if len(notes) == 0 or not res_json["data"]["has_more"]:
+                break
+
+    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None, stop_note_ids: set = None):
         """
            获取用户所有笔记
            :param user_id: 你想要获取的用户的id
            :param cookies_str: 你的cookies
-           返回用户的所有笔记
+           :param stop_note_ids: 增量爬取时传入已经爬取过的笔记id, 遇到其中的笔记(置顶笔记除外)时停止翻页
+           返回用户的所有笔记, 传入 stop_note_ids 时只返回更新的笔记
         """
-        cursor = ''
+        success, msg = True, '成功'
         note_list = []
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for notes, cursor in self.iter_user_notes(user_url, cookies_str, proxies=proxies, stop_note_ids=stop_note_ids):
                 note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
@@ -245,8 +315,7 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -254,6 +323,33 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_like_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取用户喜欢的笔记
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (笔记列表, cursor), 请求失败时抛出异常
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_user"
+        while True:
+            success, msg, res_json = self.get_user_like_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+            if not success:
+                raise Exception(msg)
+            notes = res_json["data"]["notes"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield notes, cursor
+            if len(notes) == 0 or not res_json["data"]["has_more"]:
+                break
+
     def get_user_all_like_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有喜欢笔记
@@ -261,28 +357,11 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             返回用户的所有喜欢笔记
         """
-        cursor = ''
+        success, msg = True, '成功'
         note_list = []
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_user"
-            while True:
-                success, msg, res_json = self.get_user_like_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                      xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for notes, cursor in self.iter_user_like_notes(user_url, cookies_str, proxies=proxies):
                 note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
@@ -308,8 +387,7 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -317,6 +395,33 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_collect_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取用户收藏的笔记
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (笔记列表, cursor), 请求失败时抛出异常
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
+        while True:
+            success, msg, res_json = self.get_user_collect_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+            if not success:
+                raise Exception(msg)
+            notes = res_json["data"]["notes"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield notes, cursor
+            if len(notes) == 0 or not res_json["data"]["has_more"]:
+                break
+
     def get_user_all_collect_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有收藏笔记
@@ -324,28 +429,11 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             返回用户的所有收藏笔记
         """
-        cursor = ''
+        success, msg = True, '成功'
         note_list = []
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_collect_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                         xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for notes, cursor in self.iter_user_collect_notes(user_url, cookies_str, proxies=proxies):
                 note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
@@ -359,30 +447,83 @@ class XHS_Apis():
             :param xsec_source: 你的xsec_source 默认为pc_search pc_user pc_feed
             返回笔记的详细
         """
+        try:
+            api, data = self.get_note_info_request(url)
+            res_json = self.cache.get('note_info', data['source_note_id']) if self.cache is not None else None
+            if res_json is not None:
+                return True, '成功', res_json
+        except Exception as e:
+            return False, str(e), None
+        return self.request_note_info(api, data, cookies_str, proxies)
+
+    @staticmethod
+    def get_note_info_request(url: str):
+        """
+            根据笔记的url生成获取笔记详细的api和请求数据
+            :param url: 笔记的url
+            返回 api 和请求数据
+        """
+        urlParse = urllib.parse.urlparse(url)
+        note_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        api = f"/api/sns/web/v1/feed"
+        data = {
+            "source_note_id": note_id,
+            "image_formats": [
+                "jpg",
+                "webp",
+                "avif"
+            ],
+            "extra": {
+                "need_body_topic": "1"
+            },
+            "xsec_source": kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search",
+            "xsec_token": kvDist['xsec_token']
+        }
+        return api, data
+
+    def get_some_note_info(self, urls: list, cookies_str: str, proxies: dict = None, sign_chunk: int = 8):
+        """
+            批量获取笔记的详细, 缓存中已有的笔记不再请求
+            每 sign_chunk 个请求的签名在一次js调用中生成, 生成后立即发送, 避免请求较多时 x-t 过期
+            :param urls: 你想要获取的笔记的url列表
+            :param cookies_str: 你的cookies
+            返回每个笔记的 (success, msg, res_json), 顺序与 urls 一致
+        """
+        results = [None] * len(urls)
+        items = []
+        for index, url in enumerate(urls):
+            try:
+                api, data = self.get_note_info_request(url)
+                res_json = self.cache.get('note_info', data['source_note_id']) if self.cache is not None else None
+                if res_json is not None:
+                    results[index] = (True, '成功', res_json)
+                    continue
+                items.append((index, api, data))
+            except Exception as e:
+                results[index] = (False, str(e), None)
+        for start in range(0, len(items), max(sign_chunk, 1)):
+            chunk = items[start:start + max(sign_chunk, 1)]
+            try:
+                params_list = generate_request_params_batch(cookies_str, [(api, data) for index, api, data in chunk])
+            except Exception as e:
+                params_list = [e] * len(chunk)
+            for (index, api, note_data), params in zip(chunk, params_list):
+                results[index] = self.request_note_info(api, note_data, cookies_str, proxies, params)
+        return results
+
+    def request_note_info(self, api, note_data, cookies_str, proxies=None, params=None):
+        # params 为批量签名的结果, 签名失败时为异常, 只记录这一个笔记失败
         res_json = None
         try:
-            urlParse = urllib.parse.urlparse(url)
-            note_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            api = f"/api/sns/web/v1/feed"
-            data = {
-                "source_note_id": note_id,
-                "image_formats": [
-                    "jpg",
-                    "webp",
-                    "avif"
-                ],
-                "extra": {
-                    "need_body_topic": "1"
-                },
-                "xsec_source": kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search",
-                "xsec_token": kvDist['xsec_token']
-            }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data, cookies=cookies, proxies=proxies)
+            if isinstance(params, Exception):
+                raise params
+            response = self.request(api, cookies_str, note_data, proxies=proxies, params=params)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
+            if success and self.cache is not None:
+                self.cache.set('note_info', note_data['source_note_id'], res_json)
         except Exception as e:
             success = False
             msg = str(e)
@@ -403,8 +544,7 @@ class XHS_Apis():
                 "keyword": urllib.parse.quote(word)
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -510,8 +650,7 @@ class XHS_Apis():
                     "avif"
                 ]
             }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, data, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -519,6 +658,23 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_notes(self, query: str, cookies_str: str, page=1, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
+        """
+            逐页搜索笔记, 参数与 search_some_note 相同
+            :param page 从指定的页数继续搜索, 为上一次返回的页数
+            每页返回 (笔记列表, 下一页的页数), 请求失败时抛出异常
+        """
+        while True:
+            success, msg, res_json = self.search_note(query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
+            if not success:
+                raise Exception(msg)
+            if "items" not in res_json["data"]:
+                break
+            page += 1
+            yield res_json["data"]["items"], page
+            if not res_json["data"]["has_more"]:
+                break
+
     def search_some_note(self, query: str, require_num: int, cookies_str: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
         """
             指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
@@ -533,19 +689,12 @@ class XHS_Apis():
             :param geo: 定位信息 经纬度
             返回搜索的结果
         """
-        page = 1
+        success, msg = True, '成功'
         note_list = []
         try:
-            while True:
-                success, msg, res_json = self.search_note(query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "items" not in res_json["data"]:
-                    break
-                notes = res_json["data"]["items"]
+            for notes, page in self.iter_search_notes(query, cookies_str, 1, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies):
                 note_list.extend(notes)
-                page += 1
-                if len(note_list) >= require_num or not res_json["data"]["has_more"]:
+                if len(note_list) >= require_num:
                     break
         except Exception as e:
             success = False
@@ -575,8 +724,7 @@ class XHS_Apis():
                     "request_id": "22471139-1723999898524"
                 }
             }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, data, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -584,6 +732,25 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_users(self, query: str, cookies_str: str, page=1, proxies: dict = None):
+        """
+            逐页搜索用户
+            :param query 搜索的关键词
+            :param cookies_str 你的cookies
+            :param page 从指定的页数继续搜索, 为上一次返回的页数
+            每页返回 (用户列表, 下一页的页数), 请求失败时抛出异常
+        """
+        while True:
+            success, msg, res_json = self.search_user(query, cookies_str, page, proxies)
+            if not success:
+                raise Exception(msg)
+            if "users" not in res_json["data"]:
+                break
+            page += 1
+            yield res_json["data"]["users"], page
+            if not res_json["data"]["has_more"]:
+                break
+
     def search_some_user(self, query: str, require_num: int, cookies_str: str, proxies: dict = None):
         """
             指定数量搜索用户
@@ -592,19 +759,12 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回搜索的结果
         """
-        page = 1
+        success, msg = True, '成功'
         user_list = []
         try:
-            while True:
-                success, msg, res_json = self.search_user(query, cookies_str, page, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "users" not in res_json["data"]:
-                    break
-                users = res_json["data"]["users"]
+            for users, page in self.iter_search_users(query, cookies_str, 1, proxies):
                 user_list.extend(users)
-                page += 1
-                if len(user_list) >= require_num or not res_json["data"]["has_more"]:
+                if len(user_list) >= require_num:
                     break
         except Exception as e:
             success = False
@@ -632,8 +792,7 @@ class XHS_Apis():
                 "xsec_token": xsec_token
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -641,28 +800,44 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
-    def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+    def iter_note_out_comments(self, note_id: str, xsec_token: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取笔记的一级评论
+            :param note_id 笔记的id
+            :param cookies_str 你的cookies
+            :param cursor 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (评论列表, cursor), 请求失败时抛出异常
+        """
+        count = 0
+        while True:
+            success, msg, res_json = self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            comments = res_json["data"]["comments"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            count += len(comments)
+            yield comments, cursor
+            if count == 0 or not res_json["data"]["has_more"]:
+                break
+
+    def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None, on_page=None):
         """
             获取笔记的全部一级评论
             :param note_id 笔记的id
             :param cookies_str 你的cookies
+            :param on_page 每获取到一页评论时调用 on_page(comments)
             返回笔记的全部一级评论
         """
-        cursor = ''
+        success, msg = True, '成功'
         note_out_comment_list = []
         try:
-            while True:
-                success, msg, res_json = self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for comments, cursor in self.iter_note_out_comments(note_id, xsec_token, cookies_str, proxies=proxies):
                 note_out_comment_list.extend(comments)
-                if len(note_out_comment_list) == 0 or not res_json["data"]["has_more"]:
-                    break
+                if on_page is not None:
+                    on_page(comments)
         except Exception as e:
             success = False
             msg = str(e)
@@ -689,8 +864,7 @@ class XHS_Apis():
                 "xsec_token": xsec_token
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -698,6 +872,29 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_note_inner_comments(self, comment: dict, xsec_token: str, cookies_str: str, cursor: str = None, proxies: dict = None):
+        """
+            逐页获取一级评论下的二级评论
+            :param comment 笔记的一级评论
+            :param cookies_str 你的cookies
+            :param cursor 从指定的cursor继续获取, 默认从一级评论中已经包含的二级评论之后开始
+            每页返回 (评论列表, cursor), 请求失败时抛出异常
+        """
+        if cursor is None:
+            cursor = comment['sub_comment_cursor']
+        while True:
+            success, msg, res_json = self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            comments = res_json["data"]["comments"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield comments, cursor
+            if not res_json["data"]["has_more"]:
+                break
+
     def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
             获取笔记的全部二级评论
@@ -705,52 +902,57 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回笔记的全部二级评论
         """
+        success, msg = True, 'success'
         try:
             if not comment['sub_comment_has_more']:
-                return True, 'success', comment
-            cursor = comment['sub_comment_cursor']
+                return success, msg, comment
             inner_comment_list = []
-            while True:
-                success, msg, res_json = self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for comments, cursor in self.iter_note_inner_comments(comment, xsec_token, cookies_str, proxies=proxies):
                 inner_comment_list.extend(comments)
-                if not res_json["data"]["has_more"]:
-                    break
             comment['sub_comments'].extend(inner_comment_list)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, comment
 
-    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None):
+    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None, workers: int = 4):
         """
             获取一篇文章的所有评论
+            每获取到一页一级评论, 立即把其中有更多二级评论的评论提交到线程池中获取
             :param note_id: 你想要获取的笔记的id
             :param cookies_str: 你的cookies
+            :param workers: 同时获取二级评论的线程数量
             返回一篇文章的所有评论
         """
         out_comment_list = []
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='inner_comment')
+        futures = []
         try:
             urlParse = urllib.parse.urlparse(url)
             note_id = urlParse.path.split("/")[-1]
             kvs = urlParse.query.split('&')
             kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            success, msg, out_comment_list = self.get_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
+
+            def expand(comments):
+                for comment in comments:
+                    if comment['sub_comment_has_more']:
+                        futures.append(executor.submit(tracer.bind(self.get_note_all_inner_comment), comment, kvDist['xsec_token'], cookies_str, proxies))
+
+            success, msg, out_comment_list = self.get_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies, expand)
             if not success:
                 raise Exception(msg)
-            for comment in out_comment_list:
-                success, msg, new_comment = self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies)
+            for future in futures:
+                success, msg, new_comment = future.result()
                 if not success:
                     raise Exception(msg)
         except Exception as e:
             success = False
             msg = str(e)
+        finally:
+            # 出错时取消还没有开始的二级评论请求
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
         return success, msg, out_comment_list
 
     def get_unread_message(self, cookies_str: str, proxies: dict = None):
@@ -762,8 +964,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = "/api/sns/web/unread_count"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -786,8 +987,7 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -795,27 +995,37 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_metions(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取评论和@提醒
+            :param cookies_str: 你的cookies
+            :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (评论和@提醒列表, cursor), 请求失败时抛出异常
+        """
+        while True:
+            success, msg, res_json = self.get_metions(cursor, cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            metions = res_json["data"]["message_list"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield metions, cursor
+            if not res_json["data"]["has_more"]:
+                break
+
     def get_all_metions(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的评论和@提醒
             :param cookies_str: 你的cookies
             返回全部的评论和@提醒
         """
-        cursor = ''
+        success, msg = True, '成功'
         metions_list = []
         try:
-            while True:
-                success, msg, res_json = self.get_metions(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                metions = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for metions, cursor in self.iter_metions(cookies_str, proxies=proxies):
                 metions_list.extend(metions)
-                if not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
@@ -836,8 +1046,7 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -845,27 +1054,37 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_likesAndcollects(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取赞和收藏
+            :param cookies_str: 你的cookies
+            :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (赞和收藏列表, cursor), 请求失败时抛出异常
+        """
+        while True:
+            success, msg, res_json = self.get_likesAndcollects(cursor, cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            likesAndcollects = res_json["data"]["message_list"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield likesAndcollects, cursor
+            if not res_json["data"]["has_more"]:
+                break
+
     def get_all_likesAndcollects(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的赞和收藏
             :param cookies_str: 你的cookies
             返回全部的赞和收藏
         """
-        cursor = ''
+        success, msg = True, '成功'
         likesAndcollects_list = []
         try:
-            while True:
-                success, msg, res_json = self.get_likesAndcollects(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                likesAndcollects = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for likesAndcollects, cursor in self.iter_likesAndcollects(cookies_str, proxies=proxies):
                 likesAndcollects_list.extend(likesAndcollects)
-                if not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
@@ -886,8 +1105,7 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.request(splice_api, cookies_str, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -895,48 +1113,64 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_new_connections(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取新增关注
+            :param cookies_str: 你的cookies
+            :param cursor: 从指定的cursor继续获取, 为上一次返回的cursor
+            每页返回 (新增关注列表, cursor), 请求失败时抛出异常
+        """
+        while True:
+            success, msg, res_json = self.get_new_connections(cursor, cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            connections = res_json["data"]["message_list"]
+            if 'cursor' in res_json["data"]:
+                cursor = str(res_json["data"]["cursor"])
+            else:
+                break
+            yield connections, cursor
+            if not res_json["data"]["has_more"]:
+                break
+
     def get_all_new_connections(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的新增关注
             :param cookies_str: 你的cookies
             返回全部的新增关注
         """
-        cursor = ''
+        success, msg = True, '成功'
         connections_list = []
         try:
-            while True:
-                success, msg, res_json = self.get_new_connections(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                connections = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
+            for connections, cursor in self.iter_new_connections(cookies_str, proxies=proxies):
                 connections_list.extend(connections)
-                if not res_json["data"]["has_more"]:
-                    break
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, connections_list
 
     @staticmethod
-    def get_note_no_water_video(note_id):
+    def get_note_no_water_video(note_id, cache: Response_Cache = None):
         """
             获取笔记无水印视频
             :param note_id: 你想要获取的笔记的id
+            :param cache: 响应缓存
             返回笔记无水印视频
         """
         success = True
         msg = '成功'
         video_addr = None
         try:
+            video_addr = cache.get('note_video', note_id) if cache is not None else None
+            if video_addr is not None:
+                return success, msg, video_addr
             headers = get_common_headers()
             url = f"https://www.xiaohongshu.com/explore/{note_id}"
-            response = requests.get(url, headers=headers)
+            response = default_session_pool.get(url, headers=headers)
             res = response.text
             video_addr = re.findall(r'<meta name="og:video" content="(.*?)">', res)[0]
+            if cache is not None:
+                cache.set('note_video', note_id, video_addr)
         except Exception as e:
             success = False
             msg = str(e)
@@ -954,25 +1188,16 @@ class XHS_Apis():
         msg = '成功'
         new_url = None
         try:
-            # https://sns-webpic-qc.xhscdn.com/202403211626/c4fcecea4bd012a1fe8d2f1968d6aa91/110/0/01e50c1c135e8c010010000000018ab74db332_0.jpg!nd_dft_wlteh_webp_3
+            img_id = get_img_id(img_url)
             if '.jpg' in img_url:
-                img_id = '/'.join([split for split in img_url.split('/')[-3:]]).split('!')[0]
                 # return f"http://ci.xiaohongshu.com/{img_id}?imageview2/2/w/1920/format/png"
                 # return f"http://ci.xiaohongshu.com/{img_id}?imageview2/2/w/format/png"
                 # return f'https://sns-img-hw.xhscdn.com/{img_id}'
                 new_url = f'https://sns-img-qc.xhscdn.com/{img_id}'
-
-            # 'https://sns-webpic-qc.xhscdn.com/202403231640/ea961053c4e0e467df1cc93afdabd630/spectrum/1000g0k0200n7mj8fq0005n7ikbllol6q50oniuo!nd_dft_wgth_webp_3'
             elif 'spectrum' in img_url:
-                img_id = '/'.join(img_url.split('/')[-2:]).split('!')[0]
                 # return f'http://sns-webpic.xhscdn.com/{img_id}?imageView2/2/w/1920/format/jpg'
                 new_url = f'http://sns-webpic.xhscdn.com/{img_id}?imageView2/2/w/format/jpg'
             else:
-                # 'http://sns-webpic-qc.xhscdn.com/202403181511/64ad2ea67ce04159170c686a941354f5/1040g008310cs1hii6g6g5ngacg208q5rlf1gld8!nd_dft_wlteh_webp_3'
-                img_id = img_url.split('/')[-1].split('!')[0]
-                # return f"http://ci.xiaohongshu.com/{img_id}?imageview2/2/w/1920/format/png"
-                # return f"http://ci.xiaohongshu.com/{img_id}?imageview2/2/w/format/png"
-                # return f'https://sns-img-hw.xhscdn.com/{img_id}'
                 new_url = f'https://sns-img-qc.xhscdn.com/{img_id}'
         except Exception as e:
             success = False
@@ -0,0 +1,349 @@
+# encoding: utf-8
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from apis.xhs_pc_apis import XHS_Apis
+from xhs_utils.http_util import Session_Pool
+from xhs_utils.cache_util import Response_Cache
+
+# 线程池的线程上限, 每个并发请求占用一个线程
+MAX_THREADS = 64
+
+"""
+    小红书api的异步版本, 接口和返回值 (success, msg, res_json) 与 XHS_Apis 一致
+    不是基于异步 http 的实现, 而是 XHS_Apis 在线程池上的封装: 签名和请求在线程池中执行, 不会阻塞事件循环
+    每个并发请求占用一个线程, 所以最大并发数不超过 MAX_THREADS
+    :param session_pool: http 会话池, 默认创建连接池大小为 max_concurrency 的会话池, 传入的会话池的 pool_size 应不小于 max_concurrency
+    :param max_concurrency: 全局最大并发请求数, 即线程数
+    :param cache: 响应缓存
+"""
+class AsyncXHS_Apis():
+    def __init__(self, session_pool: Session_Pool = None, max_concurrency: int = 32, cache: Response_Cache = None):
+        if max_concurrency > MAX_THREADS:
+            logger.warning(f'最大并发数 {max_concurrency} 超过线程上限, 使用 {MAX_THREADS}')
+            max_concurrency = MAX_THREADS
+        # 连接池小于并发数时, 多出的连接用完即被丢弃, 每次都要重新建立连接
+        self.own_session_pool = session_pool is None
+        if session_pool is None:
+            session_pool = Session_Pool(pool_size=max_concurrency)
+        elif not session_pool.http2 and session_pool.pool_size < max_concurrency:
+            logger.warning(f'会话池的连接池大小 {session_pool.pool_size} 小于最大并发数 {max_concurrency}, 超出的连接不会被复用')
+        self.apis = XHS_Apis(session_pool, cache)
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='xhs_apis')
+        # Semaphore 绑定创建它的事件循环, 每个事件循环使用自己的 Semaphore
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        async with semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def run_iter(self, func, *args):
+        # 在线程池中逐页推进同步的生成器, 每次只占用一个并发名额
+        gen = func(*args)
+        # 调用方提前退出时可能还有一页正在线程中获取, 加锁等它结束后再关闭生成器
+        lock = threading.Lock()
+
+        def step():
+            with lock:
+                return next(gen, end)
+
+        def close():
+            with lock:
+                gen.close()
+
+        end = object()
+        try:
+            while True:
+                page = await self.run(step)
+                if page is end:
+                    break
+                yield page
+        finally:
+            # 不在事件循环中等待, 提前退出或取消时也能关闭生成器
+            try:
+                self.executor.submit(close)
+            except RuntimeError:
+                # 线程池已经关闭
+                close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.own_session_pool:
+            self.apis.http.close()
+
+    async def get_homefeed_all_channel(self, cookies_str: str, proxies: dict = None):
+        """
+            获取主页的所有频道
+        """
+        return await self.run(self.apis.get_homefeed_all_channel, cookies_str, proxies)
+
+    async def get_homefeed_recommend(self, category, cursor_score, refresh_type, note_index, cookies_str: str, proxies: dict = None):
+        """
+            获取主页推荐的笔记
+        """
+        return await self.run(self.apis.get_homefeed_recommend, category, cursor_score, refresh_type, note_index, cookies_str, proxies)
+
+    async def get_homefeed_recommend_by_num(self, category, require_num, cookies_str: str, proxies: dict = None):
+        """
+            根据数量获取主页推荐的笔记
+        """
+        return await self.run(self.apis.get_homefeed_recommend_by_num, category, require_num, cookies_str, proxies)
+
+    async def get_user_info(self, user_id: str, cookies_str: str, proxies: dict = None):
+        """
+            获取用户的信息
+        """
+        return await self.run(self.apis.get_user_info, user_id, cookies_str, proxies)
+
+    async def get_user_self_info(self, cookies_str: str, proxies: dict = None):
+        """
+            获取用户自己的信息1
+        """
+        return await self.run(self.apis.get_user_self_info, cookies_str, proxies)
+
+    async def get_user_self_info2(self, cookies_str: str, proxies: dict = None):
+        """
+            获取用户自己的信息2
+        """
+        return await self.run(self.apis.get_user_self_info2, cookies_str, proxies)
+
+    async def get_user_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
+        """
+            获取用户指定位置的笔记
+        """
+        return await self.run(self.apis.get_user_note_info, user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+
+    async def iter_user_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None, stop_note_ids: set = None):
+        """
+            逐页获取用户的笔记, 每页返回 (笔记列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_user_notes, user_url, cookies_str, cursor, proxies, stop_note_ids):
+            yield page
+
+    async def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None, stop_note_ids: set = None):
+        """
+            获取用户所有笔记
+        """
+        return await self.run(self.apis.get_user_all_notes, user_url, cookies_str, proxies, stop_note_ids)
+
+    async def get_user_like_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
+        """
+            获取用户指定位置喜欢的笔记
+        """
+        return await self.run(self.apis.get_user_like_note_info, user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+
+    async def iter_user_like_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取用户喜欢的笔记, 每页返回 (笔记列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_user_like_notes, user_url, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_user_all_like_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
+        """
+            获取用户所有喜欢笔记
+        """
+        return await self.run(self.apis.get_user_all_like_note_info, user_url, cookies_str, proxies)
+
+    async def get_user_collect_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
+        """
+            获取用户指定位置收藏的笔记
+        """
+        return await self.run(self.apis.get_user_collect_note_info, user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
+
+    async def iter_user_collect_notes(self, user_url: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取用户收藏的笔记, 每页返回 (笔记列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_user_collect_notes, user_url, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_user_all_collect_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
+        """
+            获取用户所有收藏笔记
+        """
+        return await self.run(self.apis.get_user_all_collect_note_info, user_url, cookies_str, proxies)
+
+    async def get_note_info(self, url: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的详细
+        """
+        return await self.run(self.apis.get_note_info, url, cookies_str, proxies)
+
+    async def get_some_note_info(self, urls: list, cookies_str: str, proxies: dict = None, sign_chunk: int = 8):
+        """
+            批量获取笔记的详细, 每 sign_chunk 个请求的签名在一次js调用中生成
+        """
+        return await self.run(self.apis.get_some_note_info, urls, cookies_str, proxies, sign_chunk)
+
+    async def get_search_keyword(self, word: str, cookies_str: str, proxies: dict = None):
+        """
+            获取搜索关键词
+        """
+        return await self.run(self.apis.get_search_keyword, word, cookies_str, proxies)
+
+    async def search_note(self, query: str, cookies_str: str, page=1, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
+        """
+            获取搜索笔记的结果
+        """
+        return await self.run(self.apis.search_note, query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
+
+    async def iter_search_notes(self, query: str, cookies_str: str, page=1, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
+        """
+            逐页搜索笔记, 每页返回 (笔记列表, 下一页的页数)
+        """
+        async for page in self.run_iter(self.apis.iter_search_notes, query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies):
+            yield page
+
+    async def search_some_note(self, query: str, require_num: int, cookies_str: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
+        """
+            指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
+        """
+        return await self.run(self.apis.search_some_note, query, require_num, cookies_str, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
+
+    async def search_user(self, query: str, cookies_str: str, page=1, proxies: dict = None):
+        """
+            获取搜索用户的结果
+        """
+        return await self.run(self.apis.search_user, query, cookies_str, page, proxies)
+
+    async def iter_search_users(self, query: str, cookies_str: str, page=1, proxies: dict = None):
+        """
+            逐页搜索用户, 每页返回 (用户列表, 下一页的页数)
+        """
+        async for page in self.run_iter(self.apis.iter_search_users, query, cookies_str, page, proxies):
+            yield page
+
+    async def search_some_user(self, query: str, require_num: int, cookies_str: str, proxies: dict = None):
+        """
+            指定数量搜索用户
+        """
+        return await self.run(self.apis.search_some_user, query, require_num, cookies_str, proxies)
+
+    async def get_note_out_comment(self, note_id: str, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取指定位置的笔记一级评论
+        """
+        return await self.run(self.apis.get_note_out_comment, note_id, cursor, xsec_token, cookies_str, proxies)
+
+    async def iter_note_out_comments(self, note_id: str, xsec_token: str, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取笔记的一级评论, 每页返回 (评论列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_note_out_comments, note_id, xsec_token, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的全部一级评论
+        """
+        return await self.run(self.apis.get_note_all_out_comment, note_id, xsec_token, cookies_str, proxies)
+
+    async def get_note_inner_comment(self, comment: dict, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取指定位置的笔记二级评论
+        """
+        return await self.run(self.apis.get_note_inner_comment, comment, cursor, xsec_token, cookies_str, proxies)
+
+    async def iter_note_inner_comments(self, comment: dict, xsec_token: str, cookies_str: str, cursor: str = None, proxies: dict = None):
+        """
+            逐页获取一级评论下的二级评论, 每页返回 (评论列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_note_inner_comments, comment, xsec_token, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的全部二级评论
+        """
+        return await self.run(self.apis.get_note_all_inner_comment, comment, xsec_token, cookies_str, proxies)
+
+    async def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None, workers: int = 4):
+        """
+            获取一篇文章的所有评论
+        """
+        return await self.run(self.apis.get_note_all_comment, url, cookies_str, proxies, workers)
+
+    async def get_unread_message(self, cookies_str: str, proxies: dict = None):
+        """
+            获取未读消息
+        """
+        return await self.run(self.apis.get_unread_message, cookies_str, proxies)
+
+    async def get_metions(self, cursor: str, cookies_str: str, proxies: dict = None):
+        """
+            获取评论和@提醒
+        """
+        return await self.run(self.apis.get_metions, cursor, cookies_str, proxies)
+
+    async def iter_metions(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取评论和@提醒, 每页返回 (评论和@提醒列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_metions, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_all_metions(self, cookies_str: str, proxies: dict = None):
+        """
+            获取全部的评论和@提醒
+        """
+        return await self.run(self.apis.get_all_metions, cookies_str, proxies)
+
+    async def get_likesAndcollects(self, cursor: str, cookies_str: str, proxies: dict = None):
+        """
+            获取赞和收藏
+        """
+        return await self.run(self.apis.get_likesAndcollects, cursor, cookies_str, proxies)
+
+    async def iter_likesAndcollects(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取赞和收藏, 每页返回 (赞和收藏列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_likesAndcollects, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_all_likesAndcollects(self, cookies_str: str, proxies: dict = None):
+        """
+            获取全部的赞和收藏
+        """
+        return await self.run(self.apis.get_all_likesAndcollects, cookies_str, proxies)
+
+    async def get_new_connections(self, cursor: str, cookies_str: str, proxies: dict = None):
+        """
+            获取新增关注
+        """
+        return await self.run(self.apis.get_new_connections, cursor, cookies_str, proxies)
+
+    async def iter_new_connections(self, cookies_str: str, cursor: str = '', proxies: dict = None):
+        """
+            逐页获取新增关注, 每页返回 (新增关注列表, cursor)
+        """
+        async for page in self.run_iter(self.apis.iter_new_connections, cookies_str, cursor, proxies):
+            yield page
+
+    async def get_all_new_connections(self, cookies_str: str, proxies: dict = None):
+        """
+            获取全部的新增关注
+        """
+        return await self.run(self.apis.get_all_new_connections, cookies_str, proxies)
+
+    async def get_note_no_water_video(self, note_id):
+        """
+            获取笔记无水印视频
+        """
+        return await self.run(self.apis.get_note_no_water_video, note_id, self.apis.cache)
+
+    @staticmethod
+    def get_note_no_water_img(img_url):
+        """
+            获取笔记无水印图片, 不涉及网络请求
+        """
+        return XHS_Apis.get_note_no_water_img(img_url)
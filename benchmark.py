@@ -0,0 +1,176 @@
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from loguru import logger
+from main import Data_Spider
+from xhs_utils import data_util, xhs_util
+from xhs_utils.http_util import Session_Pool
+from xhs_utils.account_util import Account_Pool
+from xhs_utils.rate_limit_util import Rate_Limiter
+from xhs_utils.mock_util import run_mock_server
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCENARIOS = ('notes', 'user', 'search', 'comments')
+
+
+class Timed_Session_Pool(Session_Pool):
+    """
+        记录每个请求的耗时 (包括限速等待), 用于计算延迟的分位数
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+        self.failures = 0
+
+    def request(self, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, **kwargs)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def stub_sign():
+    # 不启动 node 进程, 只测量签名以外的开销
+    xhs_util.generate_xs_xs_common = lambda a1, api, data='': ('XYW_benchmark', int(time.time() * 1000), 'benchmark')
+    xhs_util.sign_batch = lambda items: [('XYW_benchmark', int(time.time() * 1000), 'benchmark') for item in items]
+
+
+def start_server(**kwargs):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_mock_server, args=(child_conn,), kwargs=kwargs, daemon=True)
+    process.start()
+    return process, parent_conn.recv()
+
+
+def run_scenario(scenario, data_spider, cookies_str, base_path, targets, args):
+    if scenario == 'notes':
+        return len(data_spider.spider_some_note(targets['notes'][:args.notes], cookies_str, base_path, args.save_choice, 'benchmark'))
+    if scenario == 'user':
+        note_list, success, msg = data_spider.spider_user_all_note(targets['users'][0], cookies_str, base_path, args.save_choice)
+        return len(note_list) if success else 0
+    if scenario == 'search':
+        note_list, success, msg = data_spider.spider_some_search_note('benchmark', args.notes, cookies_str, base_path, args.save_choice)
+        return len(note_list) if success else 0
+    # 评论: 每个笔记获取全部一级和二级评论
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(data_spider.call_api, data_spider.xhs_apis.get_note_all_comment, cookies_str, note_url, workers=args.comment_workers) for note_url in targets['notes'][:args.notes]]
+        return sum(len(future.result()[2]) for future in futures if future.result()[0])
+
+
+def benchmark(scenario, server_url, targets, args):
+    """
+        运行一个场景, 返回每秒请求数、延迟分位数、内存等结果
+    """
+    session_pool = Timed_Session_Pool(rate_limiter=Rate_Limiter(rate=args.client_rate, burst=args.client_rate) if args.client_rate else None)
+    account_pool = None
+    cookies_str = 'a1=benchmark0; web_session=benchmark'
+    if args.accounts > 1:
+        account_pool = Account_Pool([f'a1=benchmark{i}; web_session=benchmark' for i in range(args.accounts)], session_pool.rate_limiter)
+        cookies_str = None
+    server_before = requests.get(server_url + '/_mock/stats').json()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_path = {'media': tmp_dir, 'excel': tmp_dir}
+        data_spider = Data_Spider(session_pool, workers=args.workers, media_workers=args.media_workers, account_pool=account_pool, trace_dir=args.trace_dir)
+        data_spider.xhs_apis.base_url = server_url
+        if args.tracemalloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        results = run_scenario(scenario, data_spider, cookies_str, base_path, targets, args)
+        seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+    session_pool.close()
+    server_after = requests.get(server_url + '/_mock/stats').json()
+    latencies = session_pool.latencies
+    report = {
+        'scenario': scenario,
+        'results': results,
+        'seconds': round(seconds, 3),
+        'requests': len(latencies),
+        'failures': session_pool.failures,
+        'requests_per_second': round(len(latencies) / seconds, 2) if seconds > 0 else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+            'p90': round(percentile(latencies, 0.9) * 1000, 2) if latencies else None,
+            'p99': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            'max': round(max(latencies) * 1000, 2) if latencies else None,
+        },
+        'server': {key: server_after[key] - server_before[key] for key in ('requests', 'throttled', 'errors', 'bytes_sent')},
+        'memory_mb': {
+            'peak_rss': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2) if resource is not None else None,
+            'traced_peak': round(traced_peak / 1024 / 1024, 2) if traced_peak is not None else None,
+        },
+    }
+    logger.info(f"场景 {scenario}: 结果 {results} 个, 耗时 {report['seconds']}s, 请求 {report['requests']} 次, {report['requests_per_second']} req/s, "
+                f"p50 {report['latency_ms']['p50']}ms, p99 {report['latency_ms']['p99']}ms, 限流 {report['server']['throttled']} 次, "
+                f"服务器错误 {report['server']['errors']} 次, 传输 {report['server']['bytes_sent'] / 1024 / 1024:.2f} MB, 内存峰值 {report['memory_mb']['peak_rss']} MB")
+    return report
+
+
+if __name__ == '__main__':
+    """
+        使用本地模拟服务器压测 Data_Spider, 不需要联网和账号
+        python benchmark.py --scenario all --notes 50 --latency 0.02 --output bench.json
+        --stub-sign 跳过 node 签名, 只测量签名以外的开销
+        模拟服务器运行在单独的进程中, 内存为爬虫进程的峰值 RSS, --tracemalloc 额外统计 python 分配的内存峰值
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--notes', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--media-workers', type=int, default=8)
+    parser.add_argument('--comment-workers', type=int, default=4)
+    parser.add_argument('--save-choice', default='media')
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--client-rate', type=float, default=None)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--cdn-latency', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    parser.add_argument('--image-size', type=int, default=50 * 1024)
+    parser.add_argument('--video-size', type=int, default=1024 * 1024)
+    parser.add_argument('--stub-sign', action='store_true')
+    parser.add_argument('--tracemalloc', action='store_true')
+    parser.add_argument('--trace-dir', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.stub_sign:
+        stub_sign()
+    process, server_url = start_server(
+        latency=args.latency, cdn_latency=args.cdn_latency, error_rate=args.error_rate, rate_limit=args.rate_limit,
+        notes_per_user=max(args.notes, 1), users=2, search_results=args.notes, image_size=args.image_size, video_size=args.video_size,
+    )
+    data_util.VIDEO_CDN = server_url + '/cdn/video/'
+    try:
+        targets = requests.get(server_url + '/_mock/targets').json()
+        scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+        reports = [benchmark(scenario, server_url, targets, args) for scenario in scenarios]
+    finally:
+        process.terminate()
+    output = json.dumps(reports, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
@@ -1,14 +1,103 @@
 import json
+import math
 import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from loguru import logger
 from apis.xhs_pc_apis import XHS_Apis
 from xhs_utils.common_util import init
-from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx
+from xhs_utils.http_util import Session_Pool
+from xhs_utils.cache_util import Response_Cache
+from xhs_utils.account_util import Account_Pool
+from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx, Media_Downloader, Media_Store, Data_Sink
+from xhs_utils.db_util import Sqlite_Store
+from xhs_utils.journal_util import Job_Journal
+from xhs_utils.trace_util import tracer, trace_job
 
 
 class Data_Spider():
-    def __init__(self):
-        self.xhs_apis = XHS_Apis()
+    def __init__(self, session_pool: Session_Pool = None, workers: int = 4, batch_size: int = 8, media_workers: int = 8, media_store: Media_Store = None, sink: Data_Sink = None, store: Sqlite_Store = None, cache: Response_Cache = None, account_pool: Account_Pool = None, journal_dir: str = None, trace_dir: str = None):
+        """
+            :param session_pool: http 会话池
+            :param workers: 同时爬取笔记信息的线程数量, 默认4, 使用多账号时可以按账号数量增加
+            :param batch_size: 每个线程一次最多爬取的笔记数量, 这些笔记的签名在一次 js 调用中生成
+            :param media_workers: 同时下载图片和视频的线程数量
+            :param media_store: 内容寻址的媒体存储, 传入时相同的图片和视频只下载一次
+            :param sink: 笔记信息的输出, 例如 open_sink('notes.jsonl'), 每爬取一个笔记写入一条, 由调用方关闭
+            :param store: sqlite 数据库, 爬取的笔记会写入数据库, 增量爬取用户笔记时需要传入
+            :param cache: 响应缓存, 多个任务爬取到相同的笔记时只请求一次
+            :param account_pool: 多账号池, 传入时 cookies_str 可以为 None, 每次请求从账号池中选择账号
+            :param journal_dir: 任务日志目录, 传入时记录翻页进度, 已完成的笔记和媒体文件, 中断后重新运行相同的任务会从中断处继续
+            :param trace_dir: 传入时开启耗时追踪, 每个任务结束后在目录中保存耗时报告和 Chrome trace 文件
+        """
+        self.session_pool = session_pool
+        self.xhs_apis = XHS_Apis(session_pool, cache)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.media_workers = media_workers
+        self.media_store = media_store
+        self.sink = sink
+        self.store = store
+        self.account_pool = account_pool
+        self.journal_dir = journal_dir
+        self.trace_dir = trace_dir
+        if trace_dir is not None:
+            tracer.enable()
+
+    def call_api(self, func, cookies_str, *args, **kwargs):
+        # cookies_str 为 None 时由账号池选择账号并记录请求结果
+        if cookies_str is None and self.account_pool is not None:
+            return self.account_pool.call(func, *args, url=XHS_Apis.ENDPOINTS.get(func.__name__), **kwargs)
+        return func(*args, cookies_str=cookies_str, **kwargs)
+
+    def iter_api(self, func, cookies_str, *args, **kwargs):
+        # 翻页接口的整个翻页过程使用同一个账号
+        if cookies_str is not None or self.account_pool is None:
+            yield from func(*args, cookies_str=cookies_str, **kwargs)
+            return
+        account = self.account_pool.acquire(XHS_Apis.ENDPOINTS.get(func.__name__))
+        success, msg = False, None
+        try:
+            yield from func(*args, cookies_str=account.cookies_str, **kwargs)
+            success = True
+        except GeneratorExit:
+            success = True
+            raise
+        except Exception as e:
+            msg = str(e)
+            raise
+        finally:
+            self.account_pool.release(account, success, msg)
+
+    def open_journal(self, *keys):
+        if self.journal_dir is None:
+            return None
+        return Job_Journal.for_job(self.journal_dir, *keys)
+
+    def paginate(self, func, cookies_str, journal: Job_Journal = None, cursor_arg: str = 'cursor', limit: int = None, **kwargs):
+        """
+            使用 iter_* 接口翻页获取全部数据
+            传入 journal 时每一页写入日志, 中断后重新运行从日志中的 cursor 继续翻页
+            :param cursor_arg: iter_* 接口中 cursor 参数的名称
+            :param limit: 获取到的数量达到 limit 后停止翻页
+        """
+        items = journal.items if journal is not None else []
+        if journal is not None:
+            if journal.pages_done:
+                return items
+            if journal.cursor is not None:
+                kwargs[cursor_arg] = journal.cursor
+        if limit is None or len(items) < limit:
+            for page, cursor in self.iter_api(func, cookies_str, **kwargs):
+                if journal is not None:
+                    journal.add_page(page, cursor)
+                else:
+                    items.extend(page)
+                if limit is not None and len(items) >= limit:
+                    break
+        if journal is not None:
+            journal.finish_pages()
+        return items
 
     def spider_note(self, note_url: str, cookies_str: str, proxies=None):
         """
@@ -18,66 +107,187 @@ class Data_Spider():
         :return:
         """
         note_info = None
-        try:
-            success, msg, note_info = self.xhs_apis.get_note_info(note_url, cookies_str, proxies)
-            if success:
-                note_info = note_info['data']['items'][0]
-                note_info['url'] = note_url
-                note_info = handle_note_info(note_info)
-        except Exception as e:
-            success = False
-            msg = e
+        note_id = urllib.parse.urlparse(note_url).path.split("/")[-1]
+        with tracer.span('note', note_id=note_id, url=note_url) as span:
+            try:
+                success, msg, note_info = self.call_api(self.xhs_apis.get_note_info, cookies_str, note_url, proxies=proxies)
+                if success:
+                    note_info = self.parse_note_info(note_url, note_info)
+            except Exception as e:
+                success = False
+                msg = e
+            span.args['success'] = success
         logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
         return success, msg, note_info
 
-    def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+    def spider_note_batch(self, note_urls: list, cookies_str: str, proxies=None):
+        """
+        批量爬取笔记的信息, 签名通过 get_some_note_info 分批生成
+        :return: 每个笔记的 (success, msg, note_info), 顺序与 note_urls 一致
+        """
+        if len(note_urls) == 1:
+            return [self.spider_note(note_urls[0], cookies_str, proxies)]
+        with tracer.span('note_batch', count=len(note_urls)):
+            try:
+                results = self.call_api(self.xhs_apis.get_some_note_info, cookies_str, note_urls, proxies=proxies, sign_chunk=self.batch_size)
+            except Exception as e:
+                results = [(False, e, None)] * len(note_urls)
+        note_infos = []
+        for note_url, (success, msg, note_info) in zip(note_urls, results):
+            try:
+                if success:
+                    note_info = self.parse_note_info(note_url, note_info)
+            except Exception as e:
+                success, msg, note_info = False, e, None
+            logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
+            note_infos.append((success, msg, note_info))
+        return note_infos
+
+    @staticmethod
+    def parse_note_info(note_url, res_json):
+        note_info = res_json['data']['items'][0]
+        note_info['url'] = note_url
+        with tracer.span('handle_note_info', note_id=urllib.parse.urlparse(note_url).path.split("/")[-1]):
+            return handle_note_info(note_info)
+
+    @trace_job('notes')
+    def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None, workers: int = None, journal: Job_Journal = None):
         """
         爬取一些笔记的信息
+        笔记信息并发爬取, 每个笔记爬取完成后立即提交到媒体下载器, 结果顺序与 notes 一致
         :param notes:
         :param cookies_str:
         :param base_path:
-        :return:
+        :param workers: 线程数量, 默认使用 Data_Spider 的 workers
+        :param journal: 任务日志, 日志中已完成的笔记不再请求, 已下载的媒体文件不再下载
+        :return: 爬取成功的笔记信息
         """
         if (save_choice == 'all' or save_choice == 'excel') and excel_name == '':
             raise ValueError('excel_name 不能为空')
-        note_list = []
-        for note_url in notes:
-            success, msg, note_info = self.spider_note(note_url, cookies_str, proxies)
-            if note_info is not None and success:
-                note_list.append(note_info)
-        for note_info in note_list:
-            if save_choice == 'all' or 'media' in save_choice:
-                download_note(note_info, base_path['media'], save_choice)
+        own_journal = journal is None
+        if own_journal:
+            journal = self.open_journal('notes', notes, save_choice, excel_name)
+        workers = max(workers or self.workers, 1)
+        need_download = save_choice == 'all' or 'media' in save_choice
+        note_list = [None] * len(notes)
+        complete = True
+        downloader = Media_Downloader(self.media_workers, self.session_pool, self.media_store, proxies, journal) if need_download else None
+
+        def save_note(index, note_info, replayed=False):
+            note_list[index] = note_info
+            if self.sink is not None:
+                # 日志中的笔记已经写入同一个输出时不再写入, 重新打开的输出中没有这些笔记, 需要再写入一次
+                if not replayed:
+                    self.sink.write(note_info)
+                elif not journal.in_sink(note_info['note_id'], self.sink.sink_id):
+                    self.sink.write(note_info)
+                    journal.add_sink(note_info['note_id'], self.sink.sink_id)
+            # 日志中的笔记在记录之前已经写入数据库
+            if self.store is not None and not replayed:
+                self.store.upsert_note(note_info)
+            if need_download:
+                with tracer.span('download_note', note_id=note_info['note_id']):
+                    download_note(note_info, base_path['media'], save_choice, downloader)
+
+        try:
+            pending = []
+            for index, note_url in enumerate(notes):
+                note_id = urllib.parse.urlparse(note_url).path.split("/")[-1]
+                if journal is not None and note_id in journal.notes:
+                    # 日志中已完成的笔记, 只补充没有下载完成的媒体文件
+                    save_note(index, journal.notes[note_id], replayed=True)
+                else:
+                    pending.append(index)
+            # 每个线程一次爬取一批笔记, 笔记较少时每批的数量减少, 保证所有线程都能用上
+            size = max(1, min(self.batch_size, math.ceil(len(pending) / workers)))
+            chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+            with ThreadPoolExecutor(max_workers=workers) as spider_pool:
+                spider_futures = {spider_pool.submit(tracer.bind(self.spider_note_batch), [notes[index] for index in chunk], cookies_str, proxies): chunk for chunk in chunks}
+                for future in as_completed(spider_futures):
+                    for index, (success, msg, note_info) in zip(spider_futures[future], future.result()):
+                        if note_info is not None and success:
+                            save_note(index, note_info)
+                            if journal is not None:
+                                journal.add_note(note_info['note_id'], note_info, self.sink.sink_id if self.sink is not None else None)
+                        else:
+                            complete = False
+        finally:
+            if downloader is not None and downloader.close()['failed']:
+                complete = False
+            if self.store is not None:
+                self.store.flush()
+        note_list = [note_info for note_info in note_list if note_info is not None]
         if save_choice == 'all' or save_choice == 'excel':
             file_path = os.path.abspath(os.path.join(base_path['excel'], f'{excel_name}.xlsx'))
-            save_to_xlsx(note_list, file_path)
+            with tracer.span('save_to_xlsx', rows=len(note_list)):
+                save_to_xlsx(note_list, file_path)
+        if journal is not None:
+            journal.complete = complete
+            # 全部完成后删除日志, 有失败的笔记或媒体文件时保留, 下次运行只重试失败的部分
+            if own_journal:
+                journal.close(remove=complete)
+        return note_list
 
 
-    def spider_user_all_note(self, user_url: str, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+    def list_user_notes(self, user_url: str, cookies_str: str, proxies=None, incremental: bool = False, journal: Job_Journal = None):
+        """
+            翻页获取用户需要爬取的笔记链接
+            增量爬取时翻页到上次已经完整爬取的笔记为止, 并跳过数据库中已有的笔记
+            新笔记全部保存后调用 store.set_user_state(user_id, newest_note_id) 更新进度
+            :return: (笔记链接列表, 最新一条非置顶笔记的id)
+        """
+        if incremental and self.store is None:
+            raise ValueError('增量爬取需要传入 store')
+        user_id = urllib.parse.urlparse(user_url).path.split("/")[-1]
+        state = self.store.get_user_state(user_id) if incremental else None
+        # 上次完整爬取时已有的笔记都可以作为停止的依据, 其中一条被删除或置顶时仍然能停止翻页
+        # 之后失败的任务中写入的笔记不作为依据, 它们之后可能还有没爬取成功的笔记
+        stop_note_ids = self.store.get_user_note_ids(user_id, state['updated_at']) if state else None
+        all_note_info = self.paginate(self.xhs_apis.iter_user_notes, cookies_str, journal, user_url=user_url, proxies=proxies, stop_note_ids=stop_note_ids)
+        logger.info(f'用户 {user_url} 作品数量: {len(all_note_info)}')
+        known_note_ids = self.store.get_user_note_ids(user_id) if incremental else set()
+        note_urls = [f"https://www.xiaohongshu.com/explore/{note['note_id']}?xsec_token={note['xsec_token']}" for note in all_note_info if note['note_id'] not in known_note_ids]
+        newest_note_id = next((note['note_id'] for note in all_note_info if not note.get('interact_info', {}).get('sticky')), None)
+        return note_urls, newest_note_id
+
+    @trace_job('user')
+    def spider_user_all_note(self, user_url: str, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None, incremental: bool = False):
         """
         爬取一个用户的所有笔记
         :param user_url:
         :param cookies_str:
         :param base_path:
+        :param incremental: 增量爬取, 需要传入 store, 翻页到上次爬取的最新笔记为止, 只爬取数据库中没有的笔记
         :return:
         """
+        if incremental and self.store is None:
+            raise ValueError('增量爬取需要传入 store')
         note_list = []
+        journal = None
         try:
-            success, msg, all_note_info = self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies)
-            if success:
-                logger.info(f'用户 {user_url} 作品数量: {len(all_note_info)}')
-                for simple_note_info in all_note_info:
-                    note_url = f"https://www.xiaohongshu.com/explore/{simple_note_info['note_id']}?xsec_token={simple_note_info['xsec_token']}"
-                    note_list.append(note_url)
+            user_id = urllib.parse.urlparse(user_url).path.split("/")[-1]
+            journal = self.open_journal('user', user_id, save_choice, incremental)
+            success, msg = True, '成功'
+            note_list, newest_note_id = self.list_user_notes(user_url, cookies_str, proxies, incremental, journal)
             if save_choice == 'all' or save_choice == 'excel':
                 excel_name = user_url.split('/')[-1].split('?')[0]
-            self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+            saved_note_list = self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies, journal=journal)
+            # 新笔记全部爬取成功后才更新进度, 否则下次从上一次的进度重新翻页, 已经爬取的笔记会被跳过
+            if incremental and newest_note_id is not None and len(saved_note_list) == len(note_list) and (journal is None or journal.complete):
+                self.store.set_user_state(user_id, newest_note_id)
+            if journal is not None:
+                journal.close(remove=journal.complete)
+                journal = None
         except Exception as e:
             success = False
             msg = e
+        finally:
+            if journal is not None:
+                journal.close()
         logger.info(f'爬取用户所有视频 {user_url}: {success}, msg: {msg}')
         return note_list, success, msg
 
+    @trace_job('search')
     def spider_some_search_note(self, query: str, require_num: int, cookies_str: str, base_path: dict, save_choice: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo: dict = None,  excel_name: str = '', proxies=None):
         """
             指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
@@ -93,8 +303,11 @@ class Data_Spider():
             返回搜索的结果
         """
         note_list = []
+        journal = None
         try:
-            success, msg, notes = self.xhs_apis.search_some_note(query, require_num, cookies_str, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
+            journal = self.open_journal('search', query, require_num, save_choice, sort_type_choice, note_type, note_time, note_range, pos_distance, geo)
+            success, msg = True, '成功'
+            notes = self.paginate(self.xhs_apis.iter_search_notes, cookies_str, journal, cursor_arg='page', limit=require_num, query=query, sort_type_choice=sort_type_choice, note_type=note_type, note_time=note_time, note_range=note_range, pos_distance=pos_distance, geo=geo, proxies=proxies)[:require_num]
             if success:
                 notes = list(filter(lambda x: x['model_type'] == "note", notes))
                 logger.info(f'搜索关键词 {query} 笔记数量: {len(notes)}')
@@ -103,10 +316,16 @@ class Data_Spider():
                     note_list.append(note_url)
             if save_choice == 'all' or save_choice == 'excel':
                 excel_name = query
-            self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+            self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies, journal=journal)
+            if journal is not None:
+                journal.close(remove=journal.complete)
+                journal = None
         except Exception as e:
             success = False
             msg = e
+        finally:
+            if journal is not None:
+                journal.close()
         logger.info(f'搜索关键词 {query} 笔记: {success}, msg: {msg}')
         return note_list, success, msg
 
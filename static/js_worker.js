@@ -0,0 +1,61 @@
+// 常驻的 js 执行进程, 由 xhs_utils/js_pool_util.py 启动
+// 启动参数为需要加载的脚本, 脚本中定义的全局函数可以被调用
+// 协议: stdin 每行一个请求 {"id": 1, "fn": "get_xs", "args": [...]}
+//       stdout 每行一个响应 {"id": 1, "result": ...} 或 {"id": 1, "error": "..."}
+//       批量请求 {"id": 2, "fn": "get_xs", "batch": [[...], [...]]} 的 result 为按顺序排列的列表, 每一项为 {"result": ...} 或 {"error": "..."}
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+
+const write = process.stdout.write.bind(process.stdout);
+// 被加载的脚本中的 console.log 会污染 stdout 的协议输出, 统一转到 stderr
+console.log = console.info = console.debug = function (...args) {
+    process.stderr.write(args.join(' ') + '\n');
+};
+
+global.require = require;
+for (const script of process.argv.slice(2)) {
+    // 间接 eval 在全局作用域执行, 脚本中的函数声明会成为全局函数
+    (0, eval)(fs.readFileSync(path.resolve(script), 'utf-8'));
+}
+
+function errorText(e) {
+    return String(e && e.stack ? e.stack : e);
+}
+
+function call(name, args) {
+    const fn = global[name];
+    if (typeof fn !== 'function') {
+        throw new Error(`${name} is not a function`);
+    }
+    return fn(...args);
+}
+
+const rl = readline.createInterface({input: process.stdin});
+rl.on('line', (line) => {
+    let req;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        return;
+    }
+    const res = {id: req.id};
+    try {
+        if (req.batch) {
+            // 每一项单独捕获异常, 一项失败不影响其他项的结果
+            res.result = req.batch.map((args) => {
+                try {
+                    return {result: call(req.fn, args)};
+                } catch (e) {
+                    return {error: errorText(e)};
+                }
+            });
+        } else {
+            res.result = call(req.fn, req.args || []);
+        }
+    } catch (e) {
+        res.error = errorText(e);
+    }
+    write(JSON.stringify(res) + '\n');
+});
+rl.on('close', () => process.exit(0));
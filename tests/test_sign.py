@@ -0,0 +1,130 @@
+import json
+import os
+import random
+import shutil
+import string
+import subprocess
+import pytest
+from xhs_utils.js_pool_util import Js_Worker, STATIC_PATH
+from xhs_utils.xhs_sign_util import xs_common
+
+"""
+    python 的 x-s-common (xhs_utils/xhs_sign_util.py) 与 static/xhs_xs_xsc_56.js 中 XsCommon 的差异测试
+    XsCommon 及其依赖的 encrypt_* 函数不需要浏览器环境, 从脚本中截取后单独加载, 只需要 node
+    完整签名流程 get_request_headers_params 的对比需要 jsdom (npm install)
+"""
+
+NODE_BIN = os.getenv('XHS_NODE_BIN', 'node')
+SIGN_SCRIPT = os.path.join(STATIC_PATH, 'xhs_xs_xsc_56.js')
+
+# 截取 encrypt_* 函数和 XsCommon, 跳过 jsdom 初始化和 window._webmsxyw
+XS_COMMON_JS = """
+var source = require('fs').readFileSync(%s, 'utf-8');
+function between(start, end) {
+    var i = source.indexOf(start);
+    var j = source.indexOf(end, i);
+    if (i < 0 || j < 0) {
+        throw new Error('没有找到 ' + start);
+    }
+    return source.slice(i, j);
+}
+(0, eval)(between('var esm_typeof', 'function L(h, b)') + between('const fff', 'function get_request_headers_params'));
+"""
+
+SEED = 56
+CASES = 5000
+BATCH = 500
+
+A1_LIST = [
+    '189d533c32bwp462awbnt4domm5ahdx406sgskfho50000420914',
+    '18c8a8b1e2fy1kbkq3ubzm4k8d0m3t2qfhn1pfgaz50000123456',
+    '',
+]
+
+PAYLOADS = [
+    # (x-s, x-t)
+    ('XYW_eyJzaWduU3ZuIjoiNTYiLCJzaWduVHlwZSI6IngyIiwiYXBwSWQiOiJ4aHMtcGMtd2ViIiwic2lnblZlcnNpb24iOiIxIiwicGF5bG9hZCI6IjAwMCJ9', 1700000000000),
+    ('XYW_' + 'A' * 400, 1735689600123),
+    ('XYW_abc+/=', 1),
+    ('', 0),
+    ('XYW_' + ''.join(chr(c) for c in range(0x21, 0x7f)), 4102444800000),
+]
+
+
+def generate_cases(seed=SEED, count=CASES):
+    """
+        按固定种子生成 (a1, x-s, x-t), 覆盖真实格式的 a1 和 x-s, 以及需要 json 转义的字符和单字节的非 ascii 字符
+    """
+    rand = random.Random(seed)
+    b64_chars = string.ascii_letters + string.digits + '+/'
+    cases = [(a1, xs, xt) for a1 in A1_LIST for xs, xt in PAYLOADS]
+    while len(cases) < count:
+        kind = rand.random()
+        if kind < 0.6:
+            a1 = ''.join(rand.choice(string.digits + string.ascii_lowercase) for _ in range(52))
+            xs = 'XYW_' + ''.join(rand.choice(b64_chars) for _ in range(rand.randint(0, 600))) + '=' * rand.randint(0, 2)
+        else:
+            a1 = ''.join(chr(rand.randint(0, 0xFF)) for _ in range(rand.randint(0, 60)))
+            xs = ''.join(chr(rand.randint(0, 0xFF)) for _ in range(rand.randint(0, 300)))
+        xt = rand.choice([0, 1, 2 ** 31 - 1, 2 ** 31, 2 ** 32]) if rand.random() < 0.05 else rand.randint(1500000000000, 2000000000000)
+        cases.append((a1, xs, xt))
+    return cases
+
+
+def has_jsdom():
+    try:
+        return subprocess.run([NODE_BIN, '-e', 'require("jsdom")'], cwd=STATIC_PATH, capture_output=True, timeout=30).returncode == 0
+    except OSError:
+        return False
+
+
+@pytest.fixture(scope='module')
+def xs_common_worker(tmp_path_factory):
+    if shutil.which(NODE_BIN) is None:
+        pytest.skip('没有安装 node')
+    script_path = tmp_path_factory.mktemp('sign') / 'xs_common.js'
+    script_path.write_text(XS_COMMON_JS % json.dumps(SIGN_SCRIPT), encoding='utf-8')
+    worker = Js_Worker(str(script_path), NODE_BIN)
+    yield worker
+    worker.close()
+
+
+@pytest.fixture(scope='module')
+def sign_worker():
+    if shutil.which(NODE_BIN) is None:
+        pytest.skip('没有安装 node')
+    if not has_jsdom():
+        pytest.skip('没有安装 jsdom')
+    worker = Js_Worker(SIGN_SCRIPT, NODE_BIN)
+    yield worker
+    worker.close()
+
+
+def test_generate_cases_is_stable():
+    cases = generate_cases()
+    assert len(cases) == CASES
+    assert len(set(cases)) == CASES
+    assert cases == generate_cases()
+
+
+def test_xs_common_matches_js(xs_common_worker):
+    cases = generate_cases()
+    mismatches = []
+    for start in range(0, len(cases), BATCH):
+        chunk = cases[start:start + BATCH]
+        rets = xs_common_worker.request({'fn': 'XsCommon', 'batch': [list(case) for case in chunk]}, timeout=120)
+        for case, ret in zip(chunk, rets):
+            assert 'error' not in ret, ret['error']
+            if xs_common(*case) != ret['result']:
+                mismatches.append(case)
+    assert not mismatches, f'{len(mismatches)} / {len(cases)} 不一致, 第一组: {mismatches[0]!r}'
+
+
+@pytest.mark.parametrize('api,data', [
+    ('/api/sns/web/v1/feed', {'source_note_id': '6767de72000000001301984c', 'image_formats': ['jpg', 'webp', 'avif'], 'extra': {'need_body_topic': '1'}, 'xsec_source': 'pc_search', 'xsec_token': 'ABc'}),
+    ('/api/sns/web/v2/comment/page?note_id=6767de72000000001301984c&cursor=&top_comment_id=&image_formats=jpg,webp,avif&xsec_token=ABc', ''),
+])
+def test_signed_xs_common_matches_js(sign_worker, api, data):
+    # 使用 js 实际生成的 x-s 和 x-t, 对比完整签名流程中的 x-s-common
+    ret = sign_worker.call('get_request_headers_params', api, data, A1_LIST[0])
+    assert xs_common(A1_LIST[0], ret['xs'], ret['xt']) == ret['xs_common']
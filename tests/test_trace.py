@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from xhs_utils.trace_util import Tracer, current_job
+
+"""
+    Trace_Job 嵌套时的报告, 以及并发任务的 span 归属
+"""
+
+
+def test_nested_job_then_next_job():
+    tracer = Tracer(enabled=True)
+    with tracer.job('outer') as outer:
+        with tracer.job('inner') as inner:
+            with tracer.span('http', endpoint='feed'):
+                pass
+    assert outer.report is not None
+    assert inner.report is None
+    assert current_job.get() is None
+    assert tracer.active_jobs == 0
+    assert tracer.spans == []
+
+    with tracer.job('next') as next_job:
+        with tracer.span('note', note_id='1'):
+            pass
+    assert next_job.outermost
+    assert next_job.report['job'] == 'next'
+    assert next_job.report['stages']['note']['count'] == 1
+    assert 'http' not in next_job.report['stages']
+    assert current_job.get() is None
+    assert tracer.spans == []
+
+
+def test_nested_job_exits_on_error():
+    tracer = Tracer(enabled=True)
+    try:
+        with tracer.job('outer'):
+            with tracer.job('inner'):
+                raise ValueError()
+    except ValueError:
+        pass
+    assert current_job.get() is None
+    assert tracer.active_jobs == 0
+
+
+def test_disabled_job():
+    tracer = Tracer(enabled=False)
+    with tracer.job('outer') as job:
+        with tracer.job('inner'):
+            pass
+    assert job.report is None
+    assert current_job.get() is None
+
+
+def test_concurrent_jobs_only_report_own_spans():
+    tracer = Tracer(enabled=True)
+    started = threading.Barrier(2)
+    reports = {}
+
+    def run(name):
+        with tracer.job(name) as job:
+            started.wait()
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                futures = [pool.submit(tracer.bind(record), name) for _ in range(3)]
+                for future in futures:
+                    future.result()
+            started.wait()
+        reports[name] = job.report
+
+    def record(name):
+        with tracer.span(name):
+            pass
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert list(reports['a']['stages']) == ['a']
+    assert reports['a']['stages']['a']['count'] == 3
+    assert list(reports['b']['stages']) == ['b']
+    assert tracer.active_jobs == 0
+    assert tracer.spans == []
@@ -0,0 +1,54 @@
+import os
+import shutil
+import pytest
+from xhs_utils.js_pool_util import Js_Worker, STATIC_PATH
+from xhs_utils.xhs_util import generate_xray_traceid_py
+
+"""
+    generate_xray_traceid_py 与 static/xhs_xray.js 中 traceId 的一致性测试
+    js 中的自增序号和随机数替换为固定值, 在同一个 node 进程中对比
+"""
+
+FIXED_XRAY_JS = """
+(0, eval)(require('fs').readFileSync(require('path').join(process.cwd(), 'xhs_xray.js'), 'utf-8'));
+function fixedTraceId(timestamp, seq, low, high) {
+    var randoms = [low, high];
+    a.Int.seq = function () { return seq; };
+    a.Int.random = function () { return randoms.shift(); };
+    return traceId(timestamp);
+}
+"""
+
+CASES = [
+    # (毫秒时间戳, 自增序号, 随机数低 32 位, 随机数高 32 位)
+    (1700000000000, 0, 0, 0),
+    (1700000000000, 1, 1, 1),
+    (1735689600123, 2 ** 23 - 1, 2 ** 32 - 1, 2 ** 32 - 1),
+    (1735689600123, 4194304, 123456789, 987654321),
+    (1, 12345, 2 ** 31, 2 ** 31 - 1),
+    (4102444800000, 8388000, 3735928559, 305419896),
+    (1712345678901, 77, 16, 4096),
+]
+
+
+@pytest.fixture(scope='module')
+def xray_worker(tmp_path_factory):
+    if shutil.which(os.getenv('XHS_NODE_BIN', 'node')) is None:
+        pytest.skip('没有安装 node')
+    script_path = tmp_path_factory.mktemp('xray') / 'fixed_xray.js'
+    script_path.write_text(FIXED_XRAY_JS, encoding='utf-8')
+    worker = Js_Worker(str(script_path), os.getenv('XHS_NODE_BIN', 'node'))
+    yield worker
+    worker.close()
+
+
+@pytest.mark.parametrize('timestamp,seq,low,high', CASES)
+def test_traceid_matches_js(xray_worker, timestamp, seq, low, high):
+    expected = xray_worker.call('fixedTraceId', timestamp, seq, low, high)
+    assert generate_xray_traceid_py(timestamp, seq, (high << 32) | low) == expected
+
+
+def test_traceid_format():
+    traceid = generate_xray_traceid_py()
+    assert len(traceid) == 32
+    int(traceid, 16)
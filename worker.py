@@ -0,0 +1,291 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import urllib.parse
+from loguru import logger
+from main import Data_Spider
+from xhs_utils.common_util import init, load_cookies_list
+from xhs_utils.http_util import Session_Pool
+from xhs_utils.account_util import Account_Pool
+from xhs_utils.data_util import handle_comment_info, Data_Sink, open_sink
+from xhs_utils.db_util import Sqlite_Store
+from xhs_utils.journal_util import Job_Journal
+from xhs_utils.queue_util import Task_Queue, Sqlite_Queue, Redis_Queue
+from xhs_utils.metrics_util import metrics, start_metrics_server
+
+
+class Crawl_Worker():
+    """
+        从共享任务队列中取任务并爬取, 同一个队列可以由多个进程, 多台机器上的 worker 同时消费
+        任务类型:
+            note: {'url': 笔记链接}
+            user: {'url': 用户链接, 'incremental': 是否增量爬取}, 翻页后每个笔记生成一个 note 任务, 增量爬取时再生成一个 user_state 任务
+            user_state: {'user_id': 用户id, 'newest_note_id': 最新的笔记id, 'tasks': note 任务id}, note 任务全部完成后更新增量爬取的进度
+            search: {'query': 关键词, 'require_num': 数量, 以及 spider_some_search_note 的筛选参数}, 每个笔记生成一个 note 任务
+            comments: {'url': 笔记链接}, 保存一级评论, 有更多二级评论的评论生成 comment_expand 任务
+            comment_expand: {'comment': 一级评论, 'xsec_token': xsec_token, 'note_url': 笔记链接}
+        任务成功后 ack, 抛出异常时 nack, 由队列决定重试还是进入死信队列
+        :param data_spider: Data_Spider, 笔记通过它的 sink 和 store 输出
+        :param queue: Sqlite_Queue 或 Redis_Queue
+        :param cookies_str: 你的cookies, 为 None 时使用 data_spider 的账号池
+        :param save_choice: 同 spider_some_note, 笔记信息不单独保存 excel, 统一写入 data_spider 的 sink 和 store
+        :param lease: 任务租约秒数, 处理期间每 lease / 3 秒续约一次
+        :param comment_sink: 评论的输出, 评论同时写入 data_spider 的 store
+        :param journal_dir: note 任务的日志目录, 默认使用 data_spider 的 journal_dir, 没有则为 datas/jobs
+        :param state_check_interval: note 任务没有全部完成时, 隔多少秒再检查一次 user_state 任务
+    """
+    def __init__(self, data_spider: Data_Spider, queue: Task_Queue, cookies_str: str, base_path: dict, save_choice: str = 'media', proxies=None, worker_id: str = None, lease: float = 600, comment_sink: Data_Sink = None, journal_dir: str = None, state_check_interval: float = 30):
+        self.data_spider = data_spider
+        self.xhs_apis = data_spider.xhs_apis
+        self.queue = queue
+        self.cookies_str = cookies_str
+        self.base_path = base_path
+        # excel 只在所有笔记爬取完成后一次性写入, 由 sink 代替, 这里只保留媒体文件的选项
+        self.save_choice = {'all': 'media', 'excel': 'none'}.get(save_choice, save_choice)
+        if save_choice in ('all', 'excel') and data_spider.sink is None and data_spider.store is None:
+            logger.warning('data_spider 没有设置 sink 和 store, 笔记信息不会保存')
+        self.proxies = proxies
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease = lease
+        self.comment_sink = comment_sink
+        self.journal_dir = journal_dir or data_spider.journal_dir or os.path.abspath(os.path.join(os.path.dirname(__file__), 'datas/jobs'))
+        self.state_check_interval = state_check_interval
+        self.processed = 0
+        self.failed = 0
+        for status in ('pending', 'leased', 'dead'):
+            metrics.register_gauge('xhs_queue_depth', lambda status=status: self.queue.stats()[status], queue=f'tasks_{status}')
+
+    def handle_note(self, payload):
+        note_url = payload['url']
+        note_id = urllib.parse.urlparse(note_url).path.split("/")[-1]
+        # 笔记信息和媒体文件全部完成才 ack, 失败时保留日志, 重试时只补充没有完成的部分
+        journal = Job_Journal.for_job(self.journal_dir, 'task', note_url, self.save_choice)
+        try:
+            self.data_spider.spider_some_note([note_url], self.cookies_str, self.base_path, self.save_choice, proxies=self.proxies, journal=journal)
+            if note_id not in journal.notes:
+                raise Exception(f'爬取笔记失败 {note_url}')
+            if not journal.complete:
+                raise Exception(f'下载笔记媒体文件失败 {note_url}')
+        finally:
+            journal.close(remove=note_id in journal.notes and journal.complete)
+
+    def handle_user(self, payload):
+        user_url = payload['url']
+        incremental = payload.get('incremental', False)
+        note_urls, newest_note_id = self.data_spider.list_user_notes(user_url, self.cookies_str, self.proxies, incremental)
+        task_ids = self.queue.put_many('note', [{'url': note_url} for note_url in note_urls])
+        # 增量爬取的进度在 note 任务全部完成后由 user_state 任务更新
+        if incremental and newest_note_id is not None:
+            user_id = urllib.parse.urlparse(user_url).path.split("/")[-1]
+            self.queue.put('user_state', {'user_id': user_id, 'newest_note_id': newest_note_id, 'tasks': task_ids}, delay=self.state_check_interval if task_ids else 0)
+        logger.info(f'用户 {user_url} 生成笔记任务: {len(note_urls)}')
+
+    def handle_user_state(self, payload):
+        statuses = self.queue.status(payload['tasks'])
+        dead = [task_id for task_id, status in statuses.items() if status == 'dead']
+        if dead:
+            # 不更新进度, 下次增量爬取时重新翻页, 已经保存的笔记会被跳过
+            logger.warning(f"用户 {payload['user_id']} 有 {len(dead)} 个笔记任务失败, 不更新增量爬取进度")
+            return
+        if all(status == 'done' for status in statuses.values()):
+            self.data_spider.store.set_user_state(payload['user_id'], payload['newest_note_id'])
+            logger.info(f"用户 {payload['user_id']} 增量爬取进度更新为 {payload['newest_note_id']}")
+            return
+        # 还有没完成的笔记任务, 稍后再检查, 不计入失败次数
+        self.queue.put('user_state', payload, delay=self.state_check_interval)
+
+    def handle_search(self, payload):
+        payload = dict(payload)
+        query = payload.pop('query')
+        require_num = payload.pop('require_num')
+        notes = self.data_spider.paginate(self.xhs_apis.iter_search_notes, self.cookies_str, cursor_arg='page', limit=require_num, query=query, proxies=self.proxies, **payload)[:require_num]
+        note_urls = [f"https://www.xiaohongshu.com/explore/{note['id']}?xsec_token={note['xsec_token']}" for note in notes if note['model_type'] == "note"]
+        self.queue.put_many('note', [{'url': note_url} for note_url in note_urls])
+        logger.info(f'搜索关键词 {query} 生成笔记任务: {len(note_urls)}')
+
+    def handle_comments(self, payload):
+        note_url = payload['url']
+        urlParse = urllib.parse.urlparse(note_url)
+        note_id = urlParse.path.split("/")[-1]
+        kvDist = dict(urllib.parse.parse_qsl(urlParse.query))
+        expands = []
+        for comments, cursor in self.data_spider.iter_api(self.xhs_apis.iter_note_out_comments, self.cookies_str, note_id=note_id, xsec_token=kvDist['xsec_token'], proxies=self.proxies):
+            for comment in comments:
+                self.save_comments([comment] + comment.get('sub_comments', []), note_url)
+                if comment['sub_comment_has_more']:
+                    expands.append({
+                        'comment': {key: comment[key] for key in ('id', 'note_id', 'sub_comment_cursor')},
+                        'xsec_token': kvDist['xsec_token'],
+                        'note_url': note_url,
+                    })
+        # 翻页完成后再生成任务, 重试时不会重复生成
+        self.queue.put_many('comment_expand', expands)
+        logger.info(f'笔记 {note_url} 生成二级评论任务: {len(expands)}')
+
+    def handle_comment_expand(self, payload):
+        for comments, cursor in self.data_spider.iter_api(self.xhs_apis.iter_note_inner_comments, self.cookies_str, comment=payload['comment'], xsec_token=payload['xsec_token'], proxies=self.proxies):
+            self.save_comments(comments, payload['note_url'])
+
+    def save_comments(self, comments, note_url):
+        for comment in comments:
+            comment['note_url'] = note_url
+            comment_info = handle_comment_info(comment)
+            if self.data_spider.store is not None:
+                self.data_spider.store.upsert_comment(comment_info)
+            if self.comment_sink is not None:
+                self.comment_sink.write(comment_info)
+        if self.data_spider.store is not None:
+            self.data_spider.store.flush('comment')
+
+    def process(self, task):
+        handler = getattr(self, f"handle_{task['type']}", None)
+        if handler is None:
+            self.queue.nack(task, f"未知的任务类型 {task['type']}")
+            self.failed += 1
+            return False
+        # 处理时间较长的任务定时续约, 避免被其他 worker 重复领取
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease / 3):
+                self.queue.extend(task, self.lease)
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        start = time.monotonic()
+        try:
+            handler(task['payload'])
+            self.queue.ack(task)
+            self.processed += 1
+            metrics.inc('xhs_tasks_total', type=task['type'], result='success')
+            return True
+        except Exception as e:
+            logger.warning(f"任务失败 {task['type']} {task['payload']} 第 {task['attempts']} 次: {e}")
+            self.queue.nack(task, str(e))
+            self.failed += 1
+            metrics.inc('xhs_tasks_total', type=task['type'], result='failed')
+            return False
+        finally:
+            done.set()
+            thread.join()
+            metrics.observe('xhs_task_seconds', time.monotonic() - start, type=task['type'])
+
+    def run(self, max_tasks: int = None, idle_timeout: float = None, poll_interval: float = 1):
+        """
+            循环取任务并处理
+            :param max_tasks: 处理的任务数量达到 max_tasks 后退出
+            :param idle_timeout: 队列为空超过 idle_timeout 秒后退出, 为 None 时一直等待新任务
+        """
+        idle_since = time.time()
+        while max_tasks is None or self.processed + self.failed < max_tasks:
+            task = self.queue.get(self.worker_id, self.lease)
+            if task is None:
+                if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            self.process(task)
+            idle_since = time.time()
+        logger.info(f'worker {self.worker_id} 退出: 成功 {self.processed}, 失败 {self.failed}')
+        return self.processed, self.failed
+
+
+def open_queue(args):
+    if args.redis:
+        import redis
+        return Redis_Queue(redis.Redis.from_url(args.redis, decode_responses=True), args.name, args.max_attempts)
+    return Sqlite_Queue(args.queue, args.max_attempts)
+
+
+def run_worker(args, index):
+    cookies_str, base_path = init()
+    session_pool = Session_Pool()
+    account_pool = None
+    if args.multi_account:
+        account_pool = Account_Pool(load_cookies_list())
+        cookies_str = None
+    store = Sqlite_Store(args.db) if args.db else None
+    sink = None
+    if args.output:
+        # 每个进程写入自己的文件, 避免多个进程同时写同一个文件
+        root, ext = os.path.splitext(args.output)
+        sink = open_sink(f'{root}_{index}{ext}' if args.processes > 1 else args.output)
+    data_spider = Data_Spider(session_pool, workers=1, media_workers=args.media_workers, sink=sink, store=store, account_pool=account_pool, journal_dir=args.journal_dir)
+    queue = open_queue(args)
+    if args.metrics_port:
+        # 每个进程一个端口
+        start_metrics_server(args.metrics_port + index, args.metrics_host)
+    worker = Crawl_Worker(data_spider, queue, cookies_str, base_path, args.save_choice, worker_id=f'{socket.gethostname()}-{os.getpid()}-{index}', lease=args.lease)
+    try:
+        worker.run(idle_timeout=args.idle_timeout)
+    finally:
+        if sink is not None:
+            sink.close()
+        if store is not None:
+            store.close()
+        queue.close()
+
+
+if __name__ == '__main__':
+    """
+        worker 模式, 多个进程或多台机器共用一个任务队列
+        python worker.py put note <笔记链接> ...          添加任务
+        python worker.py put user <用户链接> ...
+        python worker.py put search <关键词> --require-num 20
+        python worker.py put comments <笔记链接> ...
+        python worker.py run --processes 4              启动 4 个 worker 进程
+        python worker.py run --output datas/notes.xlsx  笔记信息写入文件, 多个进程时第 i 个进程写入 notes_i.xlsx
+        python worker.py stats                          查看队列状态和死信
+        python worker.py run --processes 4 --metrics-port 9108    第 i 个进程在 9108 + i 端口提供 /metrics
+        默认使用 datas/queue.db, 多台机器时使用 --redis redis://host:6379/0, 需要安装 redis
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue', default=os.path.abspath(os.path.join(os.path.dirname(__file__), 'datas/queue.db')))
+    parser.add_argument('--redis', default=None)
+    parser.add_argument('--name', default='xhs')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    put_parser = subparsers.add_parser('put')
+    put_parser.add_argument('type', choices=['note', 'user', 'search', 'comments'])
+    put_parser.add_argument('targets', nargs='+')
+    put_parser.add_argument('--require-num', type=int, default=10)
+    put_parser.add_argument('--incremental', action='store_true')
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--processes', type=int, default=1)
+    run_parser.add_argument('--save-choice', default='media')
+    run_parser.add_argument('--db', default=None)
+    run_parser.add_argument('--output', default=None)
+    run_parser.add_argument('--journal-dir', default=None)
+    run_parser.add_argument('--media-workers', type=int, default=8)
+    run_parser.add_argument('--lease', type=float, default=600)
+    run_parser.add_argument('--idle-timeout', type=float, default=None)
+    run_parser.add_argument('--multi-account', action='store_true')
+    run_parser.add_argument('--metrics-port', type=int, default=None)
+    run_parser.add_argument('--metrics-host', default='127.0.0.1')
+    subparsers.add_parser('stats')
+    args = parser.parse_args()
+
+    if args.command == 'put':
+        queue = open_queue(args)
+        if args.type == 'search':
+            payloads = [{'query': query, 'require_num': args.require_num} for query in args.targets]
+        elif args.type == 'user':
+            payloads = [{'url': url, 'incremental': args.incremental} for url in args.targets]
+        else:
+            payloads = [{'url': url} for url in args.targets]
+        queue.put_many(args.type, payloads)
+        logger.info(f'添加任务 {args.type}: {len(payloads)}')
+    elif args.command == 'run':
+        processes = [multiprocessing.Process(target=run_worker, args=(args, index)) for index in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        queue = open_queue(args)
+        logger.info(f'队列状态: {queue.stats()}')
+        for task in queue.dead_letters():
+            logger.info(f"死信 {task['id']} {task['type']} {task['payload']}: {task['error']}")
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import deque
+from loguru import logger
+from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.rate_limit_util import THROTTLE_CODES, THROTTLE_KEYWORDS
+
+# 账号失效时的提示, 出现后账号长时间停用
+INVALID_KEYWORDS = ('登录', '账号异常', '封禁')
+# 登录失效, 验证码和限流计入账号的错误, 笔记被删除或不可见等其他失败与账号无关
+ACCOUNT_ERROR_CODES = {-100, -101, -104, 300011} | THROTTLE_CODES
+ACCOUNT_ERROR_KEYWORDS = INVALID_KEYWORDS + THROTTLE_KEYWORDS + ('验证',)
+
+
+def is_account_error(msg=None, code=None):
+    return code in ACCOUNT_ERROR_CODES or any(keyword in str(msg or '') for keyword in ACCOUNT_ERROR_KEYWORDS)
+
+
+class Account():
+    """
+        一个账号, cookies 只在创建时解析一次
+        :param cookies_str: 账号的cookies
+        :param window: 统计最近多少次请求的错误率
+    """
+    def __init__(self, cookies_str: str, window: int = 20):
+        self.cookies_str = cookies_str
+        self.cookies = trans_cookies(cookies_str)
+        self.a1 = self.cookies.get('a1')
+        self.results = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.in_flight = 0
+        self.last_used = 0
+        self.disabled_until = 0
+        self.disabled_times = 0
+        self.last_error = None
+
+    @property
+    def error_rate(self):
+        return self.results.count(False) / len(self.results) if self.results else 0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.disabled_until
+
+    def stats(self):
+        return {
+            'a1': self.a1,
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.error_rate, 3),
+            'in_flight': self.in_flight,
+            'disabled_for': round(max(0, self.disabled_until - time.monotonic()), 2),
+            'last_error': self.last_error,
+        }
+
+
+class Account_Pool():
+    """
+        多账号调度, 每次请求选择 限速等待时间 + 正在进行的请求 + 最近错误率 综合最小的账号
+        连续失败或者错误率过高的账号暂停使用, 暂停时间指数增长, 提示需要登录的账号长时间停用
+        :param cookies_list: 账号的cookies列表
+        :param rate_limiter: Rate_Limiter, 传入时优先选择限速预算充足的账号, 应与 Session_Pool 使用同一个
+        :param max_consecutive_errors: 连续失败多少次后暂停
+        :param max_error_rate: 最近的错误率超过多少后暂停
+        :param cooldown: 第一次暂停的秒数
+        :param invalid_cooldown: 账号失效后停用的秒数
+    """
+    def __init__(self, cookies_list: list, rate_limiter=None, window: int = 20, max_consecutive_errors: int = 3, max_error_rate: float = 0.5, cooldown: float = 60, max_cooldown: float = 3600, invalid_cooldown: float = 86400):
+        self.accounts = []
+        seen = set()
+        for cookies_str in cookies_list:
+            cookies_str = cookies_str.strip()
+            if not cookies_str:
+                continue
+            account = Account(cookies_str, window)
+            if account.a1 is None or account.a1 in seen:
+                logger.warning(f'跳过没有 a1 或重复的 cookies')
+                continue
+            seen.add(account.a1)
+            self.accounts.append(account)
+        if not self.accounts:
+            raise ValueError('没有可用的 cookies')
+        self.rate_limiter = rate_limiter
+        self.window = window
+        self.max_consecutive_errors = max_consecutive_errors
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.invalid_cooldown = invalid_cooldown
+        self.lock = threading.Lock()
+
+    def score(self, account: Account, url: str = None):
+        delay = self.rate_limiter.delay(account.a1, url) if self.rate_limiter is not None else 0
+        # 错误数按整个统计窗口计算, 避免刚开始请求时一次失败就让错误率变成 100%
+        return delay + account.in_flight + account.results.count(False) / self.window * 10
+
+    def acquire(self, url: str = None):
+        """
+            选择一个账号, 使用完需要调用 release 报告结果
+            :param url: 将要请求的接口, 用于按接口的限速预算选择账号
+        """
+        with self.lock:
+            accounts = [account for account in self.accounts if account.available]
+            if not accounts:
+                raise Exception('没有可用的账号, 所有账号都在暂停中')
+            # 分数相同时选择最久没有使用的账号, 请求在账号之间轮流分配
+            account = min(accounts, key=lambda account: (self.score(account, url), account.last_used))
+            account.in_flight += 1
+            account.last_used = time.monotonic()
+        return account
+
+    def release(self, account: Account, success: bool, msg=None, code=None):
+        """
+            报告请求结果, 根据结果更新账号的健康状态
+            只有 is_account_error 的失败计入账号的错误, 其他失败按成功处理
+            :param code: 响应中的错误码
+        """
+        success = success or not is_account_error(msg, code)
+        with self.lock:
+            account.in_flight -= 1
+            account.requests += 1
+            account.results.append(bool(success))
+            if success:
+                account.consecutive_errors = 0
+                return
+            account.errors += 1
+            account.consecutive_errors += 1
+            account.last_error = str(msg)
+            if any(keyword in str(msg) for keyword in INVALID_KEYWORDS):
+                self.disable(account, self.invalid_cooldown)
+            elif account.consecutive_errors >= self.max_consecutive_errors or (len(account.results) >= self.window and account.error_rate > self.max_error_rate):
+                self.disable(account, min(self.max_cooldown, self.cooldown * 2 ** account.disabled_times))
+
+    def disable(self, account: Account, cooldown: float):
+        account.disabled_until = time.monotonic() + cooldown
+        account.disabled_times += 1
+        account.consecutive_errors = 0
+        account.results.clear()
+        logger.warning(f'账号 {account.a1} 暂停使用 {cooldown:.0f} 秒, msg: {account.last_error}')
+
+    def call(self, func, *args, url: str = None, **kwargs):
+        """
+            选择一个账号调用 XHS_Apis 的接口, func 的 cookies_str 参数由账号池填入
+            例如 account_pool.call(xhs_apis.get_note_info, note_url, url='/api/sns/web/v1/feed')
+            返回 func 的返回值 (success, msg, res_json), 批量接口返回它们的列表
+            :param url: 将要请求的接口
+        """
+        account = self.acquire(url)
+        success, msg, code = False, None, None
+        try:
+            result = func(*args, cookies_str=account.cookies_str, **kwargs)
+            # 批量接口中有一个请求出现账号错误时按失败报告
+            success = True
+            for item_success, item_msg, item_json in result if isinstance(result, list) else [result]:
+                item_code = item_json.get('code') if isinstance(item_json, dict) else None
+                if not item_success and is_account_error(item_msg, item_code):
+                    success, msg, code = False, item_msg, item_code
+                    break
+            return result
+        except Exception as e:
+            msg = str(e)
+            raise
+        finally:
+            self.release(account, success, msg, code)
+
+    def stats(self):
+        with self.lock:
+            return [account.stats() for account in self.accounts]
+
+    def __len__(self):
+        return len(self.accounts)
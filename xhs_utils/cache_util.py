@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 每个接口的默认缓存时间(秒), 没有配置的接口不缓存
+DEFAULT_TTLS = {
+    'note_info': 3600,
+    'user_info': 3600,
+    'note_video': 86400,
+}
+
+
+class Response_Cache():
+    """
+        接口响应的本地缓存, 按 接口 + 笔记id/用户id 缓存, 与签名和 xsec_token 无关
+        基于 sqlite, 多个进程可以共用同一个缓存文件
+        超过 max_size 字节时按最近访问时间淘汰, 过期的缓存每写入 purge_interval 次清理一次
+        :param db_path: 缓存文件路径, 默认读取环境变量 XHS_CACHE_PATH, 没有则为 datas/cache.db
+        :param ttls: 每个接口的缓存时间(秒), 会覆盖 DEFAULT_TTLS 中的配置
+        :param max_size: 缓存的最大字节数
+        :param purge_interval: 每写入多少次清理一次过期的缓存
+        :param touch_interval: 命中时最近访问时间早于多少秒才更新, 避免每次命中都写入数据库
+    """
+    def __init__(self, db_path: str = None, ttls: dict = None, max_size: int = 512 * 1024 * 1024, purge_interval: int = 100, touch_interval: float = 300):
+        self.db_path = db_path or os.getenv('XHS_CACHE_PATH', os.path.abspath(os.path.join(os.path.dirname(__file__), '../datas/cache.db')))
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_size = max_size
+        self.purge_interval = purge_interval
+        self.touch_interval = touch_interval
+        self.writes = 0
+        self.lock = threading.Lock()
+        # 其他进程写入时等待锁, 而不是直接报错
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "responses" ("endpoint" TEXT, "key" TEXT, "value" TEXT, "size" INTEGER, "expires_at" REAL, "accessed_at" REAL, PRIMARY KEY ("endpoint", "key"))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS "responses_accessed_at" ON "responses" ("accessed_at")')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS "responses_expires_at" ON "responses" ("expires_at")')
+        # 缓存的总字节数, 每次写入和删除时更新, 避免每次写入都统计整个表, 多个进程共用
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "cache_size" ("id" INTEGER PRIMARY KEY CHECK ("id" = 0), "size" INTEGER)')
+        self.conn.execute('INSERT OR IGNORE INTO "cache_size" SELECT 0, COALESCE(SUM("size"), 0) FROM "responses"')
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint: str, key: str):
+        """
+            读取缓存, 没有或者已经过期时返回 None
+        """
+        if not self.ttls.get(endpoint):
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT "value", "expires_at", "accessed_at" FROM "responses" WHERE "endpoint" = ? AND "key" = ?', (endpoint, key)).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+            # 淘汰只需要大致的访问顺序
+            if row[2] < now - self.touch_interval:
+                self.conn.execute('UPDATE "responses" SET "accessed_at" = ? WHERE "endpoint" = ? AND "key" = ?', (now, endpoint, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, endpoint: str, key: str, value):
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+        text = json.dumps(value, ensure_ascii=False)
+        size = len(text.encode('utf-8'))
+        if size > self.max_size:
+            return
+        now = time.time()
+        with self.lock:
+            self.writes += 1
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT "size" FROM "responses" WHERE "endpoint" = ? AND "key" = ?', (endpoint, key)).fetchone()
+                self.conn.execute('INSERT OR REPLACE INTO "responses" VALUES (?, ?, ?, ?, ?, ?)', (endpoint, key, text, size, now + ttl, now))
+                total = self.add_size(size - (row[0] if row else 0))
+                if total > self.max_size or self.writes % self.purge_interval == 0:
+                    self.evict(now, total)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def add_size(self, delta):
+        self.conn.execute('UPDATE "cache_size" SET "size" = "size" + ? WHERE "id" = 0', (delta,))
+        return self.conn.execute('SELECT "size" FROM "cache_size" WHERE "id" = 0').fetchone()[0]
+
+    def evict(self, now, total):
+        # 先删除过期的缓存, 仍然超过大小时从最久没有访问的开始删除
+        expired = self.conn.execute('SELECT COALESCE(SUM("size"), 0) FROM "responses" WHERE "expires_at" < ?', (now,)).fetchone()[0]
+        if expired:
+            self.conn.execute('DELETE FROM "responses" WHERE "expires_at" < ?', (now,))
+            total = self.add_size(-expired)
+        if total <= self.max_size:
+            return
+        freed = 0
+        keys = []
+        for endpoint, key, size in self.conn.execute('SELECT "endpoint", "key", "size" FROM "responses" ORDER BY "accessed_at"'):
+            keys.append((endpoint, key))
+            freed += size
+            if total - freed <= self.max_size:
+                break
+        self.conn.executemany('DELETE FROM "responses" WHERE "endpoint" = ? AND "key" = ?', keys)
+        self.add_size(-freed)
+
+    def delete(self, endpoint: str, key: str):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT "size" FROM "responses" WHERE "endpoint" = ? AND "key" = ?', (endpoint, key)).fetchone()
+                if row is not None:
+                    self.conn.execute('DELETE FROM "responses" WHERE "endpoint" = ? AND "key" = ?', (endpoint, key))
+                    self.add_size(-row[0])
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('DELETE FROM "responses"')
+                self.conn.execute('UPDATE "cache_size" SET "size" = 0 WHERE "id" = 0')
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def stats(self):
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM "responses"').fetchone()[0]
+            size = self.conn.execute('SELECT "size" FROM "cache_size" WHERE "id" = 0').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'count': count, 'size': size}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
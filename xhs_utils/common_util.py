@@ -7,6 +7,19 @@ def load_env():
     cookies_str = os.getenv('COOKIES')
     return cookies_str
 
+def load_cookies_list():
+    """
+        读取多个账号的cookies, 用于 Account_Pool
+        COOKIES 中每行一个账号, 或者 COOKIES_FILE 指定的文件中每行一个账号
+    """
+    load_dotenv()
+    cookies_list = (os.getenv('COOKIES') or '').splitlines()
+    cookies_file = os.getenv('COOKIES_FILE')
+    if cookies_file:
+        with open(cookies_file, encoding='utf-8') as f:
+            cookies_list.extend(f.read().splitlines())
+    return [cookies_str.strip() for cookies_str in cookies_list if cookies_str.strip()]
+
 def init():
     media_base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../datas/media_datas'))
     excel_base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../datas/excel_datas'))
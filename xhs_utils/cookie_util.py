@@ -1,6 +1,12 @@
-def trans_cookies(cookies_str):
+import functools
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_cookies(cookies_str):
     if '; ' in cookies_str:
-        ck = {i.split('=')[0]: '='.join(i.split('=')[1:]) for i in cookies_str.split('; ')}
-    else:
-        ck = {i.split('=')[0]: '='.join(i.split('=')[1:]) for i in cookies_str.split(';')}
-    return ck
+        return tuple((i.split('=')[0], '='.join(i.split('=')[1:])) for i in cookies_str.split('; '))
+    return tuple((i.split('=')[0], '='.join(i.split('=')[1:])) for i in cookies_str.split(';'))
+
+def trans_cookies(cookies_str):
+    # 同一个 cookies 只解析一次, 每次返回新的 dict, 调用方可以修改
+    return dict(parse_cookies(cookies_str))
@@ -1,19 +1,40 @@
+import abc
+import csv
+import hashlib
 import json
+import math
 import os
 import re
+import threading
 import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import openpyxl
-import requests
 from loguru import logger
 from retry import retry
+from xhs_utils.http_util import default_session_pool
+from xhs_utils.metrics_util import metrics
+from xhs_utils.trace_util import tracer
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# 无水印视频的 CDN 地址, 可以替换为本地的模拟服务器
+VIDEO_CDN = 'https://sns-video-bd.xhscdn.com/'
 
 
 def norm_str(str):
     new_str = re.sub(r"|[\\/:*?\"<>| ]+", "", str).replace('\n', '').replace('\r', '')
     return new_str
 
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
 def norm_text(text):
-    ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
     text = ILLEGAL_CHARACTERS_RE.sub(r'', text)
     return text
 
@@ -93,7 +114,7 @@ def handle_note_info(data):
             pass
     if note_type == '视频':
         video_cover = image_list[0]
-        video_addr = 'https://sns-video-bd.xhscdn.com/' + data['note_card']['video']['consumer']['origin_video_key']
+        video_addr = VIDEO_CDN + data['note_card']['video']['consumer']['origin_video_key']
         # success, msg, video_addr = XHS_Apis.get_note_no_water_video(note_id)
     else:
         video_cover = None
@@ -175,35 +196,607 @@ def handle_comment_info(data):
         'ip_location': ip_location,
         'pictures': pictures,
     }
-def save_to_xlsx(datas, file_path, type='note'):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    if type == 'note':
-        headers = ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地']
-    elif type == 'user':
-        headers = ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签']
+XLSX_HEADERS = {
+    'note': ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地'],
+    'user': ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签'],
+    'comment': ['笔记id', '笔记url', '评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表'],
+}
+# excel 单个 sheet 的最大行数
+XLSX_MAX_ROWS = 1048576
+# Xlsx_Writer 默认每写入多少行保存一个文件
+XLSX_FLUSH_ROWS = 10000
+
+
+# handle_note_info, handle_user_info, handle_comment_info 输出的字段
+SINK_FIELDS = {
+    'note': ['note_id', 'note_url', 'note_type', 'user_id', 'home_url', 'nickname', 'avatar', 'title', 'desc', 'liked_count', 'collected_count', 'comment_count', 'share_count', 'video_cover', 'video_addr', 'image_list', 'tags', 'upload_time', 'ip_location'],
+    'user': ['user_id', 'home_url', 'nickname', 'avatar', 'red_id', 'gender', 'ip_location', 'desc', 'follows', 'fans', 'interaction', 'tags'],
+    'comment': ['note_id', 'note_url', 'comment_id', 'user_id', 'home_url', 'nickname', 'avatar', 'content', 'show_tags', 'like_count', 'upload_time', 'ip_location', 'pictures'],
+}
+COUNT_FIELDS = {'liked_count', 'collected_count', 'comment_count', 'share_count', 'follows', 'fans', 'interaction', 'like_count'}
+LIST_FIELDS = {'image_list', 'tags', 'show_tags', 'pictures'}
+
+
+def parse_count(count):
+    """
+        把接口返回的数量转换为整数, 例如 '1.2万' -> 12000, '10+' -> 10, 无法解析时返回 None
+    """
+    if count is None or isinstance(count, int):
+        return count
+    text = str(count).strip().replace(',', '').rstrip('+')
+    unit = 1
+    if text.endswith('万'):
+        text, unit = text[:-1], 10000
+    elif text.endswith('亿'):
+        text, unit = text[:-1], 100000000
+    try:
+        return int(float(text) * unit)
+    except ValueError:
+        return None
+
+
+class Data_Sink(abc.ABC):
+    """
+        数据输出的基类, 逐条写入 handle_note_info, handle_user_info, handle_comment_info 的结果
+        :param file_path: 保存路径
+        :param type: note, user, comment
+    """
+    def __init__(self, file_path, type='note'):
+        self.file_path = file_path
+        self.type = type
+        self.rows = 0
+        # 每次打开的输出都不同, 任务日志按它记录笔记已经写入了哪个输出
+        self.sink_id = uuid.uuid4().hex
+
+    @abc.abstractmethod
+    def write(self, data: dict):
+        pass
+
+    def write_all(self, datas):
+        for data in datas:
+            self.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Jsonl_Sink(Data_Sink):
+    """
+        每行一个 json 的输出
+        :param flush_rows: 每写入多少行刷新一次文件
+    """
+    def __init__(self, file_path, type='note', flush_rows: int = 100):
+        super().__init__(file_path, type)
+        self.flush_rows = flush_rows
+        self.f = open(file_path, mode='w', encoding='utf-8')
+
+    def write(self, data: dict):
+        self.f.write(json.dumps(data, ensure_ascii=False) + '\n')
+        self.rows += 1
+        if self.rows % self.flush_rows == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+        logger.info(f'数据保存至 {self.file_path}')
+
+
+class Csv_Sink(Data_Sink):
+    """
+        csv 输出, 列表字段保存为 json 字符串, 使用 utf-8-sig 编码以便 excel 直接打开
+        :param flush_rows: 每写入多少行刷新一次文件
+    """
+    def __init__(self, file_path, type='note', flush_rows: int = 100):
+        super().__init__(file_path, type)
+        self.flush_rows = flush_rows
+        self.f = open(file_path, mode='w', encoding='utf-8-sig', newline='')
+        self.writer = csv.DictWriter(self.f, fieldnames=SINK_FIELDS[type], extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, data: dict):
+        row = {k: json.dumps(v, ensure_ascii=False) if k in LIST_FIELDS else v for k, v in data.items()}
+        self.writer.writerow(row)
+        self.rows += 1
+        if self.rows % self.flush_rows == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+        logger.info(f'数据保存至 {self.file_path}')
+
+
+class Parquet_Sink(Data_Sink):
+    """
+        parquet 输出, 数量字段为 int64, 列表字段为 list<string>, 需要安装 pyarrow
+        :param batch_rows: 每多少行写入一个 row group
+    """
+    def __init__(self, file_path, type='note', batch_rows: int = 10000):
+        if pyarrow is None:
+            raise ImportError('parquet 输出需要安装 pyarrow')
+        super().__init__(file_path, type)
+        self.batch_rows = batch_rows
+        self.fields = SINK_FIELDS[type]
+        self.schema = pyarrow.schema([(field, self.field_type(field)) for field in self.fields])
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+        self.buffer = []
+
+    @staticmethod
+    def field_type(field):
+        if field in COUNT_FIELDS:
+            return pyarrow.int64()
+        if field in LIST_FIELDS:
+            return pyarrow.list_(pyarrow.string())
+        return pyarrow.string()
+
+    def convert(self, field, value):
+        if field in COUNT_FIELDS:
+            return parse_count(value)
+        if field in LIST_FIELDS:
+            return [str(v) if not isinstance(v, str) else v for v in value] if value is not None else None
+        return str(value) if value is not None else None
+
+    def write(self, data: dict):
+        self.buffer.append({field: self.convert(field, data.get(field)) for field in self.fields})
+        self.rows += 1
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write_table(pyarrow.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        logger.info(f'数据保存至 {self.file_path}')
+
+
+class Xlsx_Writer(Data_Sink):
+    """
+        流式写入 excel, 使用 openpyxl 的 write_only 模式, 内存占用与数据量无关
+        单个 sheet 超过 excel 的行数上限时写入新的 sheet
+        :param file_path: 保存路径
+        :param type: note, user, comment
+        :param flush_rows: 每写入多少行保存一次文件, 之后的数据写入新的文件 xxx_2.xlsx, xxx_3.xlsx
+                           程序中途退出时已保存的文件不会丢失, 默认 XLSX_FLUSH_ROWS, 为 None 时只在 close 时保存为一个文件
+    """
+    def __init__(self, file_path, type='note', flush_rows: int = XLSX_FLUSH_ROWS):
+        super().__init__(file_path, type)
+        self.headers = XLSX_HEADERS.get(type, XLSX_HEADERS['comment'])
+        self.flush_rows = flush_rows
+        self.file_paths = []
+        self.open_workbook()
+
+    def open_workbook(self):
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.file_rows = 0
+        self.new_sheet()
+
+    def new_sheet(self):
+        self.ws = self.wb.create_sheet()
+        self.ws.append(self.headers)
+        self.sheet_rows = 1
+
+    def part_path(self):
+        if not self.file_paths:
+            return self.file_path
+        root, ext = os.path.splitext(self.file_path)
+        return f'{root}_{len(self.file_paths) + 1}{ext}'
+
+    def write(self, data: dict):
+        if self.sheet_rows >= XLSX_MAX_ROWS:
+            self.new_sheet()
+        self.ws.append([norm_text(str(v)) for v in data.values()])
+        self.sheet_rows += 1
+        self.file_rows += 1
+        self.rows += 1
+        if self.flush_rows and self.file_rows >= self.flush_rows:
+            self.save()
+            self.open_workbook()
+
+    def save(self):
+        file_path = self.part_path()
+        self.wb.save(file_path)
+        self.file_paths.append(file_path)
+        logger.info(f'数据保存至 {file_path}')
+
+    def close(self):
+        if self.file_rows > 0 or not self.file_paths:
+            self.save()
+        return self.file_paths
+
+
+SINKS = {
+    '.jsonl': Jsonl_Sink,
+    '.csv': Csv_Sink,
+    '.parquet': Parquet_Sink,
+    '.xlsx': Xlsx_Writer,
+}
+
+
+def open_sink(file_path, type='note'):
+    """
+        根据文件后缀创建输出, 支持 .jsonl .csv .parquet .xlsx
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in SINKS:
+        raise ValueError(f'不支持的文件类型 {ext}')
+    return SINKS[ext](file_path, type)
+
+
+def save_to_xlsx(datas, file_path, type='note', flush_rows: int = XLSX_FLUSH_ROWS):
+    """
+        保存数据到 excel
+        :param datas: 数据列表, 也可以是生成器
+        :param flush_rows: 每写入多少行保存一次文件, 见 Xlsx_Writer
+    """
+    with Xlsx_Writer(file_path, type, flush_rows) as writer:
+        writer.write_all(datas)
+    return writer.file_paths
+
+# 大于此大小且支持 Range 的视频分段下载
+VIDEO_SEGMENT_MIN_SIZE = 8 * 1024 * 1024
+VIDEO_SEGMENTS = 4
+
+
+def get_range_size(http, url, proxies=None):
+    """
+        获取支持 Range 请求的文件大小, 不支持时返回 None
+    """
+    try:
+        res = http.request('HEAD', url, allow_redirects=True, proxies=proxies)
+        if res.status_code != 200 or res.headers.get('Accept-Ranges') != 'bytes':
+            return None
+        return int(res.headers.get('Content-Length', 0)) or None
+    except Exception:
+        return None
+
+
+def save_download_progress(progress_path, url, total, segments):
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        json.dump({'url': url, 'total': total, 'segments': segments}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, progress_path)
+
+
+def load_download_progress(progress_path, tmp_path, url, total):
+    """
+        读取分段下载的进度, 地址或者大小与进度文件不一致时返回 None, 重新下载
+        地址只比较域名和路径, CDN 地址的查询参数 (签名, 过期时间) 每次获取笔记时都会变化
+    """
+    try:
+        with open(progress_path, mode='r', encoding='utf-8') as f:
+            progress = json.load(f)
+        saved_url, current_url = urllib.parse.urlsplit(progress['url']), urllib.parse.urlsplit(url)
+        if (saved_url.netloc, saved_url.path) != (current_url.netloc, current_url.path):
+            logger.warning(f'下载地址与进度文件不一致, 重新下载 {tmp_path}')
+            return None
+        if progress['total'] == total and os.path.getsize(tmp_path) == total:
+            return progress['segments']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def download_segmented(file_path, url, total, session_pool=None, segments=VIDEO_SEGMENTS, proxies=None):
+    """
+        使用多个 Range 请求并发下载一个文件
+        进度记录在 .part.json 中, 中断后再次调用会从上次的位置继续下载
+        下载完成后校验文件大小与 Content-Length 一致
+        :param total: 文件大小
+        返回下载的字节数
+    """
+    http = session_pool or default_session_pool
+    tmp_path = file_path + '.part'
+    progress_path = tmp_path + '.json'
+    chunk_size = 1024 * 1024
+    # 每一段为 [开始位置, 结束位置, 已下载字节数]
+    ranges = load_download_progress(progress_path, tmp_path, url, total)
+    if ranges is None:
+        step = math.ceil(total / segments)
+        ranges = [[start, min(start + step, total) - 1, 0] for start in range(0, total, step)]
+        with open(tmp_path, mode='wb') as f:
+            f.truncate(total)
+        save_download_progress(progress_path, url, total, ranges)
     else:
-        headers = ['笔记id', '笔记url', '评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表']
-    ws.append(headers)
-    for data in datas:
-        data = {k: norm_text(str(v)) for k, v in data.items()}
-        ws.append(list(data.values()))
-    wb.save(file_path)
-    logger.info(f'数据保存至 {file_path}')
-
-def download_media(path, name, url, type):
+        logger.info(f'继续下载 {file_path} 已完成 {sum(segment[2] for segment in ranges)}/{total}')
+    resumed = sum(segment[2] for segment in ranges)
+    lock = threading.Lock()
+
+    def fetch(segment):
+        start, end, done = segment
+        if start + done > end:
+            return
+        headers = {'Range': f'bytes={start + done}-{end}'}
+        with http.get(url, headers=headers, stream=True, proxies=proxies) as res:
+            if res.status_code != 206:
+                raise Exception(f'Range 请求失败 {res.status_code}')
+            with open(tmp_path, mode='r+b') as f:
+                f.seek(start + done)
+                for data in res.iter_content(chunk_size=chunk_size):
+                    data = data[:end + 1 - start - segment[2]]
+                    if not data:
+                        break
+                    f.write(data)
+                    # 数据写入磁盘后再记录进度, 断电后进度不会超过实际写入的数据
+                    f.flush()
+                    os.fsync(f.fileno())
+                    with lock:
+                        segment[2] += len(data)
+                        save_download_progress(progress_path, url, total, ranges)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        for future in [pool.submit(tracer.bind(fetch), segment) for segment in ranges]:
+            future.result()
+    if any(start + done <= end for start, end, done in ranges) or os.path.getsize(tmp_path) != total:
+        raise Exception(f'文件下载不完整 {file_path}')
+    os.replace(tmp_path, file_path)
+    os.remove(progress_path)
+    return total - resumed
+
+
+@retry(tries=3, delay=1)
+def download_media(path, name, url, type, session_pool=None, proxies=None):
+    """
+        流式下载一个图片或视频, 先写入 .part 临时文件, 下载完成后再重命名
+        较大的视频使用 Range 分段下载, 中断后可以继续下载
+        失败时只重试当前文件
+        :param proxies: 代理 dict 或 Proxy_Pool
+        返回下载的字节数
+    """
     if type == 'image':
-        content = requests.get(url).content
-        with open(path + '/' + name + '.jpg', mode="wb") as f:
-            f.write(content)
+        file_path = path + '/' + name + '.jpg'
     elif type == 'video':
-        res = requests.get(url, stream=True)
-        size = 0
-        chunk_size = 1024 * 1024
-        with open(path + '/' + name + '.mp4', mode="wb") as f:
+        file_path = path + '/' + name + '.mp4'
+    else:
+        return 0
+    http = session_pool or default_session_pool
+    start = time.monotonic()
+    if type == 'video':
+        total = get_range_size(http, url, proxies)
+        if total is not None and total >= VIDEO_SEGMENT_MIN_SIZE:
+            size = download_segmented(file_path, url, total, session_pool, proxies=proxies)
+            metrics.inc('xhs_download_bytes_total', size, type=type)
+            metrics.observe('xhs_download_seconds', time.monotonic() - start, type=type)
+            return size
+    tmp_path = file_path + '.part'
+    size = 0
+    chunk_size = 1024 * 1024
+    with http.get(url, stream=True, proxies=proxies) as res:
+        res.raise_for_status()
+        with open(tmp_path, mode="wb") as f:
             for data in res.iter_content(chunk_size=chunk_size):
                 f.write(data)
                 size += len(data)
+        content_length = res.headers.get('Content-Length')
+        if content_length and 'Content-Encoding' not in res.headers and size != int(content_length):
+            raise Exception(f'文件下载不完整 {file_path} {size}/{content_length}')
+    os.replace(tmp_path, file_path)
+    metrics.inc('xhs_download_bytes_total', size, type=type)
+    metrics.observe('xhs_download_seconds', time.monotonic() - start, type=type)
+    return size
+
+
+def get_img_id(img_url):
+    """
+        从 CDN 图片地址中解析出稳定的图片 id, 与地址中的时间戳和签名无关
+    """
+    # https://sns-webpic-qc.xhscdn.com/202403211626/c4fcecea4bd012a1fe8d2f1968d6aa91/110/0/01e50c1c135e8c010010000000018ab74db332_0.jpg!nd_dft_wlteh_webp_3
+    if '.jpg' in img_url:
+        return '/'.join([split for split in img_url.split('/')[-3:]]).split('!')[0]
+    # 'https://sns-webpic-qc.xhscdn.com/202403231640/ea961053c4e0e467df1cc93afdabd630/spectrum/1000g0k0200n7mj8fq0005n7ikbllol6q50oniuo!nd_dft_wgth_webp_3'
+    elif 'spectrum' in img_url:
+        return '/'.join(img_url.split('/')[-2:]).split('!')[0]
+    # 'http://sns-webpic-qc.xhscdn.com/202403181511/64ad2ea67ce04159170c686a941354f5/1040g008310cs1hii6g6g5ngacg208q5rlf1gld8!nd_dft_wlteh_webp_3'
+    else:
+        return img_url.split('/')[-1].split('!')[0]
+
+
+def get_media_id(url, type):
+    """
+        媒体文件的稳定 id, 图片为 CDN 中的图片 id, 视频为 origin_video_key, 无法解析时返回 None
+    """
+    try:
+        if type == 'image':
+            return get_img_id(url) or None
+        return urllib.parse.urlparse(url).path.strip('/') or None
+    except Exception:
+        return None
+
+
+class Media_Store():
+    """
+        内容寻址的媒体存储, 同一个图片或视频只下载和保存一次
+        对象以媒体 id 为 key, 无法解析 id 时使用文件内容的 sha256
+        笔记目录中的文件为指向对象的硬链接, 不支持硬链接时记录在笔记目录的 manifest.json 中
+        :param root: 对象的保存目录
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_root = os.path.join(self.root, 'tmp')
+        check_and_create_path(self.tmp_root)
+        self.lock = threading.Lock()
+        # key: [锁, 正在使用的线程数], 没有线程使用时删除, 避免每个对象留下一个锁
+        self.key_locks = {}
+
+    def acquire_key(self, key):
+        with self.lock:
+            entry = self.key_locks.get(key)
+            if entry is None:
+                entry = self.key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+
+    def release_key(self, key):
+        with self.lock:
+            entry = self.key_locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.key_locks[key]
+
+    def object_path(self, digest, suffix):
+        return os.path.join(self.root, 'objects', digest[:2], digest + suffix)
+
+    def id_object_path(self, media_id, suffix):
+        return self.object_path(hashlib.sha256(media_id.encode('utf-8')).hexdigest(), suffix)
+
+    def fetch(self, path, name, url, type, session_pool=None, proxies=None):
+        """
+            把媒体文件保存到笔记目录, 对象已经存在时不发起网络请求
+            返回 (下载的字节数, 是否复用了已有对象)
+        """
+        suffix = '.mp4' if type == 'video' else '.jpg'
+        file_path = path + '/' + name + suffix
+        media_id = get_media_id(url, type)
+        # 临时文件名由 id 或 url 决定, 中断的视频下载再次运行时可以继续
+        tmp_name = hashlib.sha256((media_id or url).encode('utf-8')).hexdigest()
+        # 同一个对象同时只下载一次
+        self.acquire_key(tmp_name)
+        try:
+            if media_id is not None:
+                obj_path = self.id_object_path(media_id, suffix)
+                if os.path.exists(obj_path):
+                    self.link(obj_path, file_path)
+                    return 0, True
+            size = download_media(self.tmp_root, tmp_name, url, type, session_pool, proxies)
+            tmp_path = os.path.join(self.tmp_root, tmp_name + suffix)
+            if media_id is None:
+                obj_path = self.object_path(file_sha256(tmp_path), suffix)
+            check_and_create_path(os.path.dirname(obj_path))
+            reused = os.path.exists(obj_path)
+            if reused:
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, obj_path)
+        finally:
+            self.release_key(tmp_name)
+        self.link(obj_path, file_path)
+        return size, reused
+
+    def link(self, obj_path, file_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(obj_path, file_path)
+        except OSError:
+            self.add_manifest(file_path, obj_path)
+
+    def add_manifest(self, file_path, obj_path):
+        manifest_path = os.path.join(os.path.dirname(file_path), 'manifest.json')
+        with self.lock:
+            manifest = {}
+            if os.path.exists(manifest_path):
+                with open(manifest_path, mode='r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            manifest[os.path.basename(file_path)] = os.path.relpath(obj_path, os.path.dirname(file_path))
+            with open(manifest_path, mode='w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, mode='rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class Media_Downloader():
+    """
+        媒体下载器, 所有笔记的图片和视频共用一个线程池, 并统计本次运行下载的字节数和耗时
+        :param workers: 同时下载的文件数量
+        :param session_pool: http 会话池, 默认使用全局共享的会话池
+        :param store: 内容寻址的媒体存储, 传入时已经下载过的媒体文件不会重复下载
+        :param proxies: 代理 dict 或 Proxy_Pool
+        :param journal: 任务日志 Job_Journal, 传入时记录已下载的文件, 日志中已完成的文件不再下载
+    """
+    def __init__(self, workers: int = 8, session_pool=None, store: Media_Store = None, proxies=None, journal=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media')
+        self.session_pool = session_pool
+        self.store = store
+        self.proxies = proxies
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.futures = []
+        self.start_time = time.time()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.reused = 0
+
+    def submit(self, path, name, url, type):
+        metrics.add('xhs_queue_depth', 1, queue='media')
+        future = self.executor.submit(tracer.bind(self.download), path, name, url, type)
+        future.add_done_callback(lambda future: metrics.add('xhs_queue_depth', -1, queue='media'))
+        with self.lock:
+            self.futures.append(future)
+        return future
+
+    def download(self, path, name, url, type):
+        reused = False
+        key = f'{path}/{name}.{type}'
+        if self.journal is not None and self.journal.has_media(key):
+            with self.lock:
+                self.reused += 1
+            return 0
+        try:
+            with tracer.span('download_media', type=type) as span:
+                if self.store is not None:
+                    size, reused = self.store.fetch(path, name, url, type, self.session_pool, self.proxies)
+                else:
+                    size = download_media(path, name, url, type, self.session_pool, self.proxies)
+                span.args['bytes'] = size
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            metrics.inc('xhs_download_failures_total', type=type)
+            logger.warning(f'下载失败 {url}: {e}')
+            return 0
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.reused += reused
+        if self.journal is not None:
+            self.journal.add_media(key)
+        return size
+
+    def wait(self):
+        # 等待所有已提交的文件下载完成, 包括等待期间新提交的
+        while True:
+            with self.lock:
+                futures, self.futures = self.futures, []
+            if not futures:
+                break
+            for future in futures:
+                future.result()
+
+    def summary(self):
+        seconds = time.time() - self.start_time
+        return {
+            'files': self.files,
+            'failed': self.failed,
+            'reused': self.reused,
+            'bytes': self.bytes,
+            'seconds': round(seconds, 2),
+            'speed': round(self.bytes / seconds, 2) if seconds > 0 else 0,
+        }
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        summary = self.summary()
+        logger.info(f"媒体下载完成 成功 {summary['files']} 个, 复用 {summary['reused']} 个, 失败 {summary['failed']} 个, 共 {summary['bytes'] / 1024 / 1024:.2f} MB, 耗时 {summary['seconds']}s, {summary['speed'] / 1024 / 1024:.2f} MB/s")
+        return summary
 
 def save_user_detail(user, path):
     with open(f'{path}/detail.txt', mode="w", encoding="utf-8") as f:
@@ -246,8 +839,11 @@ def save_note_detail(note, path):
 
 
 
-@retry(tries=3, delay=1)
-def download_note(note_info, path, save_choice):
+def download_note(note_info, path, save_choice, downloader: Media_Downloader = None):
+    """
+        保存笔记的信息和媒体文件
+        传入 downloader 时媒体文件提交到下载器的线程池中下载, 否则在当前线程依次下载
+    """
     note_id = note_info['note_id']
     user_id = note_info['user_id']
     title = note_info['title']
@@ -262,12 +858,13 @@ def download_note(note_info, path, save_choice):
         f.write(json.dumps(note_info) + '\n')
     note_type = note_info['note_type']
     save_note_detail(note_info, save_path)
+    download = downloader.submit if downloader is not None else download_media
     if note_type == '图集' and save_choice in ['media', 'media-image', 'all']:
         for img_index, img_url in enumerate(note_info['image_list']):
-            download_media(save_path, f'image_{img_index}', img_url, 'image')
+            download(save_path, f'image_{img_index}', img_url, 'image')
     elif note_type == '视频' and save_choice in ['media', 'media-video', 'all']:
-        download_media(save_path, 'cover', note_info['video_cover'], 'image')
-        download_media(save_path, 'video', note_info['video_addr'], 'video')
+        download(save_path, 'cover', note_info['video_cover'], 'image')
+        download(save_path, 'video', note_info['video_addr'], 'video')
     return save_path
 
 
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+import threading
+import time
+from loguru import logger
+from xhs_utils.data_util import SINK_FIELDS, COUNT_FIELDS, LIST_FIELDS, Data_Sink, parse_count
+
+# 每种数据对应的表和主键
+TABLES = {
+    'note': ('notes', 'note_id'),
+    'user': ('users', 'user_id'),
+    'comment': ('comments', 'comment_id'),
+}
+
+
+class Sqlite_Store():
+    """
+        基于 sqlite 的本地数据库, 保存笔记, 用户和评论, 多次运行的数据可以统一查询和去重
+        使用 WAL 模式, 写入先缓存, 每 batch_size 条在一个事务中批量 upsert
+        :param db_path: 数据库文件路径
+        :param batch_size: 每次批量写入的条数
+    """
+    def __init__(self, db_path: str, batch_size: int = 500):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.lock = threading.RLock()
+        self.buffers = {type: [] for type in TABLES}
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.conn:
+            for type, (table, key) in TABLES.items():
+                columns = []
+                for field in SINK_FIELDS[type]:
+                    column_type = 'INTEGER' if field in COUNT_FIELDS else 'TEXT'
+                    column = f'"{field}" {column_type}'
+                    if field == key:
+                        column += ' PRIMARY KEY'
+                    columns.append(column)
+                columns.append('"first_seen" REAL')
+                columns.append('"updated_at" REAL')
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(columns)})')
+            # 增量爬取用户笔记的进度, newest_note_id 为已经完整爬取的最新一条笔记, updated_at 之前写入的笔记都已经完整爬取
+            self.conn.execute('CREATE TABLE IF NOT EXISTS "user_states" ("user_id" TEXT PRIMARY KEY, "newest_note_id" TEXT, "updated_at" REAL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS "notes_user_id" ON "notes" ("user_id")')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS "comments_note_id" ON "comments" ("note_id")')
+
+    @staticmethod
+    def to_row(type, data):
+        row = []
+        for field in SINK_FIELDS[type]:
+            value = data.get(field)
+            if field in COUNT_FIELDS:
+                value = parse_count(value)
+            elif field in LIST_FIELDS:
+                value = json.dumps(value, ensure_ascii=False) if value is not None else None
+            row.append(value)
+        now = time.time()
+        row.extend([now, now])
+        return row
+
+    def upsert(self, type, data: dict):
+        """
+            写入一条 handle_note_info, handle_user_info 或 handle_comment_info 的结果, 主键相同时更新
+            :param type: note, user, comment
+        """
+        with self.lock:
+            self.buffers[type].append(self.to_row(type, data))
+            if len(self.buffers[type]) >= self.batch_size:
+                self.flush(type)
+
+    def upsert_note(self, note: dict):
+        self.upsert('note', note)
+
+    def upsert_user(self, user: dict):
+        self.upsert('user', user)
+
+    def upsert_comment(self, comment: dict):
+        self.upsert('comment', comment)
+
+    def flush(self, type=None):
+        types = [type] if type is not None else list(TABLES)
+        with self.lock, self.conn:
+            for type in types:
+                rows, self.buffers[type] = self.buffers[type], []
+                if not rows:
+                    continue
+                table, key = TABLES[type]
+                fields = SINK_FIELDS[type] + ['first_seen', 'updated_at']
+                columns = ', '.join(f'"{field}"' for field in fields)
+                placeholders = ', '.join('?' for _ in fields)
+                # 更新时保留第一次写入的时间
+                updates = ', '.join(f'"{field}" = excluded."{field}"' for field in fields if field not in (key, 'first_seen'))
+                sql = f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders}) ON CONFLICT("{key}") DO UPDATE SET {updates}'
+                self.conn.executemany(sql, rows)
+
+    def query(self, sql: str, params=()):
+        self.flush()
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def has_note(self, note_id: str):
+        return bool(self.query('SELECT 1 FROM "notes" WHERE "note_id" = ?', (note_id,)))
+
+    def get_note(self, note_id: str):
+        rows = self.query('SELECT * FROM "notes" WHERE "note_id" = ?', (note_id,))
+        return rows[0] if rows else None
+
+    def get_user_note_ids(self, user_id: str, seen_before: float = None):
+        """
+            :param seen_before: 只返回在该时间之前第一次写入的笔记
+        """
+        if seen_before is None:
+            return {row['note_id'] for row in self.query('SELECT "note_id" FROM "notes" WHERE "user_id" = ?', (user_id,))}
+        return {row['note_id'] for row in self.query('SELECT "note_id" FROM "notes" WHERE "user_id" = ? AND "first_seen" <= ?', (user_id, seen_before))}
+
+    def get_user_state(self, user_id: str):
+        rows = self.query('SELECT * FROM "user_states" WHERE "user_id" = ?', (user_id,))
+        return rows[0] if rows else None
+
+    def set_user_state(self, user_id: str, newest_note_id: str):
+        self.flush()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO "user_states" ("user_id", "newest_note_id", "updated_at") VALUES (?, ?, ?) '
+                'ON CONFLICT("user_id") DO UPDATE SET "newest_note_id" = excluded."newest_note_id", "updated_at" = excluded."updated_at"',
+                (user_id, newest_note_id, time.time()),
+            )
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+        logger.info(f'数据保存至 {self.db_path}')
+
+
+class Sqlite_Sink(Data_Sink):
+    """
+        把 Sqlite_Store 作为 Data_Spider 的输出, 关闭 sink 时只写入缓存, 不关闭数据库
+        :param store: Sqlite_Store
+        :param type: note, user, comment
+    """
+    def __init__(self, store: Sqlite_Store, type='note'):
+        super().__init__(store.db_path, type)
+        self.store = store
+
+    def write(self, data: dict):
+        self.store.upsert(self.type, data)
+        self.rows += 1
+
+    def close(self):
+        self.store.flush()
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from xhs_utils.proxy_util import Proxy_Pool
+from xhs_utils.metrics_util import metrics, get_endpoint
+from xhs_utils.trace_util import tracer
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class Http2_Response():
+    """
+        包装 httpx.Response, 提供下载代码用到的 requests.Response 接口
+        stream=True 时响应体没有读取, 通过 iter_content 读取, 读取完或者退出 with 时释放连接
+    """
+    def __init__(self, response):
+        self.response = response
+
+    @property
+    def content(self):
+        # 与 requests 一致, 流式响应访问 content 时读取整个响应体
+        if not self.response.is_stream_consumed:
+            self.response.read()
+        return self.response.content
+
+    @property
+    def text(self):
+        self.content
+        return self.response.text
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+    def iter_content(self, chunk_size: int = 1):
+        return self.response.iter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        if self.response.status_code >= 400:
+            raise requests.HTTPError(f'{self.response.status_code} Error for url: {self.response.url}', response=self)
+
+    def close(self):
+        self.response.close()
+
+    def __getattr__(self, name):
+        # status_code, headers, url 等属性与 requests.Response 相同
+        return getattr(self.response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Http2_Session():
+    """
+        基于 httpx 的 http2 会话, 请求参数与 requests.Session.request 保持一致, 返回 Http2_Response
+        httpx 的代理在创建时指定, 所以每个代理单独一个会话
+    """
+    def __init__(self, proxies: dict = None, pool_size: int = 10, keep_alive: bool = True, timeout=None):
+        if httpx is None:
+            raise ImportError('http2 需要安装 httpx[http2]')
+        proxy = (proxies or {}).get('https') or (proxies or {}).get('http')
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size if keep_alive else 0)
+        self.client = httpx.Client(http2=True, proxy=proxy, limits=limits, timeout=to_httpx_timeout(timeout))
+
+    def request(self, method: str, url: str, data=None, cookies: dict = None, proxies: dict = None, timeout=None, stream=False, allow_redirects=True, **kwargs):
+        if data is not None:
+            kwargs['data' if isinstance(data, dict) else 'content'] = data
+        if timeout is not None:
+            kwargs['timeout'] = to_httpx_timeout(timeout)
+        # httpx 不支持单个请求的 cookies, 并且会保存到 client 中, 所以直接写入请求头
+        if cookies:
+            headers = {key: value for key, value in (kwargs.get('headers') or {}).items() if key.lower() != 'cookie'}
+            headers['Cookie'] = '; '.join(f'{key}={value}' for key, value in cookies.items())
+            kwargs['headers'] = headers
+        request = self.client.build_request(method, url, **kwargs)
+        response = self.client.send(request, stream=stream, follow_redirects=allow_redirects)
+        return Http2_Response(response)
+
+    def close(self):
+        self.client.close()
+
+
+def to_httpx_timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+class Session_Pool():
+    """
+        按 账号(a1) + 代理 复用的 http 会话, 避免每次请求都重新建立 TCP+TLS 连接
+        :param pool_size: 每个会话的连接池大小
+        :param keep_alive: 是否保持长连接
+        :param timeout: 默认超时时间, (连接超时, 读取超时)
+        :param http2: 是否使用 http2, 需要安装 httpx[http2]
+        :param rate_limiter: 按账号限速, 带 cookies 的请求发送前等待令牌, 被限流时自动降速
+    """
+    def __init__(self, pool_size: int = 10, keep_alive: bool = True, timeout=(10, 60), http2: bool = False, rate_limiter=None):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.http2 = http2
+        self.rate_limiter = rate_limiter
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def new_session(self, proxies: dict = None):
+        if self.http2:
+            return Http2_Session(proxies, self.pool_size, self.keep_alive, self.timeout)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get_session(self, a1: str = None, proxies: dict = None):
+        key = (a1, json.dumps(proxies, sort_keys=True) if proxies else None)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.new_session(proxies)
+                self.sessions[key] = session
+        return session
+
+    def request(self, method: str, url: str, cookies: dict = None, proxies=None, **kwargs):
+        """
+            :param proxies: 代理 dict, 或者 Proxy_Pool, 使用代理池时每次请求选择一个代理并记录延迟和失败
+        """
+        a1 = cookies.get('a1') if cookies else None
+        kwargs.setdefault('timeout', self.timeout)
+        if self.rate_limiter is not None and a1 is not None:
+            with tracer.span('rate_limit'):
+                self.rate_limiter.acquire(a1, url)
+        proxy_pool, proxy = None, None
+        if isinstance(proxies, Proxy_Pool):
+            proxy_pool, proxy = proxies, proxies.choose(a1)
+            proxies = proxy.proxies
+        session = self.get_session(a1, proxies)
+        endpoint = get_endpoint(url)
+        start = time.monotonic()
+        with tracer.span('http', method=method, endpoint=endpoint) as span:
+            try:
+                response = session.request(method, url, cookies=cookies, proxies=proxies, **kwargs)
+                # 请求返回后立即计时, 不包括之后读取响应体的时间
+                seconds = time.monotonic() - start
+            except Exception as e:
+                metrics.observe_response(method, url, seconds=time.monotonic() - start, error=e, endpoint=endpoint)
+                if proxy is not None:
+                    proxy_pool.report(proxy, success=False)
+                raise
+            span.args['status'] = response.status_code
+            # 流式下载的字节数由 download_media 记录
+            if not kwargs.get('stream'):
+                span.args['bytes'] = len(response.content)
+        if tracer.enabled:
+            response.json = tracer.wrap('response.json', response.json, endpoint=endpoint)
+        metrics.observe_response(method, url, response, seconds, endpoint=endpoint)
+        if proxy is not None:
+            proxy_pool.report(proxy, seconds, response.status_code < 500 and response.status_code != 407)
+        if self.rate_limiter is not None and a1 is not None:
+            self.rate_limiter.observe(a1, url, response)
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+default_session_pool = Session_Pool()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+from loguru import logger
+
+
+class Job_Journal():
+    """
+        一次爬取任务的日志, 每条记录追加写入一行 json 并立即落盘, 进程崩溃后重新运行同一个任务时从日志恢复
+        记录的内容:
+            page: 翻页获取到的一页数据和下一页的 cursor
+            pages_done: 翻页已经完成
+            note: 已经爬取完成的笔记信息
+            sink: 笔记已经写入的输出 (Data_Sink.sink_id)
+            media: 已经下载完成的图片和视频
+        任务全部完成后调用 close(remove=True) 删除日志, 下一次运行重新开始
+        :param path: 日志文件路径
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.items = []
+        self.cursor = None
+        self.pages_done = False
+        self.notes = {}
+        self.sinks = {}
+        self.media = set()
+        self.resumed = False
+        # 本次运行是否全部完成, 由 Data_Spider 设置
+        self.complete = True
+        self.load()
+        self.f = open(self.path, mode='a', encoding='utf-8')
+
+    @classmethod
+    def for_job(cls, root: str, *keys):
+        """
+            根据任务的参数确定日志文件, 参数相同的任务使用同一个日志
+        """
+        os.makedirs(root, exist_ok=True)
+        job_id = hashlib.sha1(json.dumps(keys, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(root, f'{keys[0]}_{job_id}.jsonl'))
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        valid = 0
+        with open(self.path, mode='rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 最后一行可能在写入时中断, 之后的内容丢弃
+                    break
+                self.apply(record)
+                valid += len(line)
+        if valid != os.path.getsize(self.path):
+            with open(self.path, mode='r+b') as f:
+                f.truncate(valid)
+        self.resumed = valid > 0
+        if self.resumed:
+            logger.info(f'从日志恢复任务 {self.path}: 已获取 {len(self.items)} 条, 已完成笔记 {len(self.notes)} 个, 媒体文件 {len(self.media)} 个')
+
+    def apply(self, record):
+        type = record['t']
+        if type == 'page':
+            self.items.extend(record['items'])
+            self.cursor = record['cursor']
+        elif type == 'pages_done':
+            self.pages_done = True
+        elif type == 'note':
+            self.notes[record['note_id']] = record['info']
+            if record.get('sink') is not None:
+                self.sinks[record['note_id']] = record['sink']
+        elif type == 'sink':
+            self.sinks[record['note_id']] = record['sink']
+        elif type == 'media':
+            self.media.add(record['key'])
+
+    def record(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.apply(record)
+
+    def add_page(self, items: list, cursor):
+        self.record({'t': 'page', 'items': items, 'cursor': cursor})
+
+    def finish_pages(self):
+        self.record({'t': 'pages_done'})
+
+    def add_note(self, note_id: str, note_info: dict, sink_id: str = None):
+        """
+            :param sink_id: 笔记已经写入的输出
+        """
+        self.record({'t': 'note', 'note_id': note_id, 'info': note_info, 'sink': sink_id})
+
+    def add_sink(self, note_id: str, sink_id: str):
+        self.record({'t': 'sink', 'note_id': note_id, 'sink': sink_id})
+
+    def in_sink(self, note_id: str, sink_id: str):
+        return self.sinks.get(note_id) == sink_id
+
+    def add_media(self, key: str):
+        self.record({'t': 'media', 'key': key})
+
+    def has_media(self, key: str):
+        return key in self.media
+
+    def close(self, remove: bool = False):
+        with self.lock:
+            self.f.close()
+        if remove:
+            os.remove(self.path)
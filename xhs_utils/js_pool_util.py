@@ -0,0 +1,209 @@
+import atexit
+import itertools
+import json
+import os
+import subprocess
+import threading
+from collections import deque
+from loguru import logger
+
+STATIC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../static'))
+WORKER_SCRIPT = os.path.join(STATIC_PATH, 'js_worker.js')
+
+
+class Js_Worker_Error(Exception):
+    """
+        js 进程异常退出或者超时, 可以换一个进程重试
+    """
+
+
+class Js_Call_Error(Exception):
+    """
+        js 函数执行时抛出的异常
+    """
+
+
+class _Pending():
+    __slots__ = ('event', 'result', 'error', 'lost')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.lost = False
+
+
+class Js_Worker():
+    """
+        一个常驻的 node 进程, 脚本只在启动时加载一次
+        通过 stdin/stdout 按行传输 json, 同一个进程上可以同时有多个未完成的请求
+    """
+    def __init__(self, script_path: str, node_bin: str = 'node'):
+        self.script_path = script_path
+        self.process = subprocess.Popen(
+            [node_bin, WORKER_SCRIPT, script_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=STATIC_PATH,
+            encoding='utf-8',
+            bufsize=1,
+        )
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.pending = {}
+        self.dead = False
+        # 保留最近的 stderr 输出, 进程退出时用于定位原因
+        self.stderr_tail = deque(maxlen=20)
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_tail.append(line.rstrip())
+
+    def _read_loop(self):
+        for line in self.process.stdout:
+            try:
+                res = json.loads(line)
+            except ValueError:
+                continue
+            with self.lock:
+                pending = self.pending.pop(res.get('id'), None)
+            if pending is None:
+                continue
+            pending.result = res.get('result')
+            pending.error = res.get('error')
+            pending.event.set()
+        # stdout 关闭说明进程已经退出, 唤醒所有等待中的请求
+        with self.lock:
+            self.dead = True
+            pendings = list(self.pending.values())
+            self.pending.clear()
+        for pending in pendings:
+            pending.lost = True
+            pending.event.set()
+
+    @property
+    def alive(self):
+        return not self.dead and self.process.poll() is None
+
+    def exit_reason(self):
+        reason = f'js 进程已退出 {self.script_path}'
+        if self.stderr_tail:
+            reason += '\n' + '\n'.join(self.stderr_tail)
+        return reason
+
+    @property
+    def load(self):
+        return len(self.pending)
+
+    def request(self, payload: dict, timeout: float = 30):
+        pending = _Pending()
+        with self.lock:
+            if self.dead:
+                raise Js_Worker_Error(self.exit_reason())
+            req_id = next(self.ids)
+            self.pending[req_id] = pending
+            try:
+                self.process.stdin.write(json.dumps(dict(payload, id=req_id), ensure_ascii=False) + '\n')
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self.pending.pop(req_id, None)
+                self.dead = True
+                raise Js_Worker_Error(str(e))
+        if not pending.event.wait(timeout):
+            with self.lock:
+                self.pending.pop(req_id, None)
+            # 进程可能已经卡死, 直接结束掉让进程池重启
+            self.close()
+            raise Js_Worker_Error(f'js 调用超时 {payload.get("fn")}')
+        if pending.lost:
+            raise Js_Worker_Error(self.exit_reason())
+        if pending.error is not None:
+            raise Js_Call_Error(pending.error)
+        return pending.result
+
+    def call(self, fn: str, *args, timeout: float = 30):
+        return self.request({'fn': fn, 'args': list(args)}, timeout)
+
+    def close(self):
+        self.dead = True
+        try:
+            self.process.stdin.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class Js_Worker_Pool():
+    """
+        js 进程池, 接口和 execjs.compile 返回的对象一致, 可以直接替换 js.call(...)
+        进程在第一次调用时启动, 异常退出的进程会在下一次调用时自动重启
+        :param script_path: 需要加载的 js 文件
+        :param size: 进程数量, 默认读取环境变量 XHS_JS_WORKERS, 没有则为 2
+    """
+    def __init__(self, script_path: str, size: int = None, node_bin: str = None):
+        self.script_path = script_path
+        self.size = size
+        self.node_bin = node_bin
+        self.workers = []
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start_worker(self):
+        return Js_Worker(self.script_path, self.node_bin or os.getenv('XHS_NODE_BIN', 'node'))
+
+    def get_worker(self):
+        with self.lock:
+            if not self.workers:
+                # 环境变量可能在 import 之后才由 load_dotenv 加载, 所以在第一次调用时读取
+                self.size = self.size or int(os.getenv('XHS_JS_WORKERS', 2))
+                self.workers = [None] * self.size
+            index = min(range(self.size), key=lambda i: self.workers[i].load if self.workers[i] is not None and self.workers[i].alive else -1)
+            worker = self.workers[index]
+            if worker is None or not worker.alive:
+                if worker is not None:
+                    logger.warning(f'js 进程退出, 重新启动 {self.script_path}')
+                    worker.close()
+                worker = self._start_worker()
+                self.workers[index] = worker
+        return worker
+
+    def request(self, payload: dict, timeout: float = 30):
+        try:
+            return self.get_worker().request(payload, timeout)
+        except Js_Worker_Error:
+            # 进程崩溃时换一个新进程重试一次
+            return self.get_worker().request(payload, timeout)
+
+    def call(self, fn: str, *args, timeout: float = 30):
+        return self.request({'fn': fn, 'args': list(args)}, timeout)
+
+    @property
+    def load(self):
+        # 所有进程中未完成的调用数量
+        return sum(worker.load for worker in self.workers if worker is not None)
+
+    def call_batch(self, fn: str, args_list: list, timeout: float = 30):
+        """
+            在一次 js 调用中对每组参数执行 fn, 按顺序返回结果列表
+            执行失败的项在列表中为 Js_Call_Error, 不影响其他项
+            :param fn: js 函数名
+            :param args_list: 参数列表, 每一项为一次调用的参数
+        """
+        if not args_list:
+            return []
+        results = self.request({'fn': fn, 'batch': [list(args) for args in args_list]}, timeout)
+        return [Js_Call_Error(item['error']) if 'error' in item else item.get('result') for item in results]
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            if worker is not None:
+                worker.close()
@@ -0,0 +1,273 @@
+import bisect
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+    运行指标, 包括每个接口的请求数量、延迟分布、错误码, 签名耗时, 下载字节数, 队列长度
+    所有模块共用全局的 metrics, 通过 metrics.snapshot() 获取, 或者 start_metrics_server() 后由 Prometheus 抓取
+"""
+
+# 延迟分布的分桶, 单位秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def get_endpoint(url):
+    # 接口请求按路径统计, 其他请求 (CDN 等) 按域名统计, 避免每个文件一个标签
+    url = urllib.parse.urlparse(url)
+    if url.path.startswith('/api/'):
+        return url.path
+    return url.hostname or ''
+
+
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # 按分桶估算, 返回所在分桶的上界
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics():
+    """
+        线程安全的指标注册表, 指标按 (名称, 标签) 区分
+        counter: 只增加的计数, gauge: 可增可减的当前值, histogram: 延迟分布
+        gauge 也可以注册为函数, 在读取时计算, 用于队列长度等由其他对象维护的值
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_funcs = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def add(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def register_gauge(self, name, func, **labels):
+        """
+            注册一个在读取时调用的 gauge, 相同名称和标签的 gauge 会被替换, func 为 None 时取消注册
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            if func is None:
+                self.gauge_funcs.pop(key, None)
+            else:
+                self.gauge_funcs[key] = func
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def observe_response(self, method, url, response=None, seconds=None, error=None, endpoint=None):
+        """
+            记录一次 http 请求, 由 Session_Pool.request 调用
+            错误码: 请求异常时为异常类名, 否则为 http 状态码, 接口返回失败时附带响应中的 code
+        """
+        endpoint = endpoint or get_endpoint(url)
+        if error is not None:
+            status, code = 'error', type(error).__name__
+        else:
+            status, code = str(response.status_code), self.response_code(response)
+        self.inc('xhs_requests_total', endpoint=endpoint, method=method, status=status)
+        if code is not None:
+            self.inc('xhs_request_errors_total', endpoint=endpoint, code=code)
+        if seconds is not None:
+            self.observe('xhs_request_seconds', seconds, endpoint=endpoint)
+
+    @staticmethod
+    def response_code(response):
+        if response.status_code >= 400:
+            return str(response.status_code)
+        # 失败的 json 响应很短, 只解析短的响应, 避免重复解析正常的数据
+        if 'json' not in response.headers.get('content-type', '') or len(response.content) > 2048:
+            return None
+        try:
+            res_json = json.loads(response.content)
+        except ValueError:
+            return None
+        if not isinstance(res_json, dict) or res_json.get('success', True):
+            return None
+        return str(res_json.get('code'))
+
+    def read_gauges(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+            gauge_funcs = list(self.gauge_funcs.items())
+        for key, func in gauge_funcs:
+            try:
+                gauges[key] = func()
+            except Exception:
+                continue
+        return gauges
+
+    def snapshot(self):
+        """
+            返回当前所有指标, 标签为 'name{key=value,...}' 形式的字符串
+            下载吞吐量 xhs_download_bytes_per_second 为下载字节数除以下载耗时
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: histogram.stats() for key, histogram in self.histograms.items()}
+        snapshot = {
+            'uptime': round(time.time() - self.start_time, 2),
+            'counters': {format_key(key): value for key, value in counters.items()},
+            'gauges': {format_key(key): value for key, value in self.read_gauges().items()},
+            'histograms': {format_key(key): value for key, value in histograms.items()},
+            'download': {},
+        }
+        for (name, labels), value in counters.items():
+            if name != 'xhs_download_bytes_total':
+                continue
+            seconds = histograms.get(('xhs_download_seconds', labels), {}).get('sum')
+            snapshot['download'][format_key(('xhs_download_bytes_per_second', labels))] = round(value / seconds, 2) if seconds else None
+        return snapshot
+
+    def render(self):
+        """
+            Prometheus 文本格式
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.count, histogram.sum) for key, histogram in self.histograms.items()}
+        lines = []
+        for metric_type, values in (('counter', counters), ('gauge', self.read_gauges())):
+            for name in sorted({name for name, labels in values}):
+                lines.append(f'# TYPE {name} {metric_type}')
+                for (key_name, labels), value in sorted(values.items()):
+                    if key_name == name:
+                        lines.append(f'{format_key((name, labels))} {value}')
+        for name in sorted({name for name, labels in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (key_name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{format_key((name + '_bucket', labels + (('le', str(bound)),)))} {cumulative}")
+                lines.append(f'{format_key((name + "_sum", labels))} {total}')
+                lines.append(f'{format_key((name + "_count", labels))} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+class Timer():
+    """
+        with metrics.timer('name', label=...): 记录代码块的耗时
+    """
+    def __init__(self, metrics: Metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.monotonic() - self.start
+        self.metrics.observe(self.name, self.seconds, **self.labels)
+
+
+def format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    values = ','.join(f'{label}="{escape(value)}"' for label, value in labels)
+    return f'{name}{{{values}}}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+class _Metrics_Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body, content_type = metrics.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.split('?')[0] == '/snapshot':
+            body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = 9108, host: str = '127.0.0.1'):
+    """
+        在后台线程中启动指标的 http 服务, /metrics 为 Prometheus 格式, /snapshot 为 json
+        返回 server, 调用 server.shutdown() 停止
+    """
+    server = ThreadingHTTPServer((host, port), _Metrics_Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
@@ -0,0 +1,380 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+"""
+    本地的小红书模拟服务器, 实现 XHS_Apis 用到的 edith 接口和图片、视频 CDN, 不需要联网即可测试和压测
+    数据由 seed 确定性生成, 相同的参数每次返回相同的用户、笔记和评论
+    使用方法:
+        server = Mock_XHS_Server(latency=0.05, error_rate=0.01, rate_limit=5).start()
+        data_spider.xhs_apis.base_url = server.url
+        data_util.VIDEO_CDN = server.url + '/cdn/video/'
+    /_mock/stats 返回服务器的请求统计, /_mock/targets 返回所有笔记和用户的链接, 服务器在其他进程中运行时使用
+"""
+
+BASE_TIME = 1700000000000
+
+
+class Mock_XHS_Server():
+    """
+        :param latency: 接口的延迟秒数, 可以是 (最小值, 最大值)
+        :param cdn_latency: 图片和视频的延迟秒数, 可以是 (最小值, 最大值)
+        :param error_rate: 接口返回 500 的概率
+        :param rate_limit: 每个账号(a1)每秒最多的接口请求数, 超过后返回 461 和限流错误码, 为 None 时不限流
+        :param users: 用户数量
+        :param notes_per_user: 每个用户的笔记数量
+        :param video_ratio: 视频笔记的比例
+        :param images_per_note: 图集笔记的图片数量
+        :param comments_per_note: 每个笔记的一级评论数量
+        :param sub_comments: 每个一级评论的二级评论数量
+        :param search_results: 每个关键词的搜索结果数量
+        :param image_size: 图片大小
+        :param video_size: 视频大小, 超过 data_util.VIDEO_SEGMENT_MIN_SIZE 时会使用 Range 分段下载
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency=0.0, cdn_latency=0.0, error_rate: float = 0.0, rate_limit: float = None,
+                 users: int = 10, notes_per_user: int = 30, video_ratio: float = 0.2, images_per_note: int = 3, comments_per_note: int = 20, sub_comments: int = 5,
+                 search_results: int = 100, image_size: int = 50 * 1024, video_size: int = 1024 * 1024, seed: int = 0):
+        self.latency = latency
+        self.cdn_latency = cdn_latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.users = users
+        self.notes_per_user = notes_per_user
+        self.video_ratio = video_ratio
+        self.images_per_note = images_per_note
+        self.comments_per_note = comments_per_note
+        self.sub_comments = sub_comments
+        self.search_results = search_results
+        self.image_size = image_size
+        self.video_size = video_size
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.counts = {}
+        self.throttled = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.user_ids = [self.make_id('user', u) for u in range(users)]
+        self.user_index = {user_id: index for index, user_id in enumerate(self.user_ids)}
+        self.note_ids = [self.make_id('note', u, i) for u in range(users) for i in range(notes_per_user)]
+        self.note_index = {note_id: index for index, note_id in enumerate(self.note_ids)}
+        self.media = {'img': b'\xff' * image_size, 'video': b'\x00' * video_size}
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def make_id(self, *parts):
+        return hashlib.sha1(json.dumps([self.seed, *parts]).encode('utf-8')).hexdigest()[:24]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='mock_xhs')
+        self.thread.start()
+        logger.info(f'模拟服务器已启动 {self.url}')
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def note_url(self, note_id):
+        return f'https://www.xiaohongshu.com/explore/{note_id}?xsec_token={self.make_id("token", note_id)}&xsec_source=pc_search'
+
+    def user_url(self, index: int = 0):
+        user_id = self.user_ids[index]
+        return f'https://www.xiaohongshu.com/user/profile/{user_id}?xsec_token={self.make_id("token", user_id)}&xsec_source=pc_note'
+
+    def note_urls(self, count: int = None):
+        return [self.note_url(note_id) for note_id in self.note_ids[:count]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': sum(self.counts.values()),
+                'endpoints': dict(self.counts),
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'bytes_sent': self.bytes_sent,
+            }
+
+    def sleep(self, latency):
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency > 0:
+            time.sleep(latency)
+
+    def check_rate(self, a1):
+        # 每个账号每秒的请求数, 超过 rate_limit 时限流
+        if self.rate_limit is None:
+            return True
+        window = int(time.time())
+        with self.lock:
+            start, count = self.windows.get(a1, (window, 0))
+            if start != window:
+                start, count = window, 0
+            self.windows[a1] = (start, count + 1)
+            if count + 1 > self.rate_limit:
+                self.throttled += 1
+                return False
+        return True
+
+    def is_video(self, note_id):
+        return int(note_id[:8], 16) / 0xffffffff < self.video_ratio
+
+    def user_of(self, note_id):
+        return self.note_index[note_id] // self.notes_per_user
+
+    def user_brief(self, user_index):
+        user_id = self.user_ids[user_index]
+        return {'user_id': user_id, 'nickname': f'用户{user_index}', 'nick_name': f'用户{user_index}', 'avatar': f'{self.url}/cdn/img/avatar/{user_id}', 'image': f'{self.url}/cdn/img/avatar/{user_id}'}
+
+    def interact_info(self, note_id):
+        value = int(note_id[8:14], 16)
+        return {'liked': False, 'liked_count': str(value % 10000), 'collected': False, 'collected_count': str(value % 3000), 'comment_count': str(self.comments_per_note), 'share_count': str(value % 500), 'sticky': False}
+
+    def image_list(self, note_id, count):
+        return [{'width': 1080, 'height': 1440, 'info_list': [
+            {'image_scene': 'WB_PRV', 'url': f'{self.url}/cdn/img/prv/{note_id}/{i}'},
+            {'image_scene': 'WB_DFT', 'url': f'{self.url}/cdn/img/{note_id}/{i}'},
+        ]} for i in range(count)]
+
+    def note_card(self, note_id):
+        index = self.note_index[note_id]
+        video = self.is_video(note_id)
+        card = {
+            'note_id': note_id,
+            'type': 'video' if video else 'normal',
+            'title': f'笔记{index}',
+            'desc': f'模拟笔记 {note_id} 的内容 #标签{index % 7}',
+            'user': self.user_brief(self.user_of(note_id)),
+            'interact_info': self.interact_info(note_id),
+            'image_list': self.image_list(note_id, 1 if video else self.images_per_note),
+            'tag_list': [{'id': str(index % 7), 'name': f'标签{index % 7}', 'type': 'topic'}],
+            'time': BASE_TIME - index * 3600000,
+            'last_update_time': BASE_TIME - index * 3600000,
+            'ip_location': '上海',
+        }
+        if video:
+            card['video'] = {'consumer': {'origin_video_key': note_id}}
+        return card
+
+    def note_brief(self, note_id):
+        card = self.note_card(note_id)
+        return {
+            'note_id': note_id,
+            'xsec_token': self.make_id('token', note_id),
+            'type': card['type'],
+            'display_title': card['title'],
+            'user': card['user'],
+            'interact_info': card['interact_info'],
+            'cover': card['image_list'][0],
+        }
+
+    def comment(self, note_id, root, sub=None):
+        comment_id = f'{note_id}c{root}' if sub is None else f'{note_id}c{root}s{sub}'
+        user_index = (root * 31 + (sub or 0)) % self.users
+        comment = {
+            'id': comment_id,
+            'note_id': note_id,
+            'content': f'模拟评论 {comment_id}',
+            'user_info': {'user_id': self.user_ids[user_index], 'nickname': f'用户{user_index}', 'image': f'{self.url}/cdn/img/avatar/{self.user_ids[user_index]}'},
+            'show_tags': [],
+            'like_count': str((root + (sub or 0)) % 100),
+            'create_time': BASE_TIME - root * 60000,
+            'ip_location': '北京',
+            'pictures': [],
+        }
+        if sub is None:
+            embedded = min(1, self.sub_comments)
+            comment['sub_comments'] = [self.comment(note_id, root, k) for k in range(embedded)]
+            comment['sub_comment_count'] = str(self.sub_comments)
+            comment['sub_comment_cursor'] = str(embedded)
+            comment['sub_comment_has_more'] = self.sub_comments > embedded
+        return comment
+
+    def feed(self, query, body):
+        note_id = body['source_note_id']
+        if note_id not in self.note_index:
+            return {'success': False, 'code': -510001, 'msg': '笔记不存在'}
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {'items': [{'id': note_id, 'model_type': 'note', 'note_card': self.note_card(note_id)}]}}
+
+    def user_posted(self, query, body):
+        user_id = query.get('user_id')
+        if user_id not in self.user_index:
+            return {'success': False, 'code': -1, 'msg': '用户不存在'}
+        user_index = self.user_index[user_id]
+        start = int(query.get('cursor') or 0)
+        end = min(start + int(query.get('num') or 30), self.notes_per_user)
+        notes = [self.note_brief(self.note_ids[user_index * self.notes_per_user + i]) for i in range(start, end)]
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {'notes': notes, 'cursor': str(end), 'has_more': end < self.notes_per_user}}
+
+    def search_notes(self, query, body):
+        keyword = body['keyword']
+        page, page_size = int(body['page']), int(body['page_size'])
+        offset = int(hashlib.sha1(keyword.encode('utf-8')).hexdigest()[:8], 16)
+        start = (page - 1) * page_size
+        end = min(start + page_size, self.search_results)
+        items = []
+        for k in range(start, end):
+            note_id = self.note_ids[(offset + k * 7) % len(self.note_ids)]
+            items.append({'id': note_id, 'model_type': 'note', 'xsec_token': self.make_id('token', note_id), 'note_card': self.note_card(note_id)})
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {'items': items, 'has_more': end < self.search_results}}
+
+    def comment_page(self, query, body):
+        note_id = query.get('note_id')
+        if note_id not in self.note_index:
+            return {'success': False, 'code': -1, 'msg': '笔记不存在'}
+        start = int(query.get('cursor') or 0)
+        end = min(start + 10, self.comments_per_note)
+        comments = [self.comment(note_id, j) for j in range(start, end)]
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {'comments': comments, 'cursor': str(end), 'has_more': end < self.comments_per_note}}
+
+    def sub_comment_page(self, query, body):
+        note_id = query.get('note_id')
+        root = int(query['root_comment_id'].rsplit('c', 1)[1])
+        start = int(query.get('cursor') or 0)
+        end = min(start + int(query.get('num') or 10), self.sub_comments)
+        comments = [self.comment(note_id, root, k) for k in range(start, end)]
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {'comments': comments, 'cursor': str(end), 'has_more': end < self.sub_comments}}
+
+    def user_info(self, query, body):
+        user_id = query.get('target_user_id')
+        if user_id not in self.user_index:
+            return {'success': False, 'code': -1, 'msg': '用户不存在'}
+        user_index = self.user_index[user_id]
+        return {'success': True, 'code': 0, 'msg': '成功', 'data': {
+            'basic_info': {'nickname': f'用户{user_index}', 'imageb': f'{self.url}/cdn/img/avatar/{user_id}', 'images': f'{self.url}/cdn/img/avatar/{user_id}', 'red_id': str(100000 + user_index), 'gender': user_index % 2, 'ip_location': '上海', 'desc': f'模拟用户 {user_index}'},
+            'interactions': [{'type': 'follows', 'count': str(user_index * 3)}, {'type': 'fans', 'count': str(user_index * 100)}, {'type': 'interaction', 'count': str(user_index * 1000)}],
+            'tags': [{'name': '上海', 'tagType': 'location'}],
+        }}
+
+    def routes(self):
+        return {
+            '/api/sns/web/v1/feed': self.feed,
+            '/api/sns/web/v1/user_posted': self.user_posted,
+            '/api/sns/web/v1/search/notes': self.search_notes,
+            '/api/sns/web/v2/comment/page': self.comment_page,
+            '/api/sns/web/v2/comment/sub/page': self.sub_comment_page,
+            '/api/sns/web/v1/user/otherinfo': self.user_info,
+        }
+
+    def handler_class(self):
+        mock = self
+        routes = self.routes()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次写入, 不关闭 Nagle 时长连接上每个请求会多出约 40ms 的延迟确认
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                self.handle_request()
+
+            def do_HEAD(self):
+                self.handle_request(head=True)
+
+            def handle_request(self, head=False):
+                url = urllib.parse.urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if url.path == '/_mock/stats':
+                    return self.send_json(200, mock.stats())
+                if url.path == '/_mock/targets':
+                    return self.send_json(200, {'notes': mock.note_urls(), 'users': [mock.user_url(index) for index in range(mock.users)]})
+                with mock.lock:
+                    mock.counts[url.path] = mock.counts.get(url.path, 0) + 1
+                if url.path.startswith('/cdn/'):
+                    mock.sleep(mock.cdn_latency)
+                    return self.send_media(url.path, head)
+                mock.sleep(mock.latency)
+                route = routes.get(url.path)
+                if route is None:
+                    return self.send_json(404, {'success': False, 'code': -1, 'msg': '接口不存在'})
+                cookie = SimpleCookie(self.headers.get('Cookie') or '')
+                a1 = cookie['a1'].value if 'a1' in cookie else None
+                if a1 is None:
+                    return self.send_json(200, {'success': False, 'code': -100, 'msg': '登录已过期'})
+                if not mock.check_rate(a1):
+                    return self.send_json(461, {'success': False, 'code': 300013, 'msg': '访问频次异常，请勿频繁操作或重启试试'})
+                if mock.error_rate and mock.random.random() < mock.error_rate:
+                    with mock.lock:
+                        mock.errors += 1
+                    return self.send_json(500, {'success': False, 'code': -1, 'msg': '服务器错误'})
+                query = dict(urllib.parse.parse_qsl(url.query))
+                try:
+                    data = json.loads(body) if body else {}
+                    res_json = route(query, data)
+                except (KeyError, ValueError) as e:
+                    return self.send_json(400, {'success': False, 'code': -1, 'msg': f'参数错误 {e}'})
+                self.send_json(200, res_json)
+
+            def send_json(self, status, res_json):
+                self.send_body(status, json.dumps(res_json, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+            def send_media(self, path, head):
+                content = mock.media['video' if path.startswith('/cdn/video/') else 'img']
+                content_type = 'video/mp4' if path.startswith('/cdn/video/') else 'image/jpeg'
+                byte_range = self.headers.get('Range')
+                if byte_range and byte_range.startswith('bytes='):
+                    start, end = byte_range[6:].split('-')
+                    start, end = int(start), min(int(end or len(content) - 1), len(content) - 1)
+                    headers = {'Content-Range': f'bytes {start}-{end}/{len(content)}'}
+                    return self.send_body(206, content[start:end + 1], content_type, headers, head)
+                self.send_body(200, content, content_type, {'Accept-Ranges': 'bytes'}, head)
+
+            def send_body(self, status, body, content_type, headers=None, head=False):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+                    with mock.lock:
+                        mock.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def run_mock_server(conn, **kwargs):
+    """
+        在子进程中运行模拟服务器, 启动后通过 conn 发送服务器地址, 避免服务器和爬虫争用同一个进程的 GIL
+    """
+    server = Mock_XHS_Server(**kwargs)
+    conn.send(server.url)
+    server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    """
+        单独启动模拟服务器: python -m xhs_utils.mock_util --port 8000 --latency 0.05 --rate-limit 5
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    args = parser.parse_args()
+    server = Mock_XHS_Server(args.host, args.port, args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+    logger.info(f'用户链接示例 {server.user_url(0)}')
+    logger.info(f'笔记链接示例 {server.note_urls(1)[0]}')
+    server.server.serve_forever()
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import deque
+from loguru import logger
+
+
+class Proxy():
+    """
+        一个代理, 记录延迟的滑动平均和最近的失败率
+        :param proxies: requests 格式的代理 {'http': ..., 'https': ...}
+    """
+    def __init__(self, proxies: dict, window: int = 20):
+        self.proxies = proxies
+        self.name = proxies.get('https') or proxies.get('http')
+        self.latency = None
+        self.results = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.in_flight = 0
+        self.accounts = 0
+        self.disabled_until = 0
+        self.disabled_times = 0
+
+    @property
+    def failure_rate(self):
+        return self.results.count(False) / len(self.results) if self.results else 0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.disabled_until
+
+    def stats(self):
+        return {
+            'proxy': self.name,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'failure_rate': round(self.failure_rate, 3),
+            'in_flight': self.in_flight,
+            'accounts': self.accounts,
+            'disabled_for': round(max(0, self.disabled_until - time.monotonic()), 2),
+        }
+
+
+class Proxy_Pool():
+    """
+        代理池, 可以在所有接受 proxies 参数的地方代替代理 dict 使用
+        每次请求选择 延迟 x (1 + 正在进行的请求) 最小的可用代理, 还没有测量过延迟的代理优先使用
+        sticky 为 True 时同一个账号(a1)固定使用一个代理, 代理被暂停时重新分配
+        连续失败的代理暂停使用, 暂停时间指数增长
+        :param proxies_list: 代理列表, 每一项为 'http://ip:port' 或 requests 格式的 dict
+        :param sticky: 账号是否固定使用一个代理
+        :param max_consecutive_failures: 连续失败多少次后暂停
+        :param cooldown: 第一次暂停的秒数
+    """
+    def __init__(self, proxies_list: list, sticky: bool = True, window: int = 20, alpha: float = 0.3, max_consecutive_failures: int = 3, cooldown: float = 30, max_cooldown: float = 600):
+        self.proxies = []
+        for proxies in proxies_list:
+            if isinstance(proxies, str):
+                proxies = {'http': proxies, 'https': proxies}
+            self.proxies.append(Proxy(proxies, window))
+        if not self.proxies:
+            raise ValueError('代理列表不能为空')
+        self.sticky = sticky
+        self.alpha = alpha
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.assignments = {}
+        self.lock = threading.Lock()
+
+    def score(self, proxy: Proxy):
+        latency = proxy.latency if proxy.latency is not None else 0
+        return (latency + proxy.failure_rate * 10) * (1 + proxy.in_flight)
+
+    def choose(self, a1: str = None):
+        """
+            选择一个代理, 使用完需要调用 report 报告结果
+        """
+        with self.lock:
+            proxies = [proxy for proxy in self.proxies if proxy.available]
+            if not proxies:
+                # 全部暂停时选择最早恢复的代理, 不让请求直接失败
+                proxies = [min(self.proxies, key=lambda proxy: proxy.disabled_until)]
+            if self.sticky and a1 is not None:
+                proxy = self.assignments.get(a1)
+                if proxy is None or proxy not in proxies:
+                    if proxy is not None:
+                        proxy.accounts -= 1
+                    # 分配时同时考虑已经分配的账号数量, 避免所有账号集中到同一个代理
+                    proxy = min(proxies, key=lambda proxy: (self.score(proxy) + 1) * (1 + proxy.accounts))
+                    proxy.accounts += 1
+                    self.assignments[a1] = proxy
+            else:
+                proxy = min(proxies, key=self.score)
+            proxy.in_flight += 1
+        return proxy
+
+    def report(self, proxy: Proxy, latency: float = None, success: bool = True):
+        with self.lock:
+            proxy.in_flight -= 1
+            proxy.requests += 1
+            proxy.results.append(bool(success))
+            if success:
+                proxy.consecutive_failures = 0
+                if latency is not None:
+                    proxy.latency = latency if proxy.latency is None else self.alpha * latency + (1 - self.alpha) * proxy.latency
+                return
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+            if proxy.consecutive_failures >= self.max_consecutive_failures:
+                cooldown = min(self.max_cooldown, self.cooldown * 2 ** proxy.disabled_times)
+                proxy.disabled_until = time.monotonic() + cooldown
+                proxy.disabled_times += 1
+                proxy.consecutive_failures = 0
+                logger.warning(f'代理 {proxy.name} 连续失败, 暂停使用 {cooldown:.0f} 秒')
+
+    def stats(self):
+        with self.lock:
+            return [proxy.stats() for proxy in self.proxies]
+
+    def __len__(self):
+        return len(self.proxies)
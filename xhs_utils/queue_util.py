@@ -0,0 +1,434 @@
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+
+"""
+    多个爬虫进程共享的任务队列
+    任务被取出后有一段租约时间, 租约到期还没有 ack 的任务会重新分配给其他进程
+    失败的任务延迟重试, 超过最大次数后进入死信队列
+    任务为 dict: {'id': 任务id, 'type': 任务类型, 'payload': 任务参数, 'attempts': 已经尝试的次数, 'worker': 取出任务的进程}
+    ack, nack, extend 只在调用方仍然持有租约时生效, 租约过期后任务已经分配给其他进程 (或同一进程的下一次尝试) 时不做任何操作
+"""
+
+
+class Task_Queue(abc.ABC):
+    """
+        任务队列的接口
+        :param max_attempts: 每个任务最多尝试的次数
+        :param retry_delay: 第一次重试前等待的秒数, 之后每次翻倍
+    """
+    def __init__(self, max_attempts: int = 3, retry_delay: float = 10):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    @abc.abstractmethod
+    def put(self, type: str, payload: dict, max_attempts: int = None, delay: float = 0):
+        """
+            添加任务, 返回任务id
+            :param delay: 延迟多少秒后才能被取出
+        """
+
+    def put_many(self, type: str, payloads: list, max_attempts: int = None, delay: float = 0):
+        return [self.put(type, payload, max_attempts, delay) for payload in payloads]
+
+    @abc.abstractmethod
+    def get(self, worker_id: str, lease: float = 300):
+        """
+            取出一个任务, 没有任务时返回 None
+            :param lease: 租约秒数, 到期没有 ack 或 extend 的任务会重新分配
+        """
+
+    @abc.abstractmethod
+    def ack(self, task: dict):
+        """
+            任务完成
+        """
+
+    @abc.abstractmethod
+    def nack(self, task: dict, error: str = None):
+        """
+            任务失败, 没有超过最大次数时延迟重试, 否则进入死信队列
+        """
+
+    @abc.abstractmethod
+    def extend(self, task: dict, lease: float = 300):
+        """
+            延长租约
+        """
+
+    @abc.abstractmethod
+    def stats(self):
+        """
+            返回每个状态的任务数量 {'pending', 'leased', 'done', 'dead'}
+        """
+
+    @abc.abstractmethod
+    def dead_letters(self):
+        """
+            返回死信队列中的任务, 附带最后一次的错误 'error'
+        """
+
+    @abc.abstractmethod
+    def status(self, task_ids: list):
+        """
+            返回 {任务id: pending/leased/done/dead}, 已经删除的任务视为 done
+        """
+
+    def close(self):
+        pass
+
+    def backoff(self, attempts: int):
+        return self.retry_delay * 2 ** max(attempts - 1, 0)
+
+
+class Sqlite_Queue(Task_Queue):
+    """
+        基于 sqlite 的任务队列, 同一台机器上的多个进程可以共用, 也可以放在共享文件系统上
+        :param db_path: 队列文件路径
+    """
+    # 仍然持有租约: 任务没有被重新分配, 租约属于这个进程的这一次尝试
+    LEASED = '"id" = ? AND "status" = \'leased\' AND "worker" = ? AND "attempts" = ?'
+
+    def __init__(self, db_path: str, max_attempts: int = 3, retry_delay: float = 10):
+        super().__init__(max_attempts, retry_delay)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "tasks" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "type" TEXT, "payload" TEXT, "status" TEXT, "attempts" INTEGER, "max_attempts" INTEGER, "available_at" REAL, "lease_until" REAL, "worker" TEXT, "error" TEXT, "created_at" REAL, "updated_at" REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS "tasks_status" ON "tasks" ("status", "available_at")')
+
+    def put(self, type: str, payload: dict, max_attempts: int = None, delay: float = 0):
+        return self.put_many(type, [payload], max_attempts, delay)[0]
+
+    def put_many(self, type: str, payloads: list, max_attempts: int = None, delay: float = 0):
+        now = time.time()
+        ids = []
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for payload in payloads:
+                    cursor = self.conn.execute(
+                        'INSERT INTO "tasks" ("type", "payload", "status", "attempts", "max_attempts", "available_at", "created_at", "updated_at") VALUES (?, ?, \'pending\', 0, ?, ?, ?, ?)',
+                        (type, json.dumps(payload, ensure_ascii=False), max_attempts or self.max_attempts, now + delay, now, now),
+                    )
+                    ids.append(cursor.lastrowid)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return ids
+
+    def get(self, worker_id: str, lease: float = 300):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                while True:
+                    # 等待中的任务, 或者租约已经过期的任务
+                    row = self.conn.execute(
+                        'SELECT "id", "type", "payload", "attempts", "max_attempts" FROM "tasks" '
+                        'WHERE ("status" = \'pending\' AND "available_at" <= ?) OR ("status" = \'leased\' AND "lease_until" < ?) '
+                        'ORDER BY "available_at", "id" LIMIT 1',
+                        (now, now),
+                    ).fetchone()
+                    if row is None:
+                        self.conn.execute('COMMIT')
+                        return None
+                    task_id, type, payload, attempts, max_attempts = row
+                    if attempts >= max_attempts:
+                        # 最后一次尝试的租约过期, 说明进程在处理时退出
+                        self.conn.execute('UPDATE "tasks" SET "status" = \'dead\', "error" = COALESCE("error", \'租约过期\'), "updated_at" = ? WHERE "id" = ?', (now, task_id))
+                        continue
+                    self.conn.execute(
+                        'UPDATE "tasks" SET "status" = \'leased\', "attempts" = ?, "lease_until" = ?, "worker" = ?, "updated_at" = ? WHERE "id" = ?',
+                        (attempts + 1, now + lease, worker_id, now, task_id),
+                    )
+                    self.conn.execute('COMMIT')
+                    return {'id': task_id, 'type': type, 'payload': json.loads(payload), 'attempts': attempts + 1, 'worker': worker_id}
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def lease_args(task: dict):
+        return (task['id'], task.get('worker'), task['attempts'])
+
+    def ack(self, task: dict):
+        with self.lock:
+            self.conn.execute(f'UPDATE "tasks" SET "status" = \'done\', "updated_at" = ? WHERE {self.LEASED}', (time.time(),) + self.lease_args(task))
+
+    def nack(self, task: dict, error: str = None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(f'SELECT "attempts", "max_attempts" FROM "tasks" WHERE {self.LEASED}', self.lease_args(task)).fetchone()
+                if row is not None:
+                    attempts, max_attempts = row
+                    if attempts >= max_attempts:
+                        self.conn.execute('UPDATE "tasks" SET "status" = \'dead\', "error" = ?, "updated_at" = ? WHERE "id" = ?', (error, now, task['id']))
+                    else:
+                        self.conn.execute('UPDATE "tasks" SET "status" = \'pending\', "error" = ?, "available_at" = ?, "updated_at" = ? WHERE "id" = ?', (error, now + self.backoff(attempts), now, task['id']))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def extend(self, task: dict, lease: float = 300):
+        with self.lock:
+            self.conn.execute(f'UPDATE "tasks" SET "lease_until" = ? WHERE {self.LEASED}', (time.time() + lease,) + self.lease_args(task))
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT "status", COUNT(*) FROM "tasks" GROUP BY "status"').fetchall()
+        stats = {'pending': 0, 'leased': 0, 'done': 0, 'dead': 0}
+        stats.update(dict(rows))
+        return stats
+
+    def dead_letters(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT "id", "type", "payload", "attempts", "error" FROM "tasks" WHERE "status" = \'dead\' ORDER BY "id"').fetchall()
+        return [{'id': task_id, 'type': type, 'payload': json.loads(payload), 'attempts': attempts, 'error': error} for task_id, type, payload, attempts, error in rows]
+
+    def status(self, task_ids: list):
+        statuses = {task_id: 'done' for task_id in task_ids}
+        with self.lock:
+            # sqlite 的参数数量有限制, 分批查询
+            for i in range(0, len(task_ids), 500):
+                chunk = task_ids[i:i + 500]
+                rows = self.conn.execute(f'SELECT "id", "status" FROM "tasks" WHERE "id" IN ({", ".join("?" for _ in chunk)})', chunk).fetchall()
+                statuses.update(rows)
+        return statuses
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Redis_Queue(Task_Queue):
+    """
+        基于 redis 的任务队列, 多台机器上的进程可以共用
+        只使用基本的 list, hash, sorted set 命令, 可以用 redis-py 的客户端, 也可以用 Memory_Redis 代替
+        :param client: redis 客户端, 需要 decode_responses=True
+        :param name: 队列名称, 所有 key 的前缀
+    """
+    def __init__(self, client, name: str = 'xhs', max_attempts: int = 3, retry_delay: float = 10):
+        super().__init__(max_attempts, retry_delay)
+        self.client = client
+        self.name = name
+
+    def key(self, *parts):
+        return ':'.join((self.name,) + parts)
+
+    def put(self, type: str, payload: dict, max_attempts: int = None, delay: float = 0):
+        task_id = str(self.client.incr(self.key('seq')))
+        self.client.hset(self.key('task', task_id), mapping={
+            'type': type,
+            'payload': json.dumps(payload, ensure_ascii=False),
+            'attempts': 0,
+            'max_attempts': max_attempts or self.max_attempts,
+        })
+        if delay > 0:
+            self.client.zadd(self.key('delayed'), {task_id: time.time() + delay})
+        else:
+            self.client.lpush(self.key('pending'), task_id)
+        return task_id
+
+    def promote(self, now):
+        # 到时间的重试任务和租约过期的任务放回等待队列, zrem/lrem 成功的进程才负责移动, 避免重复
+        for task_id in self.client.zrangebyscore(self.key('delayed'), 0, now):
+            if self.client.zrem(self.key('delayed'), task_id):
+                self.client.lpush(self.key('pending'), task_id)
+        for task_id in self.client.lrange(self.key('processing'), 0, -1):
+            lease_until = self.client.hget(self.key('task', task_id), 'lease_until')
+            if lease_until is not None and float(lease_until) < now and self.client.lrem(self.key('processing'), 1, task_id):
+                self.client.hdel(self.key('task', task_id), 'lease_until')
+                task = self.client.hgetall(self.key('task', task_id))
+                if int(task['attempts']) >= int(task['max_attempts']):
+                    self.client.hset(self.key('task', task_id), mapping={'error': task.get('error') or '租约过期', 'status': 'dead'})
+                    self.client.rpush(self.key('dead'), task_id)
+                else:
+                    self.client.rpush(self.key('pending'), task_id)
+
+    def get(self, worker_id: str, lease: float = 300):
+        now = time.time()
+        self.promote(now)
+        task_id = self.client.rpoplpush(self.key('pending'), self.key('processing'))
+        if task_id is None:
+            return None
+        task_key = self.key('task', task_id)
+        attempts = self.client.hincrby(task_key, 'attempts', 1)
+        self.client.hset(task_key, mapping={'lease_until': now + lease, 'worker': worker_id})
+        task = self.client.hgetall(task_key)
+        return {'id': task_id, 'type': task['type'], 'payload': json.loads(task['payload']), 'attempts': attempts, 'worker': worker_id}
+
+    def holds_lease(self, task: dict):
+        # 任务被重新分配后 worker 或 attempts 会改变, 租约过期还没有重新分配时已经不在 processing 中
+        values = self.client.hgetall(self.key('task', task['id']))
+        return values.get('worker') == task.get('worker') and values.get('attempts') == str(task['attempts'])
+
+    def ack(self, task: dict):
+        if self.holds_lease(task) and self.client.lrem(self.key('processing'), 1, task['id']):
+            self.client.delete(self.key('task', task['id']))
+            self.client.incr(self.key('done'))
+
+    def nack(self, task: dict, error: str = None):
+        task_key = self.key('task', task['id'])
+        if not self.holds_lease(task) or not self.client.lrem(self.key('processing'), 1, task['id']):
+            return
+        self.client.hdel(task_key, 'lease_until')
+        if error is not None:
+            self.client.hset(task_key, 'error', error)
+        values = self.client.hgetall(task_key)
+        attempts = int(values['attempts'])
+        if attempts >= int(values['max_attempts']):
+            self.client.hset(task_key, 'status', 'dead')
+            self.client.rpush(self.key('dead'), task['id'])
+        else:
+            self.client.zadd(self.key('delayed'), {task['id']: time.time() + self.backoff(attempts)})
+
+    def extend(self, task: dict, lease: float = 300):
+        # 租约过期后 promote 会删除 lease_until, 这时不能再写回
+        if self.holds_lease(task) and self.client.hget(self.key('task', task['id']), 'lease_until') is not None:
+            self.client.hset(self.key('task', task['id']), 'lease_until', time.time() + lease)
+
+    def stats(self):
+        return {
+            'pending': self.client.llen(self.key('pending')) + self.client.zcard(self.key('delayed')),
+            'leased': self.client.llen(self.key('processing')),
+            'done': int(self.client.get(self.key('done')) or 0),
+            'dead': self.client.llen(self.key('dead')),
+        }
+
+    def dead_letters(self):
+        tasks = []
+        for task_id in self.client.lrange(self.key('dead'), 0, -1):
+            task = self.client.hgetall(self.key('task', task_id))
+            tasks.append({'id': task_id, 'type': task['type'], 'payload': json.loads(task['payload']), 'attempts': int(task['attempts']), 'error': task.get('error')})
+        return tasks
+
+    def status(self, task_ids: list):
+        # ack 后任务会被删除
+        statuses = {}
+        for task_id in task_ids:
+            task = self.client.hgetall(self.key('task', task_id))
+            if not task:
+                statuses[task_id] = 'done'
+            elif task.get('status') == 'dead':
+                statuses[task_id] = 'dead'
+            else:
+                statuses[task_id] = 'leased' if 'lease_until' in task else 'pending'
+        return statuses
+
+
+class Memory_Redis():
+    """
+        进程内的 redis 替代品, 只实现 Redis_Queue 用到的命令, 用于单机调试和测试
+        返回值与 redis-py 在 decode_responses=True 时一致
+    """
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def incr(self, key):
+        with self.lock:
+            self.data[key] = int(self.data.get(key, 0)) + 1
+            return self.data[key]
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            return None if value is None else str(value)
+
+    def delete(self, key):
+        with self.lock:
+            return int(self.data.pop(key, None) is not None)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self.lock:
+            values = self.data.setdefault(key, {})
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = len([field for field in items if field not in values])
+            values.update({field: str(value) for field, value in items.items()})
+            return added
+
+    def hget(self, key, field):
+        with self.lock:
+            return self.data.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self.data.get(key, {}))
+
+    def hdel(self, key, field):
+        with self.lock:
+            return int(self.data.get(key, {}).pop(field, None) is not None)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            values = self.data.setdefault(key, {})
+            values[field] = str(int(values.get(field, 0)) + amount)
+            return int(values[field])
+
+    def lpush(self, key, value):
+        with self.lock:
+            self.data.setdefault(key, []).insert(0, str(value))
+            return len(self.data[key])
+
+    def rpush(self, key, value):
+        with self.lock:
+            self.data.setdefault(key, []).append(str(value))
+            return len(self.data[key])
+
+    def rpoplpush(self, src, dst):
+        with self.lock:
+            values = self.data.get(src)
+            if not values:
+                return None
+            value = values.pop()
+            self.data.setdefault(dst, []).insert(0, value)
+            return value
+
+    def lrem(self, key, count, value):
+        with self.lock:
+            values = self.data.get(key, [])
+            if str(value) in values:
+                values.remove(str(value))
+                return 1
+            return 0
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            values = self.data.get(key, [])
+            return list(values[start:] if end == -1 else values[start:end + 1])
+
+    def llen(self, key):
+        with self.lock:
+            return len(self.data.get(key, []))
+
+    def zadd(self, key, mapping):
+        with self.lock:
+            values = self.data.setdefault(key, {})
+            added = len([member for member in mapping if member not in values])
+            values.update({str(member): float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, key, member):
+        with self.lock:
+            return int(self.data.get(key, {}).pop(str(member), None) is not None)
+
+    def zrangebyscore(self, key, min, max):
+        with self.lock:
+            values = self.data.get(key, {})
+            return [member for member, score in sorted(values.items(), key=lambda item: item[1]) if min <= score <= max]
+
+    def zcard(self, key):
+        with self.lock:
+            return len(self.data.get(key, {}))
@@ -0,0 +1,202 @@
+import json
+import random
+import threading
+import time
+import urllib.parse
+from loguru import logger
+from xhs_utils.metrics_util import metrics
+
+# 小红书限流时返回的状态码和错误码
+THROTTLE_STATUS = {429, 461, 471}
+THROTTLE_CODES = {300012, 300013, 300015}
+THROTTLE_KEYWORDS = ('频次', '频繁', '请求太快')
+
+
+class Token_Bucket():
+    """
+        令牌桶, 按 rate 个/秒 生成令牌, 最多积累 burst 个
+        请求成功时缓慢提高速度, 被限流时速度减半并暂停一段时间, 暂停时间指数增长并加入随机抖动
+        :param rate: 正常情况下每秒的请求数
+        :param burst: 允许的突发请求数
+        :param min_rate: 被限流后的最低速度
+        :param backoff: 第一次被限流时暂停的秒数
+        :param max_backoff: 最长暂停的秒数
+    """
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = None, backoff: float = 5, max_backoff: float = 300):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate or rate / 20
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.consecutive = 0
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        # 暂停期间不生成令牌, 从暂停结束时开始计算
+        start = max(self.updated, self.blocked_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+            self.updated = now
+
+    def reserve(self):
+        """
+            预约一个令牌, 返回需要等待的秒数, 令牌不足时记为负数, 后面的请求依次排队
+            暂停期间预约的请求从暂停结束时开始按 1 / rate 的间隔依次发送, 不会在暂停结束时同时发送
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            self.requests += 1
+            wait = max(0, self.blocked_until - now) + max(0, -self.tokens / self.rate)
+            self.waited += wait
+        return wait
+
+    def delay(self):
+        """
+            不预约, 返回下一个令牌可用前需要等待的秒数
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return max(0, self.blocked_until - now) + max(0, (1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        with self.lock:
+            self.consecutive = 0
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttled += 1
+            self.consecutive += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            backoff = min(self.max_backoff, self.backoff * 2 ** (self.consecutive - 1))
+            backoff *= 0.5 + random.random()
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+            # 暂停期间不积累令牌
+            self.tokens = min(self.tokens, 0)
+        return backoff
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rate': round(self.rate, 4),
+                'base_rate': self.base_rate,
+                'tokens': round(self.tokens, 2),
+                'blocked_for': round(max(0, self.blocked_until - time.monotonic()), 2),
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'waited': round(self.waited, 2),
+            }
+
+
+class Rate_Limiter():
+    """
+        按账号(a1)限速, 每个账号有一个总的令牌桶, 每个账号的每个接口再各有一个令牌桶
+        请求需要同时拿到两个令牌桶的令牌, 被限流时两个令牌桶都会降速
+        :param rate: 每个账号每秒的请求数
+        :param burst: 每个账号允许的突发请求数
+        :param endpoint_rates: 每个接口每秒的请求数, 例如 {'/api/sns/web/v1/search/notes': 0.5}
+        :param endpoint_rate: 没有单独配置的接口每秒的请求数
+    """
+    def __init__(self, rate: float = 2, burst: int = 5, endpoint_rates: dict = None, endpoint_rate: float = 1, backoff: float = 5, max_backoff: float = 300):
+        self.rate = rate
+        self.burst = burst
+        self.endpoint_rates = endpoint_rates or {}
+        self.endpoint_rate = endpoint_rate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint(url: str):
+        return urllib.parse.urlparse(url).path
+
+    def get_bucket(self, a1: str, endpoint: str = None):
+        key = (a1, endpoint)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if endpoint is None:
+                    bucket = Token_Bucket(self.rate, self.burst, backoff=self.backoff, max_backoff=self.max_backoff)
+                else:
+                    rate = self.endpoint_rates.get(endpoint, self.endpoint_rate)
+                    bucket = Token_Bucket(rate, max(1, int(rate * 2)), backoff=self.backoff, max_backoff=self.max_backoff)
+                self.buckets[key] = bucket
+        return bucket
+
+    def acquire(self, a1: str, url: str):
+        """
+            等待直到账号和接口都可以发送请求
+        """
+        endpoint = self.get_endpoint(url)
+        wait = max(self.get_bucket(a1).reserve(), self.get_bucket(a1, endpoint).reserve())
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def delay(self, a1: str, url: str = None):
+        """
+            账号下一次可以发送请求前需要等待的秒数, 不占用令牌, 用于多账号调度
+        """
+        delay = self.get_bucket(a1).delay()
+        if url is not None:
+            delay = max(delay, self.get_bucket(a1, self.get_endpoint(url)).delay())
+        return delay
+
+    @staticmethod
+    def is_throttled(response):
+        if response.status_code in THROTTLE_STATUS:
+            return True
+        # 限流的响应体很短, 只检查短的 json 响应, 避免重复解析正常的数据
+        if 'json' not in response.headers.get('content-type', '') or len(response.content) > 2048:
+            return False
+        try:
+            res_json = json.loads(response.content)
+        except ValueError:
+            return False
+        if not isinstance(res_json, dict) or res_json.get('success', True):
+            return False
+        msg = str(res_json.get('msg') or '')
+        return res_json.get('code') in THROTTLE_CODES or any(keyword in msg for keyword in THROTTLE_KEYWORDS)
+
+    def observe(self, a1: str, url: str, response):
+        """
+            根据响应调整速度, 返回是否被限流
+        """
+        endpoint = self.get_endpoint(url)
+        buckets = [self.get_bucket(a1), self.get_bucket(a1, endpoint)]
+        if self.is_throttled(response):
+            backoff = max(bucket.on_throttle() for bucket in buckets)
+            metrics.inc('xhs_throttled_total', endpoint=endpoint)
+            logger.warning(f'账号 {a1} 请求 {endpoint} 被限流, 暂停 {backoff:.1f} 秒')
+            return True
+        for bucket in buckets:
+            bucket.on_success()
+        return False
+
+    def stats(self):
+        """
+            当前每个账号和接口的速度, 令牌, 暂停时间和被限流次数
+            返回 {a1: {'account': {...}, 'endpoints': {endpoint: {...}}}}
+        """
+        with self.lock:
+            buckets = list(self.buckets.items())
+        stats = {}
+        for (a1, endpoint), bucket in buckets:
+            account = stats.setdefault(a1, {'account': None, 'endpoints': {}})
+            if endpoint is None:
+                account['account'] = bucket.stats()
+            else:
+                account['endpoints'][endpoint] = bucket.stats()
+        return stats
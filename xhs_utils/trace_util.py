@@ -0,0 +1,290 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from loguru import logger
+
+"""
+    可选的耗时追踪, 记录签名、http 请求、解析 json、处理笔记、下载、保存 excel 等阶段的耗时
+    默认关闭, 设置环境变量 XHS_TRACE=1 或调用 tracer.enable() 开启, 关闭时 span 不做任何记录
+    Data_Spider 的每个任务结束时输出报告, 并可以导出为 Chrome trace 文件 (chrome://tracing 或 https://ui.perfetto.dev 打开)
+    span 记录所属的任务, 同时进行的多个任务的报告互不包含, 提交到线程池的函数需要用 tracer.bind 包装才会归属到当前任务
+"""
+
+# 当前的任务id, 嵌套的任务和 tracer.bind 提交到线程池的函数使用外层任务的id
+current_job = contextvars.ContextVar('trace_job', default=None)
+
+
+class Span():
+    """
+        一段耗时, with tracer.span('name', key=value) as span: ..., 可以在代码块中通过 span.args 补充信息
+    """
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.args)
+
+
+class _Null_Span():
+    """
+        追踪关闭时使用, 不记录任何内容
+    """
+    __slots__ = ('args',)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.args.clear()
+
+
+class Trace_Job():
+    """
+        一个任务期间的所有 span, 结束时生成报告, 嵌套的任务只在最外层生成报告
+        :param report_dir: 报告和 Chrome trace 的保存目录, 为 None 时只输出日志
+    """
+    def __init__(self, tracer, name, report_dir=None, args=None):
+        self.tracer = tracer
+        self.name = name
+        self.report_dir = report_dir
+        self.args = args or {}
+        self.report = None
+        self.outermost = False
+
+    def __enter__(self):
+        if not self.tracer.enabled or current_job.get() is not None:
+            return self
+        self.outermost = True
+        self.job_id, self.index = self.tracer.enter_job()
+        self.token = current_job.set(self.job_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.outermost:
+            return
+        end = time.perf_counter()
+        args = dict(self.args, error=exc_type.__name__) if exc_type is not None else self.args
+        try:
+            self.tracer.record(f'job:{self.name}', self.start, end, args)
+            spans = self.tracer.job_spans(self.job_id, self.index)
+            self.report = build_report(self.name, self.args, end - self.start, spans)
+            log_report(self.report)
+            if self.report_dir is not None:
+                os.makedirs(self.report_dir, exist_ok=True)
+                file_name = f"{self.name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+                with open(os.path.join(self.report_dir, file_name + '.json'), mode='w', encoding='utf-8') as f:
+                    json.dump(self.report, f, ensure_ascii=False, indent=2, default=str)
+                self.tracer.export_chrome_trace(os.path.join(self.report_dir, file_name + '.trace.json'), spans)
+        finally:
+            current_job.reset(self.token)
+            self.tracer.exit_job()
+
+
+class Tracer():
+    """
+        收集 span, 所有模块共用全局的 tracer
+        :param enabled: 是否开启, 默认读取环境变量 XHS_TRACE
+        :param max_spans: 最多保留的 span 数量, 超过后不再记录
+    """
+    def __init__(self, enabled: bool = None, max_spans: int = 1000000):
+        self.enabled = os.getenv('XHS_TRACE') == '1' if enabled is None else enabled
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+        self.active_jobs = 0
+        self.job_ids = itertools.count(1)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _Null_Span()
+        return Span(self, name, args)
+
+    def job(self, name, report_dir=None, **args):
+        return Trace_Job(self, name, report_dir, args)
+
+    def wrap(self, name, func, **args):
+        """
+            返回记录耗时的 func, 用于 response.json 等不方便改写调用处的函数
+        """
+        def traced(*func_args, **func_kwargs):
+            with Span(self, name, dict(args)):
+                return func(*func_args, **func_kwargs)
+        return traced
+
+    def bind(self, func):
+        """
+            返回在当前任务中执行的 func, 提交到线程池时使用, 例如 executor.submit(tracer.bind(func), *args)
+        """
+        if not self.enabled or current_job.get() is None:
+            return func
+        # 每次提交复制一次, 同一个 Context 不能同时在多个线程中执行
+        return functools.partial(contextvars.copy_context().run, func)
+
+    def record(self, name, start, end, args):
+        span = (name, start, end, threading.get_ident(), args, current_job.get())
+        with self.lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+    def job_spans(self, job_id, index=0):
+        """
+            任务的 span, index 为任务开始时的 span 数量
+        """
+        with self.lock:
+            return [span for span in self.spans[index:] if span[5] == job_id]
+
+    def enter_job(self):
+        """
+            返回 (任务id, 当前的 span 数量)
+        """
+        with self.lock:
+            self.active_jobs += 1
+            return next(self.job_ids), len(self.spans)
+
+    def exit_job(self):
+        with self.lock:
+            self.active_jobs -= 1
+            # 没有进行中的任务时清空, 避免长时间运行时占用内存
+            if self.active_jobs == 0:
+                self.spans.clear()
+
+    def export_chrome_trace(self, file_path, spans=None):
+        """
+            导出为 Chrome trace 格式, 每个线程一行
+        """
+        if spans is None:
+            with self.lock:
+                spans = list(self.spans)
+        events = []
+        for name, start, end, tid, args, job_id in spans:
+            events.append({
+                'name': name,
+                'cat': name.split(':')[0],
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 3),
+                'dur': round((end - start) * 1e6, 3),
+                'pid': self.pid,
+                'tid': tid,
+                'args': args,
+            })
+        with open(file_path, mode='w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+
+
+def build_report(name, args, seconds, spans, top: int = 10):
+    """
+        任务报告:
+            stages: 每个阶段的次数和耗时, share 为累计耗时占任务时间的比例, 并发执行时可能超过 1
+            slowest_notes: 耗时最长的笔记
+            slowest_endpoints: 平均耗时最长的接口
+            bytes: http 响应和媒体文件下载的字节数
+    """
+    stages = {}
+    endpoints = {}
+    notes = []
+    transferred = {'http': 0, 'download': 0}
+    errors = 0
+    for span_name, start, end, tid, span_args, job_id in spans:
+        duration = end - start
+        if span_name.startswith('job:'):
+            continue
+        stage = stages.setdefault(span_name, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+        stage['count'] += 1
+        stage['seconds'] += duration
+        stage['max'] = max(stage['max'], duration)
+        errors += 'error' in span_args
+        if span_name == 'http':
+            endpoint = endpoints.setdefault(span_args.get('endpoint'), {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            endpoint['count'] += 1
+            endpoint['seconds'] += duration
+            endpoint['max'] = max(endpoint['max'], duration)
+            transferred['http'] += span_args.get('bytes', 0)
+        elif span_name == 'download_media':
+            transferred['download'] += span_args.get('bytes', 0)
+        elif span_name == 'note':
+            notes.append({'note_id': span_args.get('note_id'), 'url': span_args.get('url'), 'seconds': round(duration, 4)})
+    for stage in stages.values():
+        stage['avg'] = round(stage['seconds'] / stage['count'], 4)
+        stage['share'] = round(stage['seconds'] / seconds, 4) if seconds > 0 else None
+        stage['seconds'] = round(stage['seconds'], 4)
+        stage['max'] = round(stage['max'], 4)
+    slowest_endpoints = []
+    for endpoint_name, endpoint in endpoints.items():
+        slowest_endpoints.append({
+            'endpoint': endpoint_name,
+            'count': endpoint['count'],
+            'seconds': round(endpoint['seconds'], 4),
+            'avg': round(endpoint['seconds'] / endpoint['count'], 4),
+            'max': round(endpoint['max'], 4),
+        })
+    return {
+        'job': name,
+        'args': args,
+        'seconds': round(seconds, 4),
+        'spans': len(spans),
+        'errors': errors,
+        'stages': dict(sorted(stages.items(), key=lambda item: -item[1]['seconds'])),
+        'slowest_notes': sorted(notes, key=lambda note: -note['seconds'])[:top],
+        'slowest_endpoints': sorted(slowest_endpoints, key=lambda endpoint: -endpoint['avg'])[:top],
+        'bytes': transferred,
+    }
+
+
+def log_report(report):
+    lines = [f"任务 {report['job']} 耗时 {report['seconds']}s, span {report['spans']} 个, 失败 {report['errors']} 个"]
+    for stage_name, stage in report['stages'].items():
+        lines.append(f"  阶段 {stage_name}: {stage['count']} 次, 累计 {stage['seconds']}s, 平均 {stage['avg']}s, 最长 {stage['max']}s, 占比 {stage['share']}")
+    for endpoint in report['slowest_endpoints'][:5]:
+        lines.append(f"  接口 {endpoint['endpoint']}: {endpoint['count']} 次, 平均 {endpoint['avg']}s, 最长 {endpoint['max']}s")
+    for note in report['slowest_notes'][:5]:
+        lines.append(f"  笔记 {note['note_id']}: {note['seconds']}s")
+    lines.append(f"  http 响应 {report['bytes']['http'] / 1024 / 1024:.2f} MB, 媒体下载 {report['bytes']['download'] / 1024 / 1024:.2f} MB")
+    logger.info('\n'.join(lines))
+
+
+tracer = Tracer()
+
+
+def trace_job(name):
+    """
+        把 Data_Spider 的方法作为一个任务追踪, 报告保存到 self.trace_dir
+        第一个参数记录在报告中, 为列表时记录数量
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            job_args = {}
+            if args and isinstance(args[0], str):
+                job_args['target'] = args[0]
+            elif args and isinstance(args[0], list):
+                job_args['count'] = len(args[0])
+            with tracer.job(name, getattr(self, 'trace_dir', None), **job_args):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
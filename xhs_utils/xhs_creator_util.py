@@ -1,11 +1,8 @@
 import json
+import os
+from xhs_utils.js_pool_util import Js_Worker_Pool, STATIC_PATH
 
-import execjs
-
-try:
-    js = execjs.compile(open(r'../static/xhs_creator_xs.js', 'r', encoding='utf-8').read())
-except:
-    js = execjs.compile(open(r'static/xhs_creator_xs.js', 'r', encoding='utf-8').read())
+js = Js_Worker_Pool(os.path.join(STATIC_PATH, 'xhs_creator_xs.js'))
 
 
 def generate_xs(a1, api, data=''):
@@ -0,0 +1,63 @@
+import base64
+import json
+import zlib
+
+"""
+    static/xhs_xs_xsc_56.js 中 XsCommon 的 python 实现, 只负责 x-s-common
+    x-s 的核心 window._webmsxyw 是依赖浏览器环境的虚拟机, 没有移植, 仍然由 js 进程计算
+"""
+
+STANDARD_B64_TABLE = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+XHS_B64_TABLE = 'ZmserbBoHQtNP+wOcza/LpngG8yJq42KWYj0DSfdikx3VT16IlUAFM97hECvuRX5'
+B64_TRANS = str.maketrans(STANDARD_B64_TABLE, XHS_B64_TABLE)
+MCR_XOR = 3988292384
+XS_COMMON_FP = "I38rHdgsjopgIvesdVwgIC+oIELmBZ5e3VwXLgFTIxS3bqwErFeexd0ekncAzMFYnqthIhJeSfMDKutRI3KsYorWHPtGrbV0P9WfIi/eWc6eYqtyQApPI37ekmR1QL+5Ii6sdnoeSfqYHqwl2qt5B0DoIx+PGDi/sVtkIxdeTqwGtuwWIEhBIE3s3Mi3ICLdI3Oe0Vtl2ADmsLveDSJsSPw5IEvsiVtJOqw8BVwfPpdeTFWOIx4TIiu6ZPwbPut5IvlaLbgs3qtxIxes1VwHIkumIkIyejgsY/WTge7eSqte/D7sDcpipBKefm4sIx/efutZIE0ejutImcLj8fPHIx5e3ut3gIoe19kKIESPIhhgHgGUI38P4m+oIhLu/uwMI3qV2d3ejIgs6PwRIvge0fvejAR2IideTbVUqqwkIkOs196s6Y3eiVwopa/eDuwFICFeoBKsWqt1msoeYqtoIvIQIvm5muwGmPwJoei4KWKed77eiPwcIioejAAeVMDYIiNsWMvs3nV7Ikge1Vt6IkiIPqwwNqtUI3OeiVtdIkKsVqwVIENsDqtXNPwnsuwFIvGUI3HgGBIW2IveiPtMIhPKIi0eSPw4eY4KLa6sYjYdIirw4VtOZuw5ICKe3qtd+L/eTlJs1rSwIhOs3oNs3qts/VwqI3Ae0PwAIkge6sR+Ixds0UgsSPtRIh/eSPwUH0PwIiLpI33sxMgeka/ejFdsYPtQIiFFI3EYmutcICEIIEgs3SFSNsOsWutsIEbQmqtWGIKsjMveYPwrsPwZIvEDIhh+LuwtyPtbIC7eWMAs6Vt2ZVwHIiHQLPw5IvG4L9MgIEJe0L/sY9Ne3VwsHVt4I3HyIx0s6PtRIEKe0WPAI3bebW42ICSKIv0e1VwvbVww4VwFICb3IkJexfgskutTmI8lIC4LqPtseuteIxGiIibyIiT3IE/ekSKe3WLItuwKICLEpPwQrVwVIh6sT/lvIEm3sUNs0VwdcqwmzLYKr/DXIiMlaVwtIkdsDWY/IiTHrPwYIhZO2utfbPtwIEDIIClMICk/zVtjIE4OIiee6VtFLbV1IkbNI3gedo5ekPwkICYkIEPAnjHdIvpf/Wq9IxgedYoeSuwZIENsiVtQIEZ8IC3s0PtwIxIpzPtYI3ve1FTnouw6GuwQIx0eSPwwIEJsSDzSIEJsDoAsTVtrtsvsSuwOcm7e6utrIx/sxYJe3PtaIEq0Ikq2autQyMFnIv5sjVtap7Ks1LFEsuwNIxRPIivsdYYrIiAeDPtrIvHyIEgeWZFdIkHLIico8M8nICJeYWYFIkWMIvb9I3oeSdWLJuwzbuwynmgsdF5sfqtYIv6ejbNejqwzZVtNI3QPnqw0outHHqtUGqwEtVtWt06s6z5ei9/skl6e6uwqIiPGIhT6I3QFI3OsiBgsT7hUHVtGIEMEmut4P03ekPt8ICAsfZOefezZIvAsSqwmPpmxI36sfPt6IvesVuw7HqtyI3JefdDzOutZbc7ejph="
+
+
+def encode_utf8(text):
+    # encrypt_encodeUtf8: encodeURIComponent 之后把 %XX 还原为字节, 等价于 utf-8 编码
+    return text.encode('utf-8')
+
+
+def b64_encode(data: bytes):
+    # encrypt_b64Encode: 使用自定义码表的 base64
+    return base64.b64encode(data).decode('ascii').translate(B64_TRANS)
+
+
+def to_int32(n):
+    n &= 0xFFFFFFFF
+    return n - 0x100000000 if n & 0x80000000 else n
+
+
+def mcr(text):
+    """
+        encrypt_mcr: 标准 crc32 的结果再异或 0xEDB88320, 按 js 的 32 位有符号整数返回
+        js 中按 charCodeAt 逐个字符计算, 这里要求输入为单字节字符
+    """
+    return to_int32(zlib.crc32(text.encode('latin-1')) ^ MCR_XOR)
+
+
+def xs_common(a1, xs, xt):
+    """
+        XsCommon: 生成 x-s-common
+        :param a1: cookies 中的 a1
+        :param xs: x-s
+        :param xt: x-t 毫秒时间戳
+    """
+    d = {
+        "s0": 5,
+        "s1": "",
+        "x0": "1",
+        "x1": "3.8.7",
+        "x2": "Windows",
+        "x3": "xhs-pc-web",
+        "x4": "4.45.1",
+        "x5": a1,
+        "x6": xt,
+        "x7": xs,
+        "x8": XS_COMMON_FP,
+        "x9": mcr(str(xt) + xs + XS_COMMON_FP),
+        "x10": 11,
+    }
+    data_str = json.dumps(d, separators=(',', ':'), ensure_ascii=False)
+    return b64_encode(encode_utf8(data_str))
@@ -1,18 +1,19 @@
 import json
 import math
+import os
 import random
-import execjs
+import threading
+import time
 from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.js_pool_util import Js_Worker_Pool, STATIC_PATH
+from xhs_utils.xhs_sign_util import xs_common
+from xhs_utils.metrics_util import metrics
+from xhs_utils.trace_util import tracer
 
-try:
-    js = execjs.compile(open(r'../static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
-except:
-    js = execjs.compile(open(r'static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
-
-try:
-    xray_js = execjs.compile(open(r'../static/xhs_xray.js', 'r', encoding='utf-8').read())
-except:
-    xray_js = execjs.compile(open(r'static/xhs_xray.js', 'r', encoding='utf-8').read())
+# 常驻的 node 进程池, 避免每次签名都重新启动 node 并加载 js
+js = Js_Worker_Pool(os.path.join(STATIC_PATH, 'xhs_xs_xsc_56.js'))
+xray_js = Js_Worker_Pool(os.path.join(STATIC_PATH, 'xhs_xray.js'))
+metrics.register_gauge('xhs_queue_depth', lambda: js.load, queue='sign')
 
 def generate_x_b3_traceid(len=16):
     x_b3_traceid = ""
@@ -20,18 +21,84 @@ def generate_x_b3_traceid(len=16):
         x_b3_traceid += "abcdef0123456789"[math.floor(16 * random.random())]
     return x_b3_traceid
 
+def use_py_xs_common():
+    # 设置环境变量 XHS_XS_COMMON_BACKEND=py 时 x-s-common 由 python 计算, x-s 仍然由 js 计算, 不能去掉 node
+    # XHS_SIGN_BACKEND 为以前的名称, 仍然兼容
+    return os.getenv('XHS_XS_COMMON_BACKEND', os.getenv('XHS_SIGN_BACKEND')) == 'py'
+
 def generate_xs_xs_common(a1, api, data=''):
-    ret = js.call('get_request_headers_params', api, data, a1)
-    xs, xt, xs_common = ret['xs'], ret['xt'], ret['xs_common']
-    return xs, xt, xs_common
+    if use_py_xs_common():
+        with metrics.timer('xhs_sign_seconds', backend='js_py'):
+            xs, xt = generate_xs(a1, api, data)
+            return xs, xt, xs_common(a1, xs, xt)
+    with metrics.timer('xhs_sign_seconds', backend='js'):
+        ret = js.call('get_request_headers_params', api, data, a1)
+    xs, xt, xs_common_str = ret['xs'], ret['xt'], ret['xs_common']
+    return xs, xt, xs_common_str
+
+def sign_batch(items):
+    """
+        批量签名, 所有请求在一次 js 调用中完成
+        :param items: [(api, data, a1), ...]
+        返回 [(xs, xt, xs_common), ...], 顺序与 items 一致, 签名失败的项为异常, 不影响其他项
+    """
+    if use_py_xs_common():
+        with metrics.timer('xhs_sign_batch_seconds', backend='js_py'):
+            rets = js.call_batch('get_xs', [(api, data, a1) for api, data, a1 in items])
+            signs = []
+            for (api, data, a1), ret in zip(items, rets):
+                try:
+                    signs.append(ret if isinstance(ret, Exception) else (ret['X-s'], ret['X-t'], xs_common(a1, ret['X-s'], ret['X-t'])))
+                except Exception as e:
+                    signs.append(e)
+            return signs
+    with metrics.timer('xhs_sign_batch_seconds', backend='js'):
+        rets = js.call_batch('get_request_headers_params', [(api, data, a1) for api, data, a1 in items])
+    return [ret if isinstance(ret, Exception) else (ret['xs'], ret['xt'], ret['xs_common']) for ret in rets]
 
 def generate_xs(a1, api, data=''):
     ret = js.call('get_xs', api, data, a1)
     xs, xt = ret['X-s'], ret['X-t']
     return xs, xt
 
-def generate_xray_traceid():
-    return xray_js.call('traceId')
+# static/xhs_xray.js 中 Int.seq 的计数器, 初始值为 23 位随机数
+XRAY_MAX_SEQ = 2 ** 23 - 1
+xray_seq = random.randint(0, XRAY_MAX_SEQ)
+xray_seq_lock = threading.Lock()
+
+def next_xray_seq():
+    global xray_seq
+    with xray_seq_lock:
+        if xray_seq > XRAY_MAX_SEQ:
+            xray_seq = 0
+        seq = xray_seq
+        xray_seq += 1
+    return seq
+
+def generate_xray_traceid_py(timestamp=None, seq=None, rand=None):
+    """
+        static/xhs_xray.js 中 traceId 的 python 实现
+        前 16 位为 (毫秒时间戳 << 23 | 自增序号) 的 64 位十六进制, 后 16 位为 64 位随机数
+        :param timestamp: 毫秒时间戳, 默认当前时间
+        :param seq: 自增序号, 默认使用全局计数器
+        :param rand: 64 位随机数, 默认随机生成
+    """
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    if seq is None:
+        seq = next_xray_seq()
+    if rand is None:
+        rand = random.getrandbits(64)
+    head = ((int(timestamp) << 23) | seq) & 0xFFFFFFFFFFFFFFFF
+    return '%016x%016x' % (head, rand)
+
+def generate_xray_traceid(timestamp=None):
+    # 设置环境变量 XHS_XRAY_BACKEND=js 时使用原始的 js 实现
+    if os.getenv('XHS_XRAY_BACKEND') == 'js':
+        if timestamp is None:
+            return xray_js.call('traceId')
+        return xray_js.call('traceId', timestamp)
+    return generate_xray_traceid_py(timestamp)
 def get_common_headers():
     return {
         "authority": "www.xiaohongshu.com",
@@ -75,8 +142,10 @@ def get_request_headers_template():
         "x-xray-traceid": generate_xray_traceid()
     }
 
-def generate_headers(a1, api, data=''):
-    xs, xt, xs_common = generate_xs_xs_common(a1, api, data)
+def generate_headers(a1, api, data='', sign=None):
+    if sign is None:
+        sign = generate_xs_xs_common(a1, api, data)
+    xs, xt, xs_common = sign
     x_b3_traceid = generate_x_b3_traceid()
     headers = get_request_headers_template()
     headers['x-s'] = xs
@@ -88,10 +157,30 @@ def generate_headers(a1, api, data=''):
     return headers, data
 
 def generate_request_params(cookies_str, api, data=''):
-    cookies = trans_cookies(cookies_str)
-    a1 = cookies['a1']
-    headers, data = generate_headers(a1, api, data)
-    return headers, cookies, data
+    with tracer.span('generate_request_params', api=api.split('?')[0]):
+        cookies = trans_cookies(cookies_str)
+        a1 = cookies['a1']
+        headers, data = generate_headers(a1, api, data)
+        return headers, cookies, data
+
+def generate_request_params_batch(cookies_str, items):
+    """
+        批量生成请求参数, 签名通过 sign_batch 一次完成
+        :param items: [(api, data), ...]
+        返回 [(headers, cookies, data), ...], 签名失败的项为异常
+    """
+    with tracer.span('generate_request_params_batch', count=len(items)):
+        cookies = trans_cookies(cookies_str)
+        a1 = cookies['a1']
+        signs = sign_batch([(api, data, a1) for api, data in items])
+        params = []
+        for (api, data), sign in zip(items, signs):
+            if isinstance(sign, Exception):
+                params.append(sign)
+                continue
+            headers, data = generate_headers(a1, api, data, sign)
+            params.append((headers, cookies, data))
+        return params
 
 def splice_str(api, params):
     url = api + '?'